@@ -1,13 +1,14 @@
 import logging
 import boto3
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 import psycopg2
 
 from langchain_aws import BedrockEmbeddings
 from langchain_postgres import PGVector
 from langchain_classic.indexes import SQLRecordManager
 
-from processing.documents import process_documents
+from processing.documents import process_documents, process_document, remove_document
+from helpers.indexes import ensure_embedding_dimension, rebuild_collection_index
 s3 = boto3.client('s3')
 
 # Setup logging
@@ -63,8 +64,9 @@ def store_module_data(
     course: str, 
     module: str,
     vectorstore_config_dict: Dict[str, str], 
-    embeddings: BedrockEmbeddings
-) -> None:
+    embeddings: BedrockEmbeddings,
+    files: Optional[Dict[str, bool]] = None
+) -> List[str]:
     """
     Store course data from an S3 bucket into the vectorstore.
     
@@ -74,6 +76,11 @@ def store_module_data(
     module (str): The moudle name/folder in the S3 bucket.
     vectorstore_config_dict (Dict[str, str]): The configuration dictionary for the vectorstore.
     embeddings (BedrockEmbeddings): The embeddings instance.
+    files (Optional[Dict[str, bool]]): The documents that changed, mapped to whether they were deleted.
+        If None, the whole module is rebuilt.
+
+    Returns:
+    List[str]: The changed documents that could not be processed.
     """
     vectorstore, connection_string = get_vectorstore(
         collection_name=vectorstore_config_dict['collection_name'],
@@ -95,14 +102,56 @@ def store_module_data(
 
     if not vectorstore:
         logger.error("VectorStore could not be initialized")
-        return
+        raise RuntimeError("VectorStore could not be initialized")
 
-    # Process all files in the "documents" folder
-    process_documents(
-        bucket=bucket,
-        course=course,
-        module=module,
-        vectorstore=vectorstore,
-        embeddings=embeddings,
-        record_manager=record_manager
-    )
+    # The first load into an empty table fixes the column's dimension, which ANN indexes need
+    ensure_embedding_dimension(connection_string, embeddings)
+
+    failed = []
+
+    if files is None:
+        # Process all files in the "documents" folder
+        process_documents(
+            bucket=bucket,
+            course=course,
+            module=module,
+            vectorstore=vectorstore,
+            embeddings=embeddings,
+            record_manager=record_manager
+        )
+
+    for filename, removed in (files or {}).items():
+        try:
+            if removed:
+                remove_document(
+                    course=course,
+                    module=module,
+                    filename=filename,
+                    vectorstore=vectorstore,
+                    record_manager=record_manager
+                )
+            else:
+                process_document(
+                    bucket=bucket,
+                    course=course,
+                    module=module,
+                    filename=filename,
+                    vectorstore=vectorstore,
+                    embeddings=embeddings,
+                    record_manager=record_manager
+                )
+        except Exception as e:
+            logger.error(f"Error updating vectorstore for {filename} in module {module}: {e}")
+            failed.append(filename)
+
+    # Refresh the collection's ANN index, rebuilding it only after a full load
+    try:
+        rebuild_collection_index(
+            connection_string=connection_string,
+            collection_name=vectorstore_config_dict['collection_name'],
+            rebuild=files is None
+        )
+    except Exception as e:
+        logger.error(f"Error rebuilding vector index for {vectorstore_config_dict['collection_name']}: {e}")
+
+    return failed
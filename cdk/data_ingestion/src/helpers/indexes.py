@@ -0,0 +1,192 @@
+import os
+import logging
+from typing import Optional
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import NullPool
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# "hnsw" or "ivfflat". HNSW is maintained on insert; IVFFlat centroids go stale
+# after bulk loads, so IVFFlat indexes are always rebuilt after ingestion.
+VECTOR_INDEX_METHOD = os.environ.get("VECTOR_INDEX_METHOD", "hnsw").lower()
+VECTOR_INDEX_MIN_ROWS = int(os.environ.get("VECTOR_INDEX_MIN_ROWS", "500"))
+HNSW_M = int(os.environ.get("HNSW_M", "16"))
+HNSW_EF_CONSTRUCTION = int(os.environ.get("HNSW_EF_CONSTRUCTION", "64"))
+
+EMBEDDING_TABLE = "langchain_pg_embedding"
+COLLECTION_TABLE = "langchain_pg_collection"
+
+def get_index_name(method: str, collection_id: str) -> str:
+    """
+    Build the name of the partial ANN index for a collection.
+
+    Args:
+    method (str): The index method, either "hnsw" or "ivfflat".
+    collection_id (str): The UUID of the collection in langchain_pg_collection.
+
+    Returns:
+    str: The index name, short enough for the 63 character identifier limit.
+    """
+    return f"ix_lpe_{method}_{collection_id.replace('-', '')}"
+
+def get_embedding_dimension(conn, warn: bool = True) -> Optional[int]:
+    """
+    Return the fixed dimension of the embedding column, which ANN indexes require.
+
+    The column is typed by the db_setup migration 005_typed_embedding_column, or by
+    ensure_embedding_dimension while the table is empty; it is never altered once it
+    holds embeddings, since that would lock the table every module's retrieval reads.
+
+    Args:
+    conn: A SQLAlchemy connection.
+    warn (bool, optional): Whether to log a warning if the column is untyped. Defaults to True.
+
+    Returns:
+    Optional[int]: The embedding dimension, or None if the column is untyped.
+    """
+    column_type = conn.execute(text(f"""
+        SELECT format_type(atttypid, atttypmod)
+        FROM pg_attribute
+        WHERE attrelid = '{EMBEDDING_TABLE}'::regclass AND attname = 'embedding';
+    """)).scalar()
+
+    if column_type and column_type.startswith("vector("):
+        return int(column_type[len("vector("):-1])
+
+    if warn:
+        logger.warning(f"{EMBEDDING_TABLE}.embedding is {column_type}, not a fixed-dimension vector; run the database migrations to type it.")
+    return None
+
+def ensure_embedding_dimension(connection_string: str, embeddings) -> Optional[int]:
+    """
+    Type the embedding column with the embedding model's dimension while the table is empty.
+
+    The model is configured at runtime, so the migration cannot know its dimension and
+    leaves a column without embeddings untyped. Altering an empty table is instant, and
+    no retrieval reads it yet; a column that already holds embeddings is left alone.
+
+    Args:
+    connection_string (str): The SQLAlchemy connection string for the vectorstore database.
+    embeddings: The embeddings instance the documents will be embedded with.
+
+    Returns:
+    Optional[int]: The dimension of the column afterwards, or None if it is untyped.
+    """
+    engine = create_engine(connection_string, poolclass=NullPool)
+    try:
+        with engine.begin() as conn:
+            is_empty = conn.execute(text(f"SELECT NOT EXISTS (SELECT 1 FROM {EMBEDDING_TABLE});")).scalar()
+            dimension = get_embedding_dimension(conn, warn=not is_empty)
+            if not is_empty:
+                return dimension
+
+            model_dimension = len(embeddings.embed_query("embedding dimension"))
+            if model_dimension == dimension:
+                return dimension
+
+            logger.info(f"Typing {EMBEDDING_TABLE}.embedding as vector({model_dimension}) (was {dimension or 'untyped'}).")
+            # Fail fast instead of queueing behind a long-running reader
+            conn.execute(text("SET LOCAL lock_timeout = '5s';"))
+            conn.execute(text(f"ALTER TABLE {EMBEDDING_TABLE} ALTER COLUMN embedding TYPE vector({model_dimension});"))
+            return model_dimension
+    finally:
+        engine.dispose()
+
+def rebuild_collection_index(
+    connection_string: str,
+    collection_name: str,
+    method: str = VECTOR_INDEX_METHOD,
+    rebuild: bool = True
+) -> None:
+    """
+    Create or refresh the partial ANN index for one collection.
+
+    Each module has its own collection, and retrieval always filters on
+    collection_id, so the index is partial on that collection. This keeps each
+    index small and lets the planner use it instead of a sequential scan over
+    every module's embeddings.
+
+    Args:
+    connection_string (str): The SQLAlchemy connection string for the vectorstore database.
+    collection_name (str): The name of the collection (the module ID).
+    method (str, optional): "hnsw" or "ivfflat". Defaults to VECTOR_INDEX_METHOD.
+    rebuild (bool, optional): Whether an existing index should be rebuilt, e.g. after bulk ingestion. Defaults to True.
+    """
+    if method not in ("hnsw", "ivfflat"):
+        raise ValueError(f"Unsupported vector index method: {method}")
+
+    # CREATE/REINDEX ... CONCURRENTLY cannot run inside a transaction block
+    engine = create_engine(connection_string, isolation_level="AUTOCOMMIT", poolclass=NullPool)
+
+    try:
+        with engine.connect() as conn:
+            collection_id = conn.execute(
+                text(f"SELECT uuid FROM {COLLECTION_TABLE} WHERE name = :name;"),
+                {"name": collection_name}
+            ).scalar()
+
+            if collection_id is None:
+                logger.info(f"Collection {collection_name} does not exist, skipping index build.")
+                return
+            collection_id = str(collection_id)
+
+            row_count = conn.execute(
+                text(f"SELECT count(*) FROM {EMBEDDING_TABLE} WHERE collection_id = :collection_id;"),
+                {"collection_id": collection_id}
+            ).scalar()
+
+            index_name = get_index_name(method, collection_id)
+            other_index_name = get_index_name("ivfflat" if method == "hnsw" else "hnsw", collection_id)
+            conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{other_index_name}";'))
+
+            if row_count < VECTOR_INDEX_MIN_ROWS:
+                # A sequential scan over a handful of chunks beats any ANN index
+                logger.info(f"Collection {collection_name} has {row_count} rows, dropping/skipping ANN index.")
+                conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{index_name}";'))
+                return
+
+            if get_embedding_dimension(conn) is None:
+                return
+
+            index_state = conn.execute(text("""
+                SELECT i.indisvalid
+                FROM pg_index i
+                JOIN pg_class c ON c.oid = i.indexrelid
+                WHERE c.relname = :index_name;
+            """), {"index_name": index_name}).scalar()
+
+            # A failed concurrent build leaves an invalid index behind
+            if index_state is False or (index_state is not None and rebuild and method == "ivfflat"):
+                conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{index_name}";'))
+                index_state = None
+
+            if index_state is None:
+                if method == "hnsw":
+                    using = (
+                        f"hnsw (embedding vector_cosine_ops) "
+                        f"WITH (m = {HNSW_M}, ef_construction = {HNSW_EF_CONSTRUCTION})"
+                    )
+                else:
+                    # pgvector guidance: rows / 1000 lists up to 1M rows, sqrt(rows) above that
+                    lists = max(1, row_count // 1000 if row_count <= 1_000_000 else int(row_count ** 0.5))
+                    using = f"ivfflat (embedding vector_cosine_ops) WITH (lists = {lists})"
+
+                logger.info(f"Creating {method} index {index_name} for collection {collection_name} ({row_count} rows)")
+                conn.execute(text(f"""
+                    CREATE INDEX CONCURRENTLY IF NOT EXISTS "{index_name}"
+                    ON {EMBEDDING_TABLE} USING {using}
+                    WHERE collection_id = '{collection_id}';
+                """))
+            elif rebuild:
+                logger.info(f"Rebuilding {method} index {index_name} for collection {collection_name} ({row_count} rows)")
+                conn.execute(text(f'REINDEX INDEX CONCURRENTLY "{index_name}";'))
+            else:
+                return
+
+            # Refresh planner statistics only when an index was just built
+            conn.execute(text(f"ANALYZE {EMBEDDING_TABLE};"))
+    finally:
+        engine.dispose()
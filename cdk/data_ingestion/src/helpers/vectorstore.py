@@ -1,4 +1,4 @@
-from typing import Dict
+from typing import Dict, List, Optional
 
 from helpers.helper import store_module_data
 
@@ -7,8 +7,9 @@ def update_vectorstore(
     course: str,
     module: str,
     vectorstore_config_dict: Dict[str, str],
-    embeddings#: BedrockEmbeddings
-) -> None:
+    embeddings,#: BedrockEmbeddings
+    files: Optional[Dict[str, bool]] = None
+) -> List[str]:
     """
     Update the vectorstore with embeddings for all documents and images in the S3 bucket.
 
@@ -18,14 +19,16 @@ def update_vectorstore(
     module (str): The name of the module folder within the S3 bucket.
     vectorstore_config_dict (Dict[str, str]): The configuration dictionary for the vectorstore, including parameters like collection name, database name, user, password, host, and port.
     embeddings (BedrockEmbeddings): The embeddings instance used to process the documents and images.
+    files (Optional[Dict[str, bool]]): The documents that changed, mapped to whether they were deleted. If None, every document in the module is re-processed.
 
     Returns:
-    None
+    List[str]: The changed documents that could not be processed.
     """
-    store_module_data(
+    return store_module_data(
         bucket=bucket,
         course=course,
         module=module,
         vectorstore_config_dict=vectorstore_config_dict,
-        embeddings=embeddings
+        embeddings=embeddings,
+        files=files
     )
\ No newline at end of file
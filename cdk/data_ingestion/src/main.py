@@ -2,11 +2,14 @@ import os
 import json
 import boto3
 from datetime import datetime, timezone
+from urllib.parse import unquote_plus
 import logging
 import psycopg2
 from langchain_aws import BedrockEmbeddings
 
 from helpers.vectorstore import update_vectorstore
+from processing.cache import get_cached_embeddings
+from processing.embeddings import BatchedEmbeddings
 
 # Set up basic logging
 logging.basicConfig(level=logging.INFO)
@@ -59,10 +62,18 @@ def get_parameter():
 def get_embeddings():
     global _embeddings
     if _embeddings is None:
-        _embeddings = BedrockEmbeddings(
-            model_id=get_parameter(),
-            client=bedrock_runtime,
-            region_name=REGION
+        # The deduplicating dispatcher and its in-memory memo come first, so repeated
+        # texts never reach the cache; the document cache is in memory as well, and
+        # only its misses are sent to Bedrock, in concurrent batches
+        _embeddings = BatchedEmbeddings(
+            get_cached_embeddings(
+                BedrockEmbeddings(
+                    model_id=get_parameter(),
+                    client=bedrock_runtime,
+                    region_name=REGION
+                ),
+                model_id=get_parameter()
+            )
         )
     return _embeddings
 
@@ -172,7 +183,32 @@ def insert_file_into_db(module_id, file_name, file_type, file_path, bucket_name)
         logger.error(f"Error inserting file {file_name}.{file_type} into database: {e}")
         raise
 
-def update_vectorstore_from_s3(bucket, course_id, module_id):
+def clear_module_openers(module_id):
+    """
+    Drop the pre-generated opening turns of a module so they are regenerated from its new files.
+    """
+    connection = connect_to_db()
+    if connection is None:
+        logger.error("No database connection available.")
+        return
+
+    cur = None
+    try:
+        cur = connection.cursor()
+        cur.execute("""
+            DELETE FROM "Module_Openers"
+            WHERE module_id = %s;
+        """, (module_id,))
+        connection.commit()
+        cur.close()
+        logger.info(f"Cleared the opener pool of module {module_id}.")
+    except Exception as e:
+        if cur:
+            cur.close()
+        connection.rollback()
+        logger.error(f"Error clearing the opener pool of module {module_id}: {e}")
+
+def update_vectorstore_from_s3(bucket, course_id, module_id, files=None):
 
     embeddings = get_embeddings()
 
@@ -188,43 +224,105 @@ def update_vectorstore_from_s3(bucket, course_id, module_id):
     }
 
     try:
-        update_vectorstore(
+        failed = update_vectorstore(
             bucket=bucket,
             course=course_id,
             module=module_id,
             vectorstore_config_dict=vectorstore_config_dict,
-            embeddings=embeddings
+            embeddings=embeddings,
+            files=files
         )
     except Exception as e:
         logger.error(f"Error updating vectorstore for module {module_id} in course {course_id}: {e}")
         raise
 
+    # Openers were generated with the old documents as context
+    clear_module_openers(module_id)
+
+    return failed
+
+def get_s3_records(event):
+    """
+    Flatten an invocation into (message ID, S3 record) pairs.
+
+    S3 notifications arrive either directly or wrapped in SQS messages, and each
+    notification may carry several records.
+    """
+    s3_records = []
+    for record in event.get('Records', []):
+        if 's3' in record:
+            s3_records.append((None, record))
+        elif 'body' in record:
+            message_id = record.get('messageId')
+            try:
+                body = json.loads(record['body'])
+            except (TypeError, ValueError) as e:
+                logger.error(f"Error parsing SQS message {message_id}: {e}")
+                s3_records.append((message_id, None))
+                continue
+            # S3 sends an s3:TestEvent without records when a notification is configured
+            for s3_record in body.get('Records', []):
+                s3_records.append((message_id, s3_record))
+    return s3_records
+
 def handler(event, context):
-    records = event.get('Records', [])
-    if not records:
+    # Direct invocation to rebuild a whole module, e.g. {"action": "reindex", "course_id": ..., "module_id": ...}
+    if event.get("action") == "reindex":
+        course_id = event.get("course_id")
+        module_id = event.get("module_id")
+        if not course_id or not module_id:
+            return {
+                "statusCode": 400,
+                "body": json.dumps("Missing required parameters: course_id or module_id")
+            }
+        try:
+            update_vectorstore_from_s3(AILA_DATA_INGESTION_BUCKET, course_id, module_id)
+            logger.info(f"Vectorstore rebuilt for module {module_id} in course {course_id}.")
+        except Exception as e:
+            logger.error(f"Error rebuilding vectorstore for module {module_id}: {e}")
+            return {
+                "statusCode": 500,
+                "body": json.dumps(f"Error rebuilding vectorstore: {e}")
+            }
+        return {
+            "statusCode": 200,
+            "body": json.dumps(f"Vectorstore rebuilt for module {module_id}.")
+        }
+
+    s3_records = get_s3_records(event)
+    if not s3_records:
         return {
             "statusCode": 400,
             "body": json.dumps("No valid S3 event found.")
         }
 
-    for record in records:
+    results = []  # one entry per S3 record, in event order
+    modules = {}  # (course_id, module_id) -> {"files": {filename: removed}, "results": [...]}
+
+    for message_id, record in s3_records:
+        if record is None:
+            results.append({"messageId": message_id, "status": "failed", "error": "Invalid SQS message body."})
+            continue
+
         event_name = record['eventName']
         bucket_name = record['s3']['bucket']['name']
+        # Keys in S3 notifications are URL encoded (e.g. spaces become '+')
+        file_key = unquote_plus(record['s3']['object']['key'])
+        result = {"messageId": message_id, "location": f"s3://{bucket_name}/{file_key}"}
+        results.append(result)
 
         # Only process files from the AILA_DATA_INGESTION_BUCKET
         if bucket_name != AILA_DATA_INGESTION_BUCKET:
             print(f"Ignoring event from non-target bucket: {bucket_name}")
-            continue  # Ignore this event and move to the next one
-        file_key = record['s3']['object']['key']
+            result["status"] = "ignored"
+            continue
 
-        # if event_name.startswith('ObjectCreated:'):
         # Parse the file path
-        course_id, module_id, file_category, file_name, file_type = parse_s3_file_path(file_key)
-        if not course_id or not module_id or not file_name or not file_type:
-            return {
-                "statusCode": 400,
-                "body": json.dumps("Error parsing S3 file path.")
-            }
+        try:
+            course_id, module_id, file_category, file_name, file_type = parse_s3_file_path(file_key)
+        except ValueError as e:
+            result.update(status="failed", error=str(e))
+            continue
 
         if event_name.startswith('ObjectCreated:'):
             # Insert the file into the PostgreSQL database
@@ -239,33 +337,52 @@ def handler(event, context):
                 logger.info(f"File {file_name}.{file_type} inserted successfully.")
             except Exception as e:
                 logger.error(f"Error inserting file {file_name}.{file_type} into database: {e}")
-                return {
-                    "statusCode": 500,
-                    "body": json.dumps(f"Error inserting file {file_name}.{file_type}: {e}")
-                }
+                result.update(status="failed", error=f"Error inserting file {file_name}.{file_type}: {e}")
+                continue
         else:
             logger.info(f"File {file_name}.{file_type} is being deleted. Deleting files from database does not occur here.")
-        
-        # Update embeddings for course after the file is successfully inserted into the database
+
+        # Coalesce the changes per module; the last event for a file decides whether it is indexed or removed
+        filename = f"{file_name}.{file_type}"
+        module = modules.setdefault((course_id, module_id), {"files": {}, "results": []})
+        module["files"].pop(filename, None)
+        module["files"][filename] = event_name.startswith('ObjectRemoved:')
+        result["filename"] = filename
+        module["results"].append(result)
+
+    # Update embeddings once per affected module
+    for (course_id, module_id), module in modules.items():
         try:
-            update_vectorstore_from_s3(bucket_name, course_id, module_id)
-            logger.info(f"Vectorstore updated successfully for module {module_id} in course {course_id}.")
+            failed = set(update_vectorstore_from_s3(
+                AILA_DATA_INGESTION_BUCKET,
+                course_id,
+                module_id,
+                files=module["files"]
+            ))
+            logger.info(f"Vectorstore updated for module {module_id} in course {course_id}, {len(failed)} files failed.")
         except Exception as e:
-            logger.error(f"Error updating vectorstore for course {course_id}: {e}")
-            return {
-                "statusCode": 500,
-                "body": json.dumps(f"File inserted, but error updating vectorstore: {e}")
-            }
+            logger.error(f"Error updating vectorstore for module {module_id} in course {course_id}: {e}")
+            failed = set(module["files"])
 
-        return {
-            "statusCode": 200,
-            "body": json.dumps({
-                "message": "New file inserted into database.",
-                "location": f"s3://{bucket_name}/{file_key}"
-            })
-        }
+        for result in module["results"]:
+            if result["filename"] in failed:
+                result.update(status="failed", error="Error updating vectorstore.")
+            else:
+                result["status"] = "success"
+
+    # SQS partial batch response: only the messages with a failed record are retried
+    failed_messages = list(dict.fromkeys(
+        result["messageId"] for result in results
+        if result["status"] == "failed" and result["messageId"] is not None
+    ))
+    succeeded = sum(result["status"] == "success" for result in results)
+    failed_count = sum(result["status"] == "failed" for result in results)
 
     return {
-        "statusCode": 400,
-        "body": json.dumps("No new file upload or deletion event found.")
-    }
\ No newline at end of file
+        "statusCode": 500 if failed_count and not succeeded else 200,
+        "body": json.dumps({
+            "message": f"Processed {succeeded} files, {failed_count} failed.",
+            "records": results
+        }),
+        "batchItemFailures": [{"itemIdentifier": message_id} for message_id in failed_messages]
+    }
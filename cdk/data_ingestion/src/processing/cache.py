@@ -0,0 +1,295 @@
+import os, json, hashlib, logging, threading
+from array import array
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+import boto3
+
+from langchain_core.stores import ByteStore
+from langchain_core.embeddings import Embeddings
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# "s3" (a prefix in the embedding bucket), "local" (a directory, for tests) or "none"
+INGESTION_CACHE_BACKEND = os.environ.get("INGESTION_CACHE_BACKEND", "s3").lower()
+INGESTION_CACHE_BUCKET = os.environ.get("INGESTION_CACHE_BUCKET", os.environ["EMBEDDING_BUCKET_NAME"])
+# Entries under this prefix expire through a lifecycle rule on the bucket, see api-gateway-stack.ts
+INGESTION_CACHE_PREFIX = os.environ.get("INGESTION_CACHE_PREFIX", "cache/")
+INGESTION_CACHE_DIR = os.environ.get("INGESTION_CACHE_DIR", "/tmp/ingestion-cache")
+
+s3 = boto3.client('s3')
+
+class S3PrefixStore(ByteStore):
+    """
+    A ByteStore that keeps each value as an object under a prefix of an S3 bucket.
+
+    Entries are whole documents, so a lookup is a single request.
+    """
+
+    def __init__(self, bucket: str, prefix: str):
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def _get(self, key: str) -> Optional[bytes]:
+        try:
+            response = s3.get_object(Bucket=self.bucket, Key=f"{self.prefix}{key}")
+            return response["Body"].read()
+        except s3.exceptions.NoSuchKey:
+            return None
+
+    def mget(self, keys: Sequence[str]) -> List[Optional[bytes]]:
+        return [self._get(key) for key in keys]
+
+    def mset(self, key_value_pairs: Sequence[Tuple[str, bytes]]) -> None:
+        for key, value in key_value_pairs:
+            s3.put_object(Bucket=self.bucket, Key=f"{self.prefix}{key}", Body=value)
+
+    def mdelete(self, keys: Sequence[str]) -> None:
+        # delete_objects accepts at most 1000 keys per call
+        keys = list(keys)
+        for start in range(0, len(keys), 1000):
+            s3.delete_objects(
+                Bucket=self.bucket,
+                Delete={"Objects": [{"Key": f"{self.prefix}{key}"} for key in keys[start:start + 1000]]}
+            )
+
+    def yield_keys(self, prefix: Optional[str] = None) -> Iterator[str]:
+        paginator = s3.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=f"{self.prefix}{prefix or ''}"):
+            for obj in page.get("Contents", []):
+                yield obj["Key"][len(self.prefix):]
+
+class LocalDirectoryStore(ByteStore):
+    """
+    A ByteStore that keeps each value as a file in a local directory.
+    """
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+
+    def _path(self, key: str) -> Path:
+        return self.root / key
+
+    def mget(self, keys: Sequence[str]) -> List[Optional[bytes]]:
+        values = []
+        for key in keys:
+            path = self._path(key)
+            values.append(path.read_bytes() if path.is_file() else None)
+        return values
+
+    def mset(self, key_value_pairs: Sequence[Tuple[str, bytes]]) -> None:
+        for key, value in key_value_pairs:
+            path = self._path(key)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(value)
+
+    def mdelete(self, keys: Sequence[str]) -> None:
+        for key in keys:
+            self._path(key).unlink(missing_ok=True)
+
+    def yield_keys(self, prefix: Optional[str] = None) -> Iterator[str]:
+        if not self.root.is_dir():
+            return
+        for path in self.root.rglob("*"):
+            key = path.relative_to(self.root).as_posix()
+            if path.is_file() and key.startswith(prefix or ""):
+                yield key
+
+def get_cache_store(namespace: str) -> Optional[ByteStore]:
+    """
+    Return the configured cache backend for a namespace, or None if caching is disabled.
+
+    Args:
+    namespace (str): The sub-prefix of the cache, e.g. "pages/" or "embeddings/".
+
+    Returns:
+    Optional[ByteStore]: The cache store.
+    """
+    if INGESTION_CACHE_BACKEND == "s3":
+        return S3PrefixStore(INGESTION_CACHE_BUCKET, f"{INGESTION_CACHE_PREFIX}{namespace}")
+    if INGESTION_CACHE_BACKEND == "local":
+        return LocalDirectoryStore(os.path.join(INGESTION_CACHE_DIR, namespace))
+    return None
+
+def encode_vectors(vectors: Dict[str, array]) -> bytes:
+    """
+    Pack vectors as a JSON header with their keys and dimension, then the packed float32 values.
+    """
+    dim = len(next(iter(vectors.values()))) if vectors else 0
+    header = json.dumps({"dim": dim, "keys": list(vectors)}).encode("utf-8")
+    return header + b"\n" + b"".join(vector.tobytes() for vector in vectors.values())
+
+def decode_vectors(value: bytes) -> Dict[str, array]:
+    header, _, data = value.partition(b"\n")
+    header = json.loads(header)
+    values = array("f", data)
+    dim = header["dim"]
+    return {key: values[i * dim:(i + 1) * dim] for i, key in enumerate(header["keys"])}
+
+class DocumentEmbeddingCache(Embeddings):
+    """
+    Embeddings that cache every vector of a document in one entry.
+
+    Entries are keyed by model ID and document fingerprint. Inside document(), the
+    entry is read once up front, lookups are answered from memory, and the vectors
+    the document used are written back once at the end if any had to be embedded.
+    A document therefore costs at most two cache requests, however many sentences
+    it has. Outside document(), texts go straight to the underlying embeddings.
+    """
+
+    def __init__(self, embeddings: Embeddings, model_id: str, store: ByteStore):
+        self.embeddings = embeddings
+        self.model_id = model_id
+        self.store = store
+        self.lock = threading.Lock()
+        self.cached: Optional[Dict[str, array]] = None
+        self.used: Dict[str, array] = {}
+        self.misses = 0
+
+    @staticmethod
+    def _key(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    @contextmanager
+    def document(self, fingerprint: str):
+        """
+        Serve the embeddings of one document from its cache entry.
+
+        Args:
+        fingerprint (str): The content fingerprint of the document.
+        """
+        entry_key = f"{self.model_id}/{fingerprint}"
+        try:
+            value = self.store.mget([entry_key])[0]
+            cached = decode_vectors(value) if value is not None else {}
+        except Exception as e:
+            logger.error(f"Error reading cached embeddings of {fingerprint}: {e}")
+            cached = {}
+
+        with self.lock:
+            self.cached, self.used, self.misses = cached, {}, 0
+        try:
+            yield
+            if self.misses:
+                try:
+                    self.store.mset([(entry_key, encode_vectors(self.used))])
+                except Exception as e:
+                    logger.error(f"Error caching embeddings of {fingerprint}: {e}")
+            logger.info(f"Embedding cache for {fingerprint}: {len(self.used) - self.misses} hits, {self.misses} misses.")
+        finally:
+            with self.lock:
+                self.cached, self.used, self.misses = None, {}, 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        with self.lock:
+            if self.cached is None:
+                cached = None
+            else:
+                cached = {}
+                for text in texts:
+                    key = self._key(text)
+                    vector = self.cached.get(key)
+                    if vector is not None:
+                        cached[text] = vector
+                        self.used[key] = vector
+        if cached is None:
+            return self.embeddings.embed_documents(texts)
+
+        missing = [text for text in dict.fromkeys(texts) if text not in cached]
+        if missing:
+            embedded = dict(zip(missing, self.embeddings.embed_documents(missing)))
+            with self.lock:
+                for text, vector in embedded.items():
+                    vector = array("f", vector)
+                    cached[text] = vector
+                    if self.cached is not None:
+                        self.cached[self._key(text)] = vector
+                        self.used[self._key(text)] = vector
+                self.misses += len(embedded)
+        return [cached[text].tolist() for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
+
+def get_cached_embeddings(embeddings: Embeddings, model_id: str) -> Embeddings:
+    """
+    Wrap an embeddings instance so the vectors of each document are cached in one entry.
+
+    Args:
+    embeddings (Embeddings): The underlying embeddings instance.
+    model_id (str): The embedding model ID, part of every entry's key.
+
+    Returns:
+    Embeddings: The cache-backed embeddings, or the original instance if caching is disabled.
+    """
+    store = get_cache_store("embeddings/")
+    if store is None:
+        return embeddings
+    return DocumentEmbeddingCache(embeddings, model_id, store)
+
+def cached_document(embeddings: Embeddings, fingerprint: str):
+    """
+    Return a context in which the document cache in an embeddings stack serves the given document.
+
+    Wrappers expose the instance they wrap as `underlying` or `embeddings`. Without a
+    DocumentEmbeddingCache in the stack, the context does nothing.
+
+    Args:
+    embeddings (Embeddings): The embeddings instance the document is embedded with.
+    fingerprint (str): The content fingerprint of the document.
+    """
+    while embeddings is not None and not isinstance(embeddings, DocumentEmbeddingCache):
+        embeddings = getattr(embeddings, "underlying", None) or getattr(embeddings, "embeddings", None)
+    if embeddings is None:
+        return nullcontext()
+    return embeddings.document(fingerprint)
+
+def get_object_fingerprint(bucket: str, key: str) -> str:
+    """
+    Return a content fingerprint for an S3 object without downloading it.
+
+    Args:
+    bucket (str): The name of the S3 bucket.
+    key (str): The key of the object.
+
+    Returns:
+    str: The object's ETag, which changes whenever its bytes change.
+    """
+    return s3.head_object(Bucket=bucket, Key=key)["ETag"].strip('"')
+
+def get_cached_pages(fingerprint: str) -> Optional[List[Tuple[int, str]]]:
+    """
+    Return the extracted text of every page of a document, if it was cached.
+
+    All pages of a document are kept in one entry, so a hit costs a single request.
+
+    Args:
+    fingerprint (str): The content fingerprint of the document.
+
+    Returns:
+    Optional[List[Tuple[int, str]]]: (page number, text) for each non-empty page, or None on a miss.
+    """
+    store = get_cache_store("pages/")
+    if store is None:
+        return None
+
+    value = store.mget([fingerprint])[0]
+    if value is None:
+        return None
+    return [(page_num, text) for page_num, text in json.loads(value)]
+
+def set_cached_pages(fingerprint: str, pages: List[Tuple[int, str]]) -> None:
+    """
+    Cache the extracted text of every page of a document.
+
+    Args:
+    fingerprint (str): The content fingerprint of the document.
+    pages (List[Tuple[int, str]]): (page number, text) for each non-empty page.
+    """
+    store = get_cache_store("pages/")
+    if store is None:
+        return
+
+    store.mset([(fingerprint, json.dumps(pages).encode("utf-8"))])
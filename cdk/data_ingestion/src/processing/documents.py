@@ -1,6 +1,7 @@
 import os, tempfile, logging, uuid
+from itertools import islice
 from io import BytesIO
-from typing import List
+from typing import Iterable, Iterator, List, Tuple, Union
 import boto3
 import fitz
 import re
@@ -12,6 +13,10 @@ from langchain_aws import BedrockEmbeddings
 from langchain_experimental.text_splitter import SemanticChunker
 from langchain_classic.indexes import SQLRecordManager, index
 
+from processing.cache import get_object_fingerprint, get_cached_pages, set_cached_pages, cached_document
+from processing.ocr import detect_document_text, ocr_in_page_order
+from processing.embeddings import prewarm_semantic_chunker
+
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -23,20 +28,27 @@ textract = boto3.client('textract')
 EMBEDDING_BUCKET_NAME = os.environ["EMBEDDING_BUCKET_NAME"]
 print('EMBEDDING_BUCKET_NAME',EMBEDDING_BUCKET_NAME)
 
-def extract_text_with_textract(page_image_bytes: bytes) -> str:
+# Write each page's extracted text to the embedding bucket, for debugging extraction
+PERSIST_PAGE_TEXT = os.environ.get("PERSIST_PAGE_TEXT", "false").lower() == "true"
+
+# Number of pages whose sentences are embedded together before chunking
+EMBEDDING_PAGE_WINDOW = int(os.environ.get("EMBEDDING_PAGE_WINDOW", "16"))
+
+SUPPORTED_EXTENSIONS = (".pdf", ".docx", ".pptx", ".txt", ".xlsx", ".xps", ".mobi", ".cbz")
+
+def extract_text_with_textract(page_image_bytes: bytes, client=None) -> str:
     """
     Extract text from a page image using AWS Textract.
     
     Args:
     page_image_bytes (bytes): The image bytes of the page
+    client (optional): The Textract client. Defaults to the module's client; tests can pass a fake.
     
     Returns:
     str: The extracted text
     """
     try:
-        response = textract.detect_document_text(
-            Document={'Bytes': page_image_bytes}
-        )
+        response = detect_document_text(client or textract, page_image_bytes)
         
         # Extract text from response
         text_lines = []
@@ -78,6 +90,11 @@ def extract_txt(
 
     return text
 
+def batched(iterable: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
 def clean_text(text: str) -> str:
     # Remove non-ASCII characters
     text = text.encode("ascii", errors="ignore").decode()
@@ -88,64 +105,97 @@ def clean_text(text: str) -> str:
         return ""
     return text
 
+def extract_doc_pages(
+    file_path: str,
+    filename: str
+) -> Iterator[Tuple[int, str]]:
+    """
+    Extract the text of each page of a local document, using Textract OCR for scanned pages.
+    
+    Args:
+    file_path (str): The path of the downloaded document.
+    filename (str): The name of the document file, used for logging.
+    
+    Returns:
+    Iterator[Tuple[int, str]]: (page number, text) for every page with text.
+    """
+    doc = fitz.open(file_path)
+
+    def page_contents() -> Iterator[Tuple[int, Union[str, bytes]]]:
+        for page_num, page in enumerate(doc, start=1):
+            text = page.get_text().strip()
+
+            if len(text) >= 30:
+                yield page_num, text
+                continue
+
+            # Render scanned pages here; Textract OCR runs on the thread pool
+            try:
+                pix = page.get_pixmap(matrix=fitz.Matrix(2, 2))  # 2x zoom for better quality
+                img_bytes = pix.tobytes("png")
+            except Exception as e:
+                logging.warning(f"Rendering page {page_num} of {filename} for OCR failed: {e}\n{traceback.format_exc()}")
+                continue
+
+            print(f"AWS Textract OCR used for page {page_num} of {filename}")
+            yield page_num, img_bytes
+
+    try:
+        for page_num, text in ocr_in_page_order(page_contents(), extract_text_with_textract):
+            if text.strip():
+                yield page_num, text
+    finally:
+        doc.close()
+
 def store_doc_texts(
     bucket: str, 
     course: str, 
     module: str,
     filename: str, 
-    output_bucket: str
-) -> List[str]:
+    output_bucket: str,
+    fingerprint: str
+) -> Iterator[Tuple[int, str]]:
     """
-    Store the text of each page of a document in an S3 bucket.
+    Yield the text of each page of a document, straight from extraction or the page cache.
+
+    Page text is only written to the output bucket when PERSIST_PAGE_TEXT is enabled,
+    which is meant for debugging extraction.
     
     Args:
     bucket (str): The name of the S3 bucket containing the document.
     course (str): The course ID folder in the S3 bucket.
     module (str): The module name and ID folder within the course.
     filename (str): The name of the document file.
-    output_bucket (str): The name of the S3 bucket for storing the extracted text.
+    output_bucket (str): The name of the S3 bucket for storing the extracted text in debug mode.
+    fingerprint (str): The content fingerprint of the document, see get_object_fingerprint.
     
     Returns:
-    List[str]: A list of keys for the stored text files in the output bucket.
+    Iterator[Tuple[int, str]]: (page number, text) for every page with text, in page order.
     """
-    with tempfile.NamedTemporaryFile(delete=False) as tmp_file:
-        s3.download_file(bucket, f"{course}/{module}/documents/{filename}", tmp_file.name)
-        file_name, file_type = filename.rsplit('.', 1)
-        doc = fitz.open(tmp_file.name)
+    file_key = f"{course}/{module}/documents/{filename}"
+    pages = get_cached_pages(fingerprint)
 
-        uploaded_keys = []
-
-        for page_num, page in enumerate(doc, start=1):
-            text = page.get_text().strip()
-
-            if len(text) < 30:
-                # Use AWS Textract for OCR
-                try:
-                    # Get page as image for Textract
-                    pix = page.get_pixmap(matrix=fitz.Matrix(2, 2))  # 2x zoom for better quality
-                    img_bytes = pix.tobytes("png")
-                    text = extract_text_with_textract(img_bytes)
-                    print(f"AWS Textract OCR used for page {page_num} of {filename}")
-                except Exception as e:
-                    logging.warning(f"AWS Textract OCR failed on page {page_num} of {filename}: {e}\n{traceback.format_exc()}")
-                    text = ""
-
-            if not text.strip():
-                continue
+    if pages is None:
+        pages = []
+        with tempfile.NamedTemporaryFile(delete=False) as tmp_file:
+            s3.download_file(bucket, file_key, tmp_file.name)
+        try:
+            for page_num, text in extract_doc_pages(tmp_file.name, filename):
+                pages.append((page_num, text))
+                yield page_num, text
+        finally:
+            os.remove(tmp_file.name)
+        set_cached_pages(fingerprint, pages)
+    else:
+        logger.info(f"Using cached page text for {filename} ({fingerprint})")
+        yield from pages
 
+    if PERSIST_PAGE_TEXT:
+        for page_num, text in pages:
             page_output_key = f'{course}/{module}/documents/{filename}_page_{page_num}.txt'
-
-            # uploads to S3 as one .txt file per page
             with BytesIO(text.encode("utf-8")) as page_output_buffer:
                 s3.upload_fileobj(page_output_buffer, output_bucket, page_output_key)
 
-            uploaded_keys.append(page_output_key)
-
-        doc.close()
-        os.remove(tmp_file.name)
-
-    return uploaded_keys
-
 def add_document(
     bucket: str, 
     course: str, 
@@ -157,6 +207,11 @@ def add_document(
 ) -> List[Document]:
     """
     Add a document to the vectorstore.
+
+    Apart from the embedding model calls, a document costs a constant number of S3
+    requests however many pages it has: one HEAD for its fingerprint, one read of
+    each of the page text and embedding cache entries, and on a miss the download
+    and one write of each entry.
     
     Args:
     bucket (str): The name of the S3 bucket containing the document.
@@ -165,41 +220,42 @@ def add_document(
     filename (str): The name of the document file.
     vectorstore (PGVector): The vectorstore instance.
     embeddings (BedrockEmbeddings): The embeddings instance.
-    output_bucket (str, optional): The name of the S3 bucket for storing extracted data. Defaults to 'temp-extracted-data'.
+    output_bucket (str, optional): The name of the S3 bucket used for the chunk source and debug page text. Defaults to EMBEDDING_BUCKET_NAME.
     
     Returns:
     List[Document]: A list of all document chunks for this document that were added to the vectorstore.
     """
-    
-    print("output_bucket", output_bucket)
-    output_filenames = store_doc_texts(
+    fingerprint = get_object_fingerprint(bucket, f"{course}/{module}/documents/{filename}")
+    pages = store_doc_texts(
         bucket=bucket,
         course=course,
         module=module,
         filename=filename,
-        output_bucket=output_bucket
-    )
-    this_doc_chunks = store_doc_chunks(
-        bucket=output_bucket,
-        filenames=output_filenames,
-        vectorstore=vectorstore,
-        embeddings=embeddings
+        output_bucket=output_bucket,
+        fingerprint=fingerprint
     )
+    with cached_document(embeddings, fingerprint):
+        this_doc_chunks = store_doc_chunks(
+            pages=pages,
+            source=get_document_source(course, module, filename, output_bucket),
+            vectorstore=vectorstore,
+            embeddings=embeddings
+        )
     
     return this_doc_chunks
 
 def store_doc_chunks(
-    bucket: str, 
-    filenames: List[str],
+    pages: Iterable[Tuple[int, str]],
+    source: str,
     vectorstore: PGVector, 
     embeddings: BedrockEmbeddings
 ) -> List[Document]:
     """
-    Store chunks of documents in the vectorstore.
+    Split the pages of a document into semantic chunks ready for the vectorstore.
     
     Args:
-    bucket (str): The name of the S3 bucket containing the text files.
-    filenames (List[str]): A list of keys for the text files in the bucket.
+    pages (Iterable[Tuple[int, str]]): (page number, text) for each page of the document.
+    source (str): The source ID of the document, see get_document_source.
     vectorstore (PGVector): The vectorstore instance.
     embeddings (BedrockEmbeddings): The embeddings instance.
     
@@ -209,34 +265,122 @@ def store_doc_chunks(
     text_splitter = SemanticChunker(embeddings)
     this_doc_chunks = []
 
-    for filename in filenames:
-        this_uuid = str(uuid.uuid4()) # Generating one UUID for all chunks of from a specific page in the document
-        output_buffer = BytesIO()
-        s3.download_fileobj(bucket, filename, output_buffer)
-        output_buffer.seek(0)
-        doc_texts = output_buffer.read().decode('utf-8')
-        doc_chunks = text_splitter.create_documents([doc_texts])
-        
-        head, _, _ = filename.partition("_page")
-        true_filename = head # Converts 'CourseCode_XXX_-_Course-Name.pdf_page_1.txt' to 'CourseCode_XXX_-_Course-Name.pdf'
-        
-        doc_chunks = [x for x in doc_chunks if x.page_content]
-        
-        for doc_chunk in doc_chunks:
-            if doc_chunk:
-                doc_chunk.metadata["source"] = f"s3://{bucket}/{true_filename}"
+    for window in batched(pages, EMBEDDING_PAGE_WINDOW):
+        # Embed the sentences of the whole window in one batched dispatch
+        prewarm_semantic_chunker(text_splitter, [doc_texts for _, doc_texts in window])
+
+        for page_num, doc_texts in window:
+            # One ID for all chunks of a specific page. Derived from the page rather than random,
+            # so re-ingesting unchanged content hashes the same and index() skips re-embedding it
+            this_uuid = str(uuid.uuid5(uuid.NAMESPACE_URL, f"{source}_page_{page_num}.txt"))
+            doc_chunks = text_splitter.create_documents([doc_texts])
+            
+            doc_chunks = [x for x in doc_chunks if x.page_content]
+            
+            for doc_chunk in doc_chunks:
+                doc_chunk.metadata["source"] = source
                 doc_chunk.metadata["doc_id"] = this_uuid
-                
-            else:
-                logger.warning(f"Empty chunk for {filename}")
-        
-        s3.delete_object(Bucket=bucket, Key=filename)
-        print(f"Deleting {filename} from {bucket}")
-        
-        this_doc_chunks.extend(doc_chunks)
+            
+            this_doc_chunks.extend(doc_chunks)
        
     return this_doc_chunks
                 
+def get_document_source(
+    course: str,
+    module: str,
+    filename: str,
+    output_bucket: str = EMBEDDING_BUCKET_NAME
+) -> str:
+    """
+    Build the "source" metadata value shared by every chunk of a document.
+
+    Args:
+    course (str): The course ID folder in the S3 bucket.
+    module (str): The module ID folder in the S3 bucket.
+    filename (str): The name of the document file.
+    output_bucket (str, optional): The name of the S3 bucket used for extracted data.
+
+    Returns:
+    str: The source ID used by the record manager to group the document's chunks.
+    """
+    return f"s3://{output_bucket}/{course}/{module}/documents/{filename}"
+
+def remove_document(
+    course: str,
+    module: str,
+    filename: str,
+    vectorstore: PGVector,
+    record_manager: SQLRecordManager
+) -> None:
+    """
+    Remove every chunk of a single document from the vectorstore.
+
+    Args:
+    course (str): The course ID folder in the S3 bucket.
+    module (str): The module ID folder in the S3 bucket.
+    filename (str): The name of the deleted document file.
+    vectorstore (PGVector): The vectorstore instance.
+    record_manager (SQLRecordManager): Manages list of documents in the vectorstore for indexing.
+    """
+    source = get_document_source(course, module, filename)
+    keys = record_manager.list_keys(group_ids=[source])
+    if keys:
+        vectorstore.delete(ids=keys)
+        record_manager.delete_keys(keys)
+    logger.info(f"Removed {len(keys)} chunks of {source} from the vectorstore.")
+
+def process_document(
+    bucket: str,
+    course: str,
+    module: str,
+    filename: str,
+    vectorstore: PGVector,
+    embeddings: BedrockEmbeddings,
+    record_manager: SQLRecordManager
+) -> None:
+    """
+    Extract, embed and index a single document without touching the rest of the module.
+
+    Uses incremental cleanup keyed on "source", so only the stale chunks of this
+    document are replaced.
+
+    Args:
+    bucket (str): The name of the S3 bucket containing the document.
+    course (str): The course ID folder in the S3 bucket.
+    module (str): The module ID folder in the S3 bucket.
+    filename (str): The name of the document file.
+    vectorstore (PGVector): The vectorstore instance.
+    embeddings (BedrockEmbeddings): The embeddings instance.
+    record_manager (SQLRecordManager): Manages list of documents in the vectorstore for indexing.
+    """
+    if not filename.endswith(SUPPORTED_EXTENSIONS):
+        logger.info(f"Skipping unsupported file {filename}.")
+        return
+
+    this_doc_chunks = add_document(
+        bucket=bucket,
+        course=course,
+        module=module,
+        filename=filename,
+        vectorstore=vectorstore,
+        embeddings=embeddings
+    )
+
+    if not this_doc_chunks:
+        # Incremental cleanup only runs for sources present in the batch
+        remove_document(course, module, filename, vectorstore, record_manager)
+        logger.info(f"No chunks extracted from {filename}.")
+        return
+
+    idx = index(
+        this_doc_chunks,
+        record_manager,
+        vectorstore,
+        cleanup="incremental",
+        source_id_key="source"
+    )
+    logger.info(f"Indexing updates for {filename}: \n {idx}")
+
 def process_documents(
     bucket: str, 
     course: str, 
@@ -265,7 +409,7 @@ def process_documents(
             continue  # Skip pages without any content (e.g., if the bucket is empty)
         for file in page['Contents']:
             filename = file['Key']
-            if filename.endswith((".pdf", ".docx", ".pptx", ".txt", ".xlsx", ".xps", ".mobi", ".cbz")):
+            if filename.endswith(SUPPORTED_EXTENSIONS):
                 this_doc_chunks = add_document(
                     bucket=bucket,
                     course=course,
@@ -0,0 +1,115 @@
+import os, re, logging, threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Sequence
+
+from langchain_core.embeddings import Embeddings
+from langchain_experimental.text_splitter import SemanticChunker, combine_sentences
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+EMBEDDING_BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE", "16"))
+EMBEDDING_MAX_IN_FLIGHT = int(os.environ.get("EMBEDDING_MAX_IN_FLIGHT", "8"))
+EMBEDDING_MEMO_SIZE = int(os.environ.get("EMBEDDING_MEMO_SIZE", "20000"))
+
+class BatchedEmbeddings(Embeddings):
+    """
+    Embeddings dispatcher that dedupes texts, remembers recent vectors and sends
+    batches to the underlying model concurrently.
+
+    Documents and queries are remembered separately: asymmetric models embed the same
+    text differently as a query than as a document.
+
+    Bedrock embedding models take one text per request, so BedrockEmbeddings embeds
+    a list serially. This splits the texts that still need a vector into batches
+    and runs up to max_in_flight of them at the same time.
+    """
+
+    def __init__(
+        self,
+        underlying: Embeddings,
+        batch_size: int = EMBEDDING_BATCH_SIZE,
+        max_in_flight: int = EMBEDDING_MAX_IN_FLIGHT,
+        memo_size: int = EMBEDDING_MEMO_SIZE
+    ):
+        self.underlying = underlying
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight
+        self.memo_size = memo_size
+        self.memo: "OrderedDict[str, List[float]]" = OrderedDict()
+        self.query_memo: "OrderedDict[str, List[float]]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight)
+
+    def _remember(self, memo: "OrderedDict[str, List[float]]", vectors: Dict[str, List[float]]) -> None:
+        with self.lock:
+            for text, vector in vectors.items():
+                memo[text] = vector
+                memo.move_to_end(text)
+            while len(memo) > self.memo_size:
+                memo.popitem(last=False)
+
+    def _recall(self, memo: "OrderedDict[str, List[float]]", text: str):
+        with self.lock:
+            vector = memo.get(text)
+            if vector is not None:
+                memo.move_to_end(text)
+            return vector
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = {}
+        missing = []
+        for text in dict.fromkeys(texts):  # dedupe, keeping order
+            vector = self._recall(self.memo, text)
+            if vector is None:
+                missing.append(text)
+            else:
+                vectors[text] = vector
+
+        if missing:
+            batches = [missing[i:i + self.batch_size] for i in range(0, len(missing), self.batch_size)]
+            results = self.executor.map(self.underlying.embed_documents, batches)
+            embedded = {}
+            for batch, batch_vectors in zip(batches, results):
+                embedded.update(zip(batch, batch_vectors))
+            self._remember(self.memo, embedded)
+            vectors.update(embedded)
+
+        logger.info(f"Embedded {len(missing)} of {len(texts)} texts ({len(texts) - len(missing)} deduped or remembered).")
+        return [vectors[text] for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        vector = self._recall(self.query_memo, text)
+        if vector is None:
+            vector = self.underlying.embed_query(text)
+            self._remember(self.query_memo, {text: vector})
+        return vector
+
+def prewarm_semantic_chunker(text_splitter: SemanticChunker, texts: Sequence[str]) -> None:
+    """
+    Embed, in one dispatch, every sentence group the chunker will ask for across several texts.
+
+    SemanticChunker embeds the sentence groups of one text at a time. Calling this
+    first for a window of pages turns many small serial requests into one batched,
+    deduplicated one; the chunker's own calls are then answered from the
+    dispatcher's in-memory memo without another lookup.
+
+    Args:
+    text_splitter (SemanticChunker): The chunker that will split the texts.
+    texts (Sequence[str]): The texts about to be split.
+    """
+    sentences = []
+    for text in texts:
+        single_sentences_list = re.split(text_splitter.sentence_split_regex, text)
+        if len(single_sentences_list) <= 1:
+            continue  # the chunker returns these without embedding
+        combined = combine_sentences(
+            [{"sentence": x, "index": i} for i, x in enumerate(single_sentences_list)],
+            text_splitter.buffer_size
+        )
+        sentences.extend(x["combined_sentence"] for x in combined)
+
+    if sentences:
+        text_splitter.embeddings.embed_documents(sentences)
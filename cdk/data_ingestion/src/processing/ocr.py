@@ -0,0 +1,122 @@
+import os, time, random, logging, threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, Tuple, Union
+
+from botocore.exceptions import ClientError
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+TEXTRACT_MAX_WORKERS = int(os.environ.get("TEXTRACT_MAX_WORKERS", "4"))
+TEXTRACT_MAX_TPS = float(os.environ.get("TEXTRACT_MAX_TPS", "5"))
+TEXTRACT_MAX_ATTEMPTS = int(os.environ.get("TEXTRACT_MAX_ATTEMPTS", "6"))
+
+THROTTLING_ERROR_CODES = (
+    "ThrottlingException",
+    "ProvisionedThroughputExceededException",
+    "LimitExceededException",
+    "ServiceUnavailable",
+    "InternalServerError",
+)
+
+class RateLimiter:
+    """
+    Spaces calls evenly so that no more than `rate` calls start per second across threads.
+    """
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.next_slot = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        with self.lock:
+            now = time.monotonic()
+            wait = self.next_slot - now
+            self.next_slot = max(now, self.next_slot) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+textract_rate_limiter = RateLimiter(TEXTRACT_MAX_TPS)
+
+def detect_document_text(
+    client,
+    page_image_bytes: bytes,
+    rate_limiter: RateLimiter = textract_rate_limiter,
+    max_attempts: int = TEXTRACT_MAX_ATTEMPTS
+) -> dict:
+    """
+    Call Textract DetectDocumentText, retrying throttling errors with exponential backoff and jitter.
+
+    Args:
+    client: The Textract client, or any object with a compatible detect_document_text method.
+    page_image_bytes (bytes): The image bytes of the page.
+    rate_limiter (RateLimiter, optional): Limits the request rate shared by all OCR threads.
+    max_attempts (int, optional): The maximum number of calls before giving up.
+
+    Returns:
+    dict: The Textract response.
+    """
+    for attempt in range(1, max_attempts + 1):
+        rate_limiter.acquire()
+        try:
+            return client.detect_document_text(Document={'Bytes': page_image_bytes})
+        except ClientError as e:
+            code = e.response.get("Error", {}).get("Code")
+            if code not in THROTTLING_ERROR_CODES or attempt == max_attempts:
+                raise
+            delay = random.uniform(0, min(20.0, 0.5 * 2 ** attempt))
+            logger.warning(f"Textract {code}, retrying in {delay:.2f}s (attempt {attempt}/{max_attempts})")
+            time.sleep(delay)
+
+def ocr_in_page_order(
+    pages: Iterable[Tuple[int, Union[str, bytes]]],
+    ocr: Callable[[bytes], str],
+    max_workers: int = TEXTRACT_MAX_WORKERS
+) -> Iterator[Tuple[int, str]]:
+    """
+    Run OCR for scanned pages on a thread pool and yield every page's text in page order.
+
+    Pages are consumed lazily, so rendering stays on the calling thread (PyMuPDF is not
+    thread safe) and at most 2 * max_workers page images are held in memory at once.
+
+    Args:
+    pages (Iterable[Tuple[int, Union[str, bytes]]]): (page number, text) for pages with a text layer,
+        or (page number, image bytes) for pages that need OCR.
+    ocr (Callable[[bytes], str]): Extracts the text of one page image.
+    max_workers (int, optional): The number of concurrent OCR calls.
+
+    Returns:
+    Iterator[Tuple[int, str]]: (page number, text) for every page, in the order they were given.
+    """
+    max_in_flight = 2 * max_workers
+    pending = deque()
+    in_flight = 0
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for page_num, content in pages:
+            if isinstance(content, bytes):
+                pending.append((page_num, executor.submit(ocr, content)))
+                in_flight += 1
+            else:
+                pending.append((page_num, content))
+
+            # Hand back finished pages from the front, and block on the oldest OCR call
+            # when too many images are waiting
+            while pending:
+                head_num, head = pending[0]
+                if isinstance(head, str):
+                    pending.popleft()
+                    yield head_num, head
+                elif head.done() or in_flight >= max_in_flight:
+                    pending.popleft()
+                    in_flight -= 1
+                    yield head_num, head.result()
+                else:
+                    break
+
+        while pending:
+            head_num, head = pending.popleft()
+            yield head_num, head if isinstance(head, str) else head.result()
@@ -0,0 +1,69 @@
+"""
+Tests for the batching embeddings dispatcher, with an asymmetric fake model that embeds
+a text differently as a query than as a document.
+
+Run from cdk/data_ingestion with the Lambda's requirements installed:
+    python -m pytest tests
+"""
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from langchain_core.embeddings import Embeddings
+
+from processing.embeddings import BatchedEmbeddings
+
+class AsymmetricEmbeddings(Embeddings):
+    def __init__(self):
+        self.documents = []
+        self.queries = []
+        self.lock = threading.Lock()
+
+    def embed_documents(self, texts):
+        with self.lock:
+            self.documents.extend(texts)
+        return [[float(len(text)), 0.0] for text in texts]
+
+    def embed_query(self, text):
+        with self.lock:
+            self.queries.append(text)
+        return [float(len(text)), 1.0]
+
+def test_queries_and_documents_are_remembered_separately():
+    underlying = AsymmetricEmbeddings()
+    embeddings = BatchedEmbeddings(underlying, batch_size=2, max_in_flight=2)
+
+    assert embeddings.embed_documents(["leaf", "node"]) == [[4.0, 0.0], [4.0, 0.0]]
+    # A query for a text already embedded as a document still gets a query vector
+    assert embeddings.embed_query("leaf") == [4.0, 1.0]
+    assert embeddings.embed_documents(["leaf"]) == [[4.0, 0.0]]
+    assert embeddings.embed_query("leaf") == [4.0, 1.0]
+
+    assert underlying.documents == ["leaf", "node"]
+    assert underlying.queries == ["leaf"]
+
+def test_documents_are_deduped_and_batched():
+    underlying = AsymmetricEmbeddings()
+    embeddings = BatchedEmbeddings(underlying, batch_size=2, max_in_flight=2)
+
+    vectors = embeddings.embed_documents(["a", "bb", "a", "ccc", "bb", "dddd", "eeeee"])
+
+    assert vectors == [[1.0, 0.0], [2.0, 0.0], [1.0, 0.0], [3.0, 0.0], [2.0, 0.0], [4.0, 0.0], [5.0, 0.0]]
+    assert sorted(underlying.documents) == ["a", "bb", "ccc", "dddd", "eeeee"]
+
+def test_memos_forget_the_least_recently_used_texts():
+    underlying = AsymmetricEmbeddings()
+    embeddings = BatchedEmbeddings(underlying, batch_size=2, max_in_flight=1, memo_size=2)
+
+    embeddings.embed_documents(["a", "bb"])
+    embeddings.embed_documents(["a"])
+    embeddings.embed_documents(["ccc"])
+    embeddings.embed_documents(["a", "bb"])
+    for text in ("a", "bb", "ccc", "a"):
+        embeddings.embed_query(text)
+
+    # bb was the least recently used document when ccc was remembered
+    assert underlying.documents == ["a", "bb", "ccc", "bb"]
+    assert underlying.queries == ["a", "bb", "ccc", "a"]
@@ -0,0 +1,118 @@
+"""
+Tests for the Textract OCR helpers, with a fake Textract client instead of AWS.
+
+Run from cdk/data_ingestion with the Lambda's requirements installed:
+    python -m pytest tests
+"""
+import os
+import sys
+import threading
+
+import pytest
+from botocore.exceptions import ClientError
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from processing import ocr
+from processing.ocr import RateLimiter, detect_document_text, ocr_in_page_order
+
+def throttling_error(code="ThrottlingException"):
+    return ClientError({"Error": {"Code": code, "Message": "Rate exceeded"}}, "DetectDocumentText")
+
+class FakeTextract:
+    """
+    Answers DetectDocumentText with the page image bytes as a single LINE block.
+
+    Each image is throttled `throttles` times before it is answered, and `delays`
+    maps an image to the seconds its answer takes, so later pages can finish first.
+    """
+
+    def __init__(self, throttles=0, delays=None, error_code="ThrottlingException"):
+        self.throttles = throttles
+        self.delays = delays or {}
+        self.error_code = error_code
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def detect_document_text(self, Document):
+        image = Document["Bytes"]
+        with self.lock:
+            self.calls[image] = self.calls.get(image, 0) + 1
+            attempt = self.calls[image]
+        if attempt <= self.throttles:
+            raise throttling_error(self.error_code)
+        # Not time.sleep, which the tests replace
+        threading.Event().wait(self.delays.get(image, 0))
+        return {"Blocks": [{"BlockType": "PAGE"}, {"BlockType": "LINE", "Text": image.decode("utf-8")}]}
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    """
+    Record the backoff delays instead of sleeping through them.
+    """
+    sleeps = []
+    monkeypatch.setattr(ocr.random, "uniform", lambda low, high: high)
+    monkeypatch.setattr(ocr.time, "sleep", sleeps.append)
+    return sleeps
+
+def fake_ocr(client):
+    def extract(image):
+        response = detect_document_text(client, image, rate_limiter=RateLimiter(0), max_attempts=4)
+        return "\n".join(block["Text"] for block in response["Blocks"] if block["BlockType"] == "LINE")
+    return extract
+
+def test_detect_document_text_retries_throttling(no_backoff):
+    client = FakeTextract(throttles=2)
+
+    response = detect_document_text(client, b"page", rate_limiter=RateLimiter(0), max_attempts=4)
+
+    assert response["Blocks"][1]["Text"] == "page"
+    assert client.calls[b"page"] == 3
+    # Exponential backoff between the attempts
+    assert no_backoff == [1.0, 2.0]
+
+def test_detect_document_text_gives_up_after_max_attempts():
+    client = FakeTextract(throttles=10)
+
+    with pytest.raises(ClientError):
+        detect_document_text(client, b"page", rate_limiter=RateLimiter(0), max_attempts=4)
+    assert client.calls[b"page"] == 4
+
+def test_detect_document_text_does_not_retry_other_errors():
+    client = FakeTextract(throttles=10, error_code="InvalidParameterException")
+
+    with pytest.raises(ClientError):
+        detect_document_text(client, b"page", rate_limiter=RateLimiter(0), max_attempts=4)
+    assert client.calls[b"page"] == 1
+
+def test_ocr_in_page_order_reassembles_pages():
+    # Later pages take less time, so they finish first
+    images = {page_num: f"scanned {page_num}".encode("utf-8") for page_num in (0, 2, 3, 5, 6, 7)}
+    client = FakeTextract(throttles=1, delays={image: 0.05 * (8 - page_num) for page_num, image in images.items()})
+    pages = [(page_num, images.get(page_num, f"text {page_num}")) for page_num in range(8)]
+
+    result = list(ocr_in_page_order(iter(pages), fake_ocr(client), max_workers=3))
+
+    assert result == [(page_num, images[page_num].decode("utf-8") if page_num in images else f"text {page_num}") for page_num in range(8)]
+    assert all(calls == 2 for calls in client.calls.values())
+
+def test_ocr_in_page_order_bounds_pages_in_memory():
+    max_workers = 2
+    client = FakeTextract()
+    pulled = 0
+    yielded = 0
+    most_waiting = 0
+
+    def pages():
+        nonlocal pulled
+        for page_num in range(20):
+            pulled += 1
+            yield page_num, f"scanned {page_num}".encode("utf-8")
+
+    for page_num, text in ocr_in_page_order(pages(), fake_ocr(client), max_workers=max_workers):
+        most_waiting = max(most_waiting, pulled - yielded)
+        yielded += 1
+        assert text == f"scanned {page_num}"
+
+    assert yielded == 20
+    assert most_waiting <= 2 * max_workers
@@ -0,0 +1,41 @@
+/**
+ * Pool of pre-generated opening turns per module.
+ *
+ * The first turn of every session in a module is the same greeting prompt, so
+ * text_generation keeps a few generated variants here and serves new sessions
+ * from them. prompt_hash identifies the model, course system prompt and opening
+ * query a variant was generated with; data_ingestion clears a module's rows
+ * whenever its files change.
+ */
+
+exports.up = async (pgm) => {
+  pgm.createTable("Module_Openers", {
+    opener_id: {
+      type: "uuid",
+      primaryKey: true,
+      default: pgm.func("uuid_generate_v4()"),
+    },
+    module_id: { type: "uuid", notNull: true },
+    prompt_hash: { type: "varchar", notNull: true },
+    variant: { type: "integer", notNull: true },
+    opener: { type: "text", notNull: true },
+    time_created: { type: "timestamp", default: pgm.func("now()") },
+  });
+
+  pgm.addConstraint("Module_Openers", "Module_Openers_module_id_fkey", {
+    foreignKeys: {
+      columns: "module_id",
+      references: '"Course_Modules"(module_id)',
+      onDelete: "CASCADE",
+      onUpdate: "CASCADE",
+    },
+  });
+
+  pgm.addConstraint("Module_Openers", "unique_module_opener_variant", {
+    unique: ["module_id", "prompt_hash", "variant"],
+  });
+};
+
+exports.down = async (pgm) => {
+  pgm.dropTable("Module_Openers", { cascade: true });
+};
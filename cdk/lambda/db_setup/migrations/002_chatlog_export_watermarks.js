@@ -0,0 +1,38 @@
+/**
+ * High-water marks for incremental chat log exports.
+ *
+ * One row per (course, instructor) records the last message included in that
+ * instructor's exports, as (time_sent, message_id), so the next incremental
+ * export only contains messages sent after it.
+ */
+
+exports.up = async (pgm) => {
+  pgm.createTable("Chatlog_Export_Watermarks", {
+    course_id: { type: "uuid", notNull: true },
+    instructor_email: { type: "varchar", notNull: true },
+    last_time_sent: { type: "timestamp", notNull: true },
+    last_message_id: { type: "uuid", notNull: true },
+    time_updated: { type: "timestamp", default: pgm.func("now()") },
+  });
+
+  pgm.addConstraint("Chatlog_Export_Watermarks", "Chatlog_Export_Watermarks_pkey", {
+    primaryKey: ["course_id", "instructor_email"],
+  });
+
+  pgm.addConstraint(
+    "Chatlog_Export_Watermarks",
+    "Chatlog_Export_Watermarks_course_id_fkey",
+    {
+      foreignKeys: {
+        columns: "course_id",
+        references: '"Courses"(course_id)',
+        onDelete: "CASCADE",
+        onUpdate: "CASCADE",
+      },
+    },
+  );
+};
+
+exports.down = async (pgm) => {
+  pgm.dropTable("Chatlog_Export_Watermarks", { cascade: true });
+};
@@ -0,0 +1,49 @@
+/**
+ * Indexes for the hot query paths.
+ *
+ * The initial schema only has primary keys and foreign keys, and Postgres does
+ * not index foreign key columns on its own. These cover the lookups made by the
+ * Lambdas:
+ * - Messages(session_id, time_sent): deleteLastMessage's latest messages of a
+ *   session and the chat log export's per-session message order.
+ * - Module_Files(module_id, filename, filetype): ingestion, getFiles and deleteFile.
+ * - Course_Concepts(course_id), Course_Modules(concept_id): a course's modules,
+ *   used by text generation and the chat log export.
+ * - Student_Modules(course_module_id), Student_Modules(enrolment_id),
+ *   Sessions(student_module_id), Enrolments(user_id): the joins from a course
+ *   or a student down to sessions and messages.
+ *
+ * The indexes are built concurrently so a deployment does not block writes,
+ * which requires running outside a transaction.
+ */
+
+const INDEXES = [
+  ["Messages", ["session_id", "time_sent"], "idx_messages_session_id_time_sent"],
+  ["Module_Files", ["module_id", "filename", "filetype"], "idx_module_files_module_id_filename_filetype"],
+  ["Course_Concepts", ["course_id"], "idx_course_concepts_course_id"],
+  ["Course_Modules", ["concept_id"], "idx_course_modules_concept_id"],
+  ["Student_Modules", ["course_module_id"], "idx_student_modules_course_module_id"],
+  ["Student_Modules", ["enrolment_id"], "idx_student_modules_enrolment_id"],
+  ["Sessions", ["student_module_id"], "idx_sessions_student_module_id"],
+  ["Enrolments", ["user_id"], "idx_enrolments_user_id"],
+];
+
+exports.up = async (pgm) => {
+  pgm.noTransaction();
+
+  for (const [table, columns, name] of INDEXES) {
+    pgm.createIndex(table, columns, {
+      name,
+      concurrently: true,
+      ifNotExists: true,
+    });
+  }
+};
+
+exports.down = async (pgm) => {
+  pgm.noTransaction();
+
+  for (const [table, columns, name] of INDEXES) {
+    pgm.dropIndex(table, columns, { name, concurrently: true, ifExists: true });
+  }
+};
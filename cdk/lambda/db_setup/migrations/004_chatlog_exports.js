@@ -0,0 +1,50 @@
+/**
+ * Index of the chat log exports written to the chat logs bucket.
+ *
+ * sqsTrigger records every file it writes under {course_id}/{instructor_email}/,
+ * so getChatLogsFunction can page through an instructor's exports newest first
+ * with an index scan instead of listing and sorting the whole S3 prefix.
+ */
+
+exports.up = async (pgm) => {
+  pgm.createTable("Chatlog_Exports", {
+    export_id: {
+      type: "uuid",
+      primaryKey: true,
+      default: pgm.func("uuid_generate_v4()"),
+    },
+    course_id: { type: "uuid", notNull: true },
+    instructor_email: { type: "varchar", notNull: true },
+    file_name: { type: "varchar", notNull: true },
+    row_count: { type: "integer" },
+    time_created: { type: "timestamp", notNull: true, default: pgm.func("now()") },
+  });
+
+  pgm.addConstraint("Chatlog_Exports", "Chatlog_Exports_course_id_fkey", {
+    foreignKeys: {
+      columns: "course_id",
+      references: '"Courses"(course_id)',
+      onDelete: "CASCADE",
+      onUpdate: "CASCADE",
+    },
+  });
+
+  pgm.addConstraint("Chatlog_Exports", "unique_chatlog_export_file", {
+    unique: ["course_id", "instructor_email", "file_name"],
+  });
+
+  pgm.createIndex(
+    "Chatlog_Exports",
+    [
+      "course_id",
+      "instructor_email",
+      { name: "time_created", sort: "DESC" },
+      { name: "file_name", sort: "DESC" },
+    ],
+    { name: "idx_chatlog_exports_instructor_time_created" },
+  );
+};
+
+exports.down = async (pgm) => {
+  pgm.dropTable("Chatlog_Exports", { cascade: true });
+};
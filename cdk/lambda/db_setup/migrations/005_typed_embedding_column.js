@@ -0,0 +1,71 @@
+/**
+ * Fixed-dimension embedding column for the vector store.
+ *
+ * PGVector creates langchain_pg_embedding with an untyped `vector` column, and
+ * pgvector can only build ANN indexes on a column with a fixed dimension.
+ * Data ingestion used to ALTER the column itself, taking an ACCESS EXCLUSIVE
+ * lock on the table every module's retrieval reads. The schema change now
+ * happens here, at deploy time:
+ * - the langchain_postgres tables are created up front, with the same layout
+ *   PGVector uses, so the Lambdas find them and leave them as they are;
+ * - an existing untyped column is typed with the dimension of its stored
+ *   embeddings.
+ * The embedding model is an SSM parameter read at runtime, so a column without
+ * embeddings is left untyped; data ingestion types it with the model's
+ * dimension while the table is still empty (see ensure_embedding_dimension).
+ */
+
+exports.up = async (pgm) => {
+  pgm.sql("CREATE EXTENSION IF NOT EXISTS vector;");
+
+  pgm.sql(`
+    CREATE TABLE IF NOT EXISTS langchain_pg_collection (
+      uuid uuid PRIMARY KEY,
+      name varchar NOT NULL UNIQUE,
+      cmetadata json
+    );
+  `);
+
+  pgm.sql(`
+    CREATE TABLE IF NOT EXISTS langchain_pg_embedding (
+      id varchar PRIMARY KEY,
+      collection_id uuid REFERENCES langchain_pg_collection (uuid) ON DELETE CASCADE,
+      embedding vector,
+      document varchar,
+      cmetadata jsonb
+    );
+  `);
+  pgm.sql(
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_langchain_pg_embedding_id ON langchain_pg_embedding (id);",
+  );
+  pgm.sql(
+    "CREATE INDEX IF NOT EXISTS ix_cmetadata_gin ON langchain_pg_embedding USING gin (cmetadata jsonb_path_ops);",
+  );
+
+  pgm.sql(`
+    DO $$
+    DECLARE
+      dims integer[];
+    BEGIN
+      IF (
+        SELECT format_type(atttypid, atttypmod)
+        FROM pg_attribute
+        WHERE attrelid = 'langchain_pg_embedding'::regclass AND attname = 'embedding'
+      ) = 'vector' THEN
+        SELECT array_agg(DISTINCT vector_dims(embedding)) FILTER (WHERE embedding IS NOT NULL) INTO dims
+        FROM langchain_pg_embedding;
+        IF dims IS NULL THEN
+          RAISE NOTICE 'langchain_pg_embedding holds no embeddings yet, leaving the column for data ingestion to type';
+        ELSIF array_length(dims, 1) = 1 THEN
+          EXECUTE format('ALTER TABLE langchain_pg_embedding ALTER COLUMN embedding TYPE vector(%s)', dims[1]);
+        ELSE
+          RAISE WARNING 'langchain_pg_embedding holds embeddings of dimensions %, leaving the column untyped', dims;
+        END IF;
+      END IF;
+    END$$;
+  `);
+};
+
+exports.down = async (pgm) => {
+  pgm.sql("ALTER TABLE langchain_pg_embedding ALTER COLUMN embedding TYPE vector;");
+};
@@ -0,0 +1,32 @@
+/**
+ * Course/instructor pairs whose chat log exports have been copied into Chatlog_Exports.
+ *
+ * Exports written before migration 004 exist only in S3. getChatLogsFunction
+ * copies an instructor's S3 prefix into Chatlog_Exports the first time it pages
+ * through it, and records the pair here so the prefix is listed only once.
+ */
+
+exports.up = async (pgm) => {
+  pgm.createTable("Chatlog_Export_Backfills", {
+    course_id: { type: "uuid", notNull: true },
+    instructor_email: { type: "varchar", notNull: true },
+    time_backfilled: { type: "timestamp", notNull: true, default: pgm.func("now()") },
+  });
+
+  pgm.addConstraint("Chatlog_Export_Backfills", "Chatlog_Export_Backfills_pkey", {
+    primaryKey: ["course_id", "instructor_email"],
+  });
+
+  pgm.addConstraint("Chatlog_Export_Backfills", "Chatlog_Export_Backfills_course_id_fkey", {
+    foreignKeys: {
+      columns: "course_id",
+      references: '"Courses"(course_id)',
+      onDelete: "CASCADE",
+      onUpdate: "CASCADE",
+    },
+  });
+};
+
+exports.down = async (pgm) => {
+  pgm.dropTable("Chatlog_Export_Backfills", { cascade: true });
+};
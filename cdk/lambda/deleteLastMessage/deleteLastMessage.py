@@ -172,10 +172,11 @@ def lambda_handler(event, context):
             }
 
         # Remove the last AI and human messages by popping the last two elements
+        message_count = len(history)
         history.pop()
         history.pop()
 
-        # Update the conversation history in DynamoDB
+        # Update the conversation history in DynamoDB, keeping the session's message counter in step
         dynamodb_client.update_item(
             TableName=table_name,
             Key={
@@ -183,9 +184,11 @@ def lambda_handler(event, context):
                     'S': session_id
                 }
             },
-            UpdateExpression="SET History = :history",
+            UpdateExpression="SET History = :history, MessageCount = if_not_exists(MessageCount, :count) - :removed",
             ExpressionAttributeValues={
-                ":history": {"L": history}
+                ":history": {"L": history},
+                ":count": {"N": str(message_count)},
+                ":removed": {"N": "2"}
             }
         )
 
@@ -1,7 +1,10 @@
 import os
 import json
+import base64
+import hashlib
 import boto3
 from botocore.config import Config
+import psycopg2
 from aws_lambda_powertools import Logger
 
 logger = Logger()
@@ -9,14 +12,163 @@ logger = Logger()
 # Environment variables
 REGION = os.environ["REGION"]
 BUCKET = os.environ["BUCKET"]
+DB_SECRET_NAME = os.environ["SM_DB_CREDENTIALS"]
+RDS_PROXY_ENDPOINT = os.environ["RDS_PROXY_ENDPOINT"]
+# Largest page a client may request with limit
+MAX_PAGE_SIZE = 100
 
 # AWS Clients
+secrets_manager_client = boto3.client('secretsmanager')
+
 s3 = boto3.client(
     "s3",
     endpoint_url=f"https://s3.{REGION}.amazonaws.com",
     config=Config(s3={"addressing_style": "virtual"}, region_name=REGION, signature_version="s3v4"),
 )
 
+# Global variables for caching
+connection = None
+db_secret = None
+
+def get_secret(secret_name):
+    global db_secret
+    if db_secret is None:
+        try:
+            response = secrets_manager_client.get_secret_value(SecretId=secret_name)["SecretString"]
+            db_secret = json.loads(response)
+        except json.JSONDecodeError as e:
+            logger.error(f"Failed to decode JSON for secret: {e}")
+            raise ValueError(f"Secret is not properly formatted as JSON.")
+        except Exception as e:
+            logger.error(f"Error fetching secret: {e}")
+            raise
+    return db_secret
+
+def connect_to_db():
+    global connection
+    if connection is None or connection.closed:
+        try:
+            secret = get_secret(DB_SECRET_NAME)
+            connection_params = {
+                'dbname': secret["dbname"],
+                'user': secret["username"],
+                'password': secret["password"],
+                'host': RDS_PROXY_ENDPOINT,
+                'port': secret["port"]
+            }
+            connection_string = " ".join([f"{key}={value}" for key, value in connection_params.items()])
+            connection = psycopg2.connect(connection_string)
+            logger.info("Connected to the database!")
+        except Exception as e:
+            logger.error(f"Failed to connect to database: {e}")
+            if connection:
+                connection.rollback()
+                connection.close()
+            raise
+    return connection
+
+def get_token_scope(course_id, instructor_email):
+    """
+    Identify the listing a continuation token belongs to, without putting the email in the token.
+    """
+    return hashlib.sha256(f"{course_id}/{instructor_email}".encode("utf-8")).hexdigest()[:16]
+
+def encode_token(position, course_id, instructor_email):
+    position = {**position, "scope": get_token_scope(course_id, instructor_email)}
+    return base64.urlsafe_b64encode(json.dumps(position).encode("utf-8")).decode("ascii")
+
+def decode_token(token, course_id, instructor_email):
+    """
+    Decode a continuation token. Raises ValueError if it is malformed or was issued for another course or instructor.
+    """
+    try:
+        position = json.loads(base64.urlsafe_b64decode(token.encode("ascii")))
+        if position["scope"] != get_token_scope(course_id, instructor_email):
+            raise ValueError
+        return position["time_created"], position["file_name"]
+    except Exception:
+        raise ValueError("Invalid next_token")
+
+def backfill_exports(cur, course_id, instructor_email):
+    """
+    Copy an instructor's exports from S3 into Chatlog_Exports, once per course and instructor.
+
+    Exports written before the index existed are only in S3. LastModified stands in
+    for the time they were created. Runs in the caller's transaction, so the
+    marker in Chatlog_Export_Backfills is only kept if the copy succeeds, and a
+    concurrent first listing waits for it instead of listing the prefix again.
+    """
+    cur.execute("""
+        INSERT INTO "Chatlog_Export_Backfills" (course_id, instructor_email)
+        VALUES (%s, %s)
+        ON CONFLICT (course_id, instructor_email) DO NOTHING
+        RETURNING course_id;
+    """, (course_id, instructor_email))
+    if cur.fetchone() is None:
+        return
+
+    prefix = f"{course_id}/{instructor_email}/"
+    paginator = s3.get_paginator("list_objects_v2")
+    backfilled = 0
+    for page in paginator.paginate(Bucket=BUCKET, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            cur.execute("""
+                INSERT INTO "Chatlog_Exports" (course_id, instructor_email, file_name, time_created)
+                VALUES (%s, %s, %s, %s)
+                ON CONFLICT (course_id, instructor_email, file_name) DO NOTHING;
+            """, (course_id, instructor_email, obj["Key"][len(prefix):], obj["LastModified"].replace(tzinfo=None)))
+            backfilled += cur.rowcount
+    logger.info("Backfilled chat log exports", extra={"course_id": course_id, "backfilled": backfilled})
+
+def list_exports_page(course_id, instructor_email, limit, next_token=None):
+    """
+    Fetch one page of an instructor's chat log exports, newest first, from the Chatlog_Exports index.
+
+    The first page backfills the index from S3 if this instructor's exports were never listed before.
+
+    Returns:
+    tuple: (file names, continuation token for the next page or None).
+    """
+    connection = connect_to_db()
+    cur = None
+    try:
+        cur = connection.cursor()
+        if next_token:
+            time_created, file_name = decode_token(next_token, course_id, instructor_email)
+            cur.execute("""
+                SELECT file_name, time_created
+                FROM "Chatlog_Exports"
+                WHERE course_id = %s AND instructor_email = %s
+                AND (time_created, file_name) < (%s::timestamp, %s)
+                ORDER BY time_created DESC, file_name DESC
+                LIMIT %s;
+            """, (course_id, instructor_email, time_created, file_name, limit + 1))
+        else:
+            backfill_exports(cur, course_id, instructor_email)
+            cur.execute("""
+                SELECT file_name, time_created
+                FROM "Chatlog_Exports"
+                WHERE course_id = %s AND instructor_email = %s
+                ORDER BY time_created DESC, file_name DESC
+                LIMIT %s;
+            """, (course_id, instructor_email, limit + 1))
+        rows = cur.fetchall()
+        connection.commit()
+        cur.close()
+    except Exception:
+        if cur:
+            cur.close()
+        connection.rollback()
+        raise
+
+    # One extra row tells whether there is another page
+    page = rows[:limit]
+    token = None
+    if len(rows) > limit:
+        file_name, time_created = page[-1]
+        token = encode_token({"time_created": time_created.isoformat(), "file_name": file_name}, course_id, instructor_email)
+    return [file_name for file_name, _ in page], token
+
 def list_files_in_s3_prefix(bucket, prefix):
     files = []
     continuation_token = None
@@ -79,16 +231,45 @@ def lambda_handler(event, context):
             "body": json.dumps("Missing required parameters: course_id or instructor_email"),
         }
 
+    # Without limit the whole prefix is listed, as before pagination was added
+    limit = query_params.get("limit")
+    next_token = query_params.get("next_token")
+    try:
+        limit = int(limit) if limit is not None else None
+        if limit is not None and not 1 <= limit <= MAX_PAGE_SIZE:
+            raise ValueError
+        if next_token:
+            decode_token(next_token, course_id, instructor_email)
+    except ValueError:
+        logger.error("Invalid pagination parameters", extra={"limit": limit, "next_token": next_token})
+        return {
+            "statusCode": 400,
+            "headers": {
+                "Content-Type": "application/json",
+                "Access-Control-Allow-Headers": "*",
+                "Access-Control-Allow-Origin": "*",
+                "Access-Control-Allow-Methods": "*",
+            },
+            "body": json.dumps(f"Invalid pagination parameters: limit must be between 1 and {MAX_PAGE_SIZE} and next_token must come from a previous response"),
+        }
+
     try:
         log_prefix = f"{course_id}/{instructor_email}/"
 
-        log_files = list_files_in_s3_prefix(BUCKET, log_prefix)
+        if limit is None:
+            log_files = list_files_in_s3_prefix(BUCKET, log_prefix)
+        else:
+            log_files, next_token = list_exports_page(course_id, instructor_email, limit, next_token)
 
-        # Generate presigned URLs for logs
+        # Generate presigned URLs for logs, only for the returned page
         log_files_urls = {file_name: generate_presigned_url(BUCKET, f"{log_prefix}{file_name}") for file_name in log_files}
 
         logger.info("Presigned URLs generated successfully", extra={"log_files": log_files_urls})
 
+        body = {"log_files": log_files_urls}
+        if limit is not None:
+            body["next_token"] = next_token
+
         return {
             "statusCode": 200,
             "headers": {
@@ -97,7 +278,7 @@ def lambda_handler(event, context):
                 "Access-Control-Allow-Origin": "*",
                 "Access-Control-Allow-Methods": "*",
             },
-            "body": json.dumps({"log_files": log_files_urls}),
+            "body": json.dumps(body),
         }
     except Exception as e:
         logger.exception(f"Error generating presigned URLs for chat logs: {e}")
@@ -1,5 +1,6 @@
 import os
 import json
+import base64
 import boto3
 from botocore.config import Config
 import psycopg2
@@ -12,6 +13,8 @@ REGION = os.environ["REGION"]
 BUCKET = os.environ["BUCKET"]
 DB_SECRET_NAME = os.environ["SM_DB_CREDENTIALS"]
 RDS_PROXY_ENDPOINT = os.environ["RDS_PROXY_ENDPOINT"]
+# Largest page a client may request with limit
+MAX_PAGE_SIZE = 100
 
 # AWS Clients
 secrets_manager_client = boto3.client('secretsmanager')
@@ -65,6 +68,24 @@ def connect_to_db():
             raise
     return connection
 
+def encode_token(position):
+    return base64.urlsafe_b64encode(json.dumps(position).encode("utf-8")).decode("ascii")
+
+def decode_token(token, source):
+    """
+    Decode a continuation token of the given listing source. Raises ValueError if it is malformed.
+
+    Returns:
+    str or tuple: the S3 continuation token for source s3, (filename, filetype) for source db.
+    """
+    try:
+        position = json.loads(base64.urlsafe_b64decode(token.encode("ascii")))
+        if source == "s3":
+            return position["continuation_token"]
+        return position["filename"], position["filetype"]
+    except Exception:
+        raise ValueError("Invalid next_token")
+
 def list_files_in_s3_prefix(bucket, prefix):
     files = []
     continuation_token = None
@@ -92,6 +113,41 @@ def list_files_in_s3_prefix(bucket, prefix):
 
     return files
 
+def list_files_page_in_s3_prefix(bucket, prefix, limit, next_token=None):
+    """
+    List one page of at most limit objects under the prefix.
+
+    Returns:
+    tuple: (file names, continuation token for the next page or None).
+    """
+    params = {"Bucket": bucket, "Prefix": prefix, "MaxKeys": limit}
+    if next_token:
+        params["ContinuationToken"] = decode_token(next_token, "s3")
+    result = s3.list_objects_v2(**params)
+
+    files = [obj['Key'].replace(prefix, '') for obj in result.get('Contents', [])]
+    token = None
+    if result.get('IsTruncated'):
+        token = encode_token({"continuation_token": result["NextContinuationToken"]})
+    return files, token
+
+def split_file_name(file_name):
+    """
+    Split a file name into (name, file type) at the last dot, the same split as data ingestion.
+
+    A name without a dot is all name, with an empty file type.
+    """
+    name, _, file_type = file_name.rpartition('.')
+    if not name:
+        return file_name, ''
+    return name, file_type
+
+def join_file_name(name, file_type):
+    """
+    The inverse of split_file_name: a file without a type has no trailing dot.
+    """
+    return f"{name}.{file_type}" if file_type else name
+
 def generate_presigned_url(bucket, key):
     try:
         return s3.generate_presigned_url(
@@ -104,43 +160,108 @@ def generate_presigned_url(bucket, key):
         logger.exception(f"Error generating presigned URL for {key}: {e}")
         return None
 
-def get_file_metadata_from_db(module_id, file_name, file_type):
+def get_module_files_from_db(module_id, file_names=None):
+    """
+    Fetch the name, type and metadata of the files of a module in one query.
+
+    Args:
+    module_id (str): The module whose files are fetched.
+    file_names (list, optional): Only fetch these names (without extension), e.g. the current page.
+
+    Returns:
+    dict: (filename, filetype) -> metadata, or None if the query failed.
+    """
     connection = connect_to_db()
     if connection is None:
         logger.error("No database connection available.")
         return None
 
+    cur = None
     try:
         cur = connection.cursor()
 
-        query = """
-            SELECT metadata 
-            FROM "Module_Files" 
-            WHERE module_id = %s AND filename = %s AND filetype = %s;
-        """
-        cur.execute(query, (module_id, file_name, file_type))
-        result = cur.fetchone()
+        if file_names is None:
+            query = """
+                SELECT filename, filetype, metadata 
+                FROM "Module_Files" 
+                WHERE module_id = %s
+                ORDER BY filename, filetype;
+            """
+            cur.execute(query, (module_id,))
+        else:
+            query = """
+                SELECT filename, filetype, metadata 
+                FROM "Module_Files" 
+                WHERE module_id = %s AND filename = ANY(%s)
+                ORDER BY filename, filetype;
+            """
+            cur.execute(query, (module_id, list(file_names)))
+        results = cur.fetchall()
+        connection.commit()
         cur.close()
 
-        if result:
-            return result[0]
-        else:
-            logger.warning(f"No metadata found for {file_name}.{file_type} in module {module_id}")
-            return None
+        return {(file_name, file_type): metadata for file_name, file_type, metadata in results}
 
     except Exception as e:
-        logger.error(f"Error retrieving metadata for {file_name}.{file_type}: {e}")
+        logger.error(f"Error retrieving file metadata for module {module_id}: {e}")
         if cur:
             cur.close()
         connection.rollback()
         return None
 
+def get_module_files_page_from_db(module_id, limit, next_token=None):
+    """
+    Fetch one page of a module's files in (filename, filetype) order, served by the Module_Files index.
+
+    Returns:
+    tuple: ((filename, filetype) -> metadata for the page, continuation token for the next page or None).
+    """
+    connection = connect_to_db()
+    cur = None
+    try:
+        cur = connection.cursor()
+        if next_token:
+            file_name, file_type = decode_token(next_token, "db")
+            cur.execute("""
+                SELECT filename, filetype, metadata
+                FROM "Module_Files"
+                WHERE module_id = %s AND (filename, filetype) > (%s, %s)
+                ORDER BY filename, filetype
+                LIMIT %s;
+            """, (module_id, file_name, file_type, limit + 1))
+        else:
+            cur.execute("""
+                SELECT filename, filetype, metadata
+                FROM "Module_Files"
+                WHERE module_id = %s
+                ORDER BY filename, filetype
+                LIMIT %s;
+            """, (module_id, limit + 1))
+        rows = cur.fetchall()
+        connection.commit()
+        cur.close()
+    except Exception:
+        if cur:
+            cur.close()
+        connection.rollback()
+        raise
+
+    # One extra row tells whether there is another page
+    page = rows[:limit]
+    token = None
+    if len(rows) > limit:
+        file_name, file_type, _ = page[-1]
+        token = encode_token({"filename": file_name, "filetype": file_type})
+    return {(file_name, file_type): metadata for file_name, file_type, metadata in page}, token
+
 @logger.inject_lambda_context
 def lambda_handler(event, context):
     query_params = event.get("queryStringParameters", {})
 
     course_id = query_params.get("course_id", "")
     module_id = query_params.get("module_id", "")
+    # "s3" lists the module's S3 prefix, "db" serves the listing from Module_Files alone
+    source = query_params.get("source", "s3")
 
     if not course_id or not module_id:
         logger.error("Missing required parameters", extra={
@@ -158,18 +279,72 @@ def lambda_handler(event, context):
             'body': json.dumps('Missing required parameters: course_id, or module_id')
         }
 
+    if source not in ("s3", "db"):
+        logger.error(f"Invalid source: {source}")
+        return {
+            'statusCode': 400,
+            "headers": {
+                "Content-Type": "application/json",
+                "Access-Control-Allow-Headers": "*",
+                "Access-Control-Allow-Origin": "*",
+                "Access-Control-Allow-Methods": "*",
+            },
+            'body': json.dumps('Invalid source: must be s3 or db')
+        }
+
+    # Without limit the whole module is listed, as before pagination was added
+    limit = query_params.get("limit")
+    next_token = query_params.get("next_token")
+    try:
+        limit = int(limit) if limit is not None else None
+        if limit is not None and not 1 <= limit <= MAX_PAGE_SIZE:
+            raise ValueError("limit out of range")
+        if next_token:
+            decode_token(next_token, source)
+    except ValueError:
+        logger.error("Invalid pagination parameters", extra={"limit": limit, "next_token": next_token})
+        return {
+            'statusCode': 400,
+            "headers": {
+                "Content-Type": "application/json",
+                "Access-Control-Allow-Headers": "*",
+                "Access-Control-Allow-Origin": "*",
+                "Access-Control-Allow-Methods": "*",
+            },
+            'body': json.dumps(f"Invalid pagination parameters: limit must be between 1 and {MAX_PAGE_SIZE} and next_token must come from a previous response with the same source")
+        }
+
     try:
         document_prefix = f"{course_id}/{module_id}/documents/"
 
-        document_files = list_files_in_s3_prefix(BUCKET, document_prefix)
+        if source == "db":
+            if limit is None:
+                module_files = get_module_files_from_db(module_id)
+                if module_files is None:
+                    raise Exception(f"Could not read Module_Files for module {module_id}")
+            else:
+                module_files, next_token = get_module_files_page_from_db(module_id, limit, next_token)
+            document_files = [join_file_name(file_name, file_type) for file_name, file_type in module_files]
+        elif limit is None:
+            document_files = list_files_in_s3_prefix(BUCKET, document_prefix)
+            # All metadata of the module in one round trip, joined to the listing below
+            module_files = get_module_files_from_db(module_id) or {}
+        else:
+            document_files, next_token = list_files_page_in_s3_prefix(BUCKET, document_prefix, limit, next_token)
+            # Only the metadata of the names on this page
+            page_names = {split_file_name(file_name)[0] for file_name in document_files}
+            module_files = (get_module_files_from_db(module_id, page_names) if page_names else {}) or {}
 
-        # Retrieve metadata and generate presigned URLs for documents
+        # Generate presigned URLs for documents; presigning is local and needs no request
         document_files_urls = {}
 
         for file_name in document_files:
-            file_type = file_name.split('.')[-1]  # Get the file extension
+            # Same split as data ingestion, so names containing dots match their row
+            name, file_type = split_file_name(file_name)
             presigned_url = generate_presigned_url(BUCKET, f"{document_prefix}{file_name}")
-            metadata = get_file_metadata_from_db(module_id, file_name.split('.')[0], file_type)
+            metadata = module_files.get((name, file_type))
+            if metadata is None:
+                logger.warning(f"No metadata found for {file_name} in module {module_id}")
             document_files_urls[f"{file_name}"] = {
                 "url": presigned_url,
                 "metadata": metadata
@@ -179,6 +354,10 @@ def lambda_handler(event, context):
             "document_files": document_files_urls,
         })
 
+        body = {'document_files': document_files_urls}
+        if limit is not None:
+            body['next_token'] = next_token
+
         return {
             'statusCode': 200,
             "headers": {
@@ -187,9 +366,7 @@ def lambda_handler(event, context):
                 "Access-Control-Allow-Origin": "*",
                 "Access-Control-Allow-Methods": "*",
             },
-            'body': json.dumps({
-                'document_files': document_files_urls
-            })
+            'body': json.dumps(body)
         }
     except Exception as e:
         logger.exception(f"Error generating presigned URLs or retrieving metadata: {e}")
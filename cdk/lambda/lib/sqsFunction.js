@@ -9,7 +9,7 @@ exports.handler = async (event) => {
   try {
     // Parse the incoming event
     console.log("Parsing instructor_email, course_id, and request_id");
-    const { instructor_email, course_id, request_id } = JSON.parse(event.body);
+    const { instructor_email, course_id, request_id, mode = "full", include_parquet = false } = JSON.parse(event.body);
 
     // Validate input
     if (!instructor_email || !course_id || !request_id) {
@@ -24,6 +24,32 @@ exports.handler = async (event) => {
       };
     }
 
+    // "incremental" exports only new messages, "compact" merges incremental exports into a full one
+    if (!["full", "incremental", "compact"].includes(mode)) {
+      return {
+        statusCode: 400,
+        headers: {
+          "Access-Control-Allow-Origin": "*",
+          "Access-Control-Allow-Headers": "Content-Type,X-Amz-Date,Authorization,X-Api-Key",
+          "Access-Control-Allow-Methods": "OPTIONS,POST",
+        },
+        body: JSON.stringify({ error: "mode must be one of full, incremental or compact" }),
+      };
+    }
+
+    // Parquet is only written for full exports
+    if (include_parquet && mode !== "full") {
+      return {
+        statusCode: 400,
+        headers: {
+          "Access-Control-Allow-Origin": "*",
+          "Access-Control-Allow-Headers": "Content-Type,X-Amz-Date,Authorization,X-Api-Key",
+          "Access-Control-Allow-Methods": "OPTIONS,POST",
+        },
+        body: JSON.stringify({ error: "include_parquet is only supported for full exports" }),
+      };
+    }
+
     // Initialize database connection if not already established
     if (!sqlConnection) {
       await initializeConnection(SM_DB_CREDENTIALS, RDS_PROXY_ENDPOINT);
@@ -41,7 +67,7 @@ exports.handler = async (event) => {
     // Prepare the SQS message
     const params = {
       QueueUrl: process.env.SQS_QUEUE_URL,
-      MessageBody: JSON.stringify({ instructor_email, course_id, request_id }),
+      MessageBody: JSON.stringify({ instructor_email, course_id, request_id, mode, include_parquet }),
       MessageGroupId: course_id, // FIFO requires group ID
       MessageDeduplicationId: `${instructor_email}-${course_id}-${request_id}`, // Deduplication ID
     };
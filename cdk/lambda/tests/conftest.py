@@ -0,0 +1,33 @@
+"""
+Shared setup for the tests of the Python API Lambdas in cdk/lambda.
+
+The tests live outside the function directories, which are deployed as they are.
+Run from cdk/lambda with boto3, psycopg2 and aws-lambda-powertools installed:
+    python -m pytest tests
+"""
+import os
+import sys
+from dataclasses import dataclass
+
+import pytest
+
+os.environ.setdefault("REGION", "ca-central-1")
+os.environ.setdefault("AWS_DEFAULT_REGION", "ca-central-1")
+os.environ.setdefault("BUCKET", "test-bucket")
+os.environ.setdefault("SM_DB_CREDENTIALS", "test-db-credentials")
+os.environ.setdefault("RDS_PROXY_ENDPOINT", "localhost")
+
+LAMBDA_DIR = os.path.join(os.path.dirname(__file__), "..")
+for function_dir in ("getChatLogsFunction", "getFilesFunction"):
+    sys.path.insert(0, os.path.join(LAMBDA_DIR, function_dir))
+
+@dataclass
+class LambdaContext:
+    function_name: str = "test"
+    memory_limit_in_mb: int = 128
+    invoked_function_arn: str = "arn:aws:lambda:ca-central-1:000000000000:function:test"
+    aws_request_id: str = "00000000-0000-0000-0000-000000000000"
+
+@pytest.fixture
+def lambda_context():
+    return LambdaContext()
@@ -0,0 +1,173 @@
+"""
+Tests for the paginated chat log listing of getChatLogsFunction, with a fake S3 client
+and a fake database that evaluates the listing's queries on a list of rows.
+"""
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+import getChatLogsFunction as chatlogs
+
+COURSE = "00000000-0000-0000-0000-00000000000a"
+INSTRUCTOR = "instructor@example.com"
+START = datetime(2026, 1, 5, 9, 0, 0)
+
+class FakeS3:
+    def __init__(self, objects):
+        # key -> LastModified
+        self.objects = objects
+        self.listings = 0
+
+    def get_paginator(self, operation):
+        fake = self
+
+        class Paginator:
+            def paginate(self, Bucket, Prefix):
+                fake.listings += 1
+                keys = sorted(key for key in fake.objects if key.startswith(Prefix))
+                yield {"Contents": [{"Key": key, "LastModified": fake.objects[key]} for key in keys]}
+
+        return Paginator()
+
+    def generate_presigned_url(self, ClientMethod, Params, ExpiresIn, HttpMethod):
+        return f"https://{Params['Bucket']}/{Params['Key']}"
+
+class FakeCursor:
+    """
+    Runs the listing's statements against FakeDatabase.
+    """
+
+    def __init__(self, database):
+        self.database = database
+        self.result = []
+        self.rowcount = 0
+
+    def execute(self, sql, params):
+        if 'INSERT INTO "Chatlog_Export_Backfills"' in sql:
+            key = tuple(params)
+            self.result = [] if key in self.database.backfills else [key]
+            self.database.backfills.add(key)
+        elif 'INSERT INTO "Chatlog_Exports"' in sql:
+            course_id, instructor_email, file_name, time_created = params
+            exists = any(row[:3] == (course_id, instructor_email, file_name) for row in self.database.exports)
+            if not exists:
+                self.database.exports.append((course_id, instructor_email, file_name, time_created))
+            self.rowcount = 0 if exists else 1
+        elif 'FROM "Chatlog_Exports"' in sql:
+            self.database.page_queries += 1
+            course_id, instructor_email, *position, limit = params
+            rows = [(name, time) for course, email, name, time in self.database.exports if (course, email) == (course_id, instructor_email)]
+            if position:
+                after = (datetime.fromisoformat(position[0]), position[1])
+                rows = [row for row in rows if (row[1], row[0]) < after]
+            self.result = sorted(rows, key=lambda row: (row[1], row[0]), reverse=True)[:limit]
+        else:
+            raise AssertionError(f"Unexpected statement: {sql}")
+
+    def fetchone(self):
+        return self.result[0] if self.result else None
+
+    def fetchall(self):
+        return self.result
+
+    def close(self):
+        pass
+
+class FakeDatabase:
+    def __init__(self):
+        self.backfills = set()
+        # (course_id, instructor_email, file_name, time_created)
+        self.exports = []
+        self.page_queries = 0
+        self.closed = False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+@pytest.fixture
+def database(monkeypatch):
+    fake = FakeDatabase()
+    monkeypatch.setattr(chatlogs, "connect_to_db", lambda: fake)
+    return fake
+
+@pytest.fixture
+def s3(monkeypatch):
+    # Two exports share a timestamp, so the file name breaks the tie
+    times = [START, START + timedelta(minutes=1), START + timedelta(minutes=1), START + timedelta(minutes=2), START + timedelta(hours=1)]
+    objects = {f"{COURSE}/{INSTRUCTOR}/export-{index}.csv": time for index, time in enumerate(times)}
+    objects[f"{COURSE}/{INSTRUCTOR}/deltas/delta-0.csv"] = START + timedelta(minutes=30)
+    objects[f"{COURSE}/other@example.com/export-9.csv"] = START
+    fake = FakeS3(objects)
+    monkeypatch.setattr(chatlogs, "s3", fake)
+    return fake
+
+def list_page(lambda_context, limit=None, next_token=None, instructor_email=INSTRUCTOR):
+    params = {"course_id": COURSE, "instructor_email": instructor_email}
+    if limit is not None:
+        params["limit"] = str(limit)
+    if next_token is not None:
+        params["next_token"] = next_token
+    response = chatlogs.lambda_handler({"queryStringParameters": params}, lambda_context)
+    return response["statusCode"], json.loads(response["body"])
+
+def list_all(lambda_context, limit):
+    names, next_token = [], None
+    while True:
+        status, body = list_page(lambda_context, limit, next_token)
+        assert status == 200
+        assert len(body["log_files"]) <= limit
+        names.extend(body["log_files"])
+        next_token = body["next_token"]
+        if next_token is None:
+            return names
+
+def test_pages_list_every_export_once_newest_first(database, s3, lambda_context):
+    expected = [
+        "export-4.csv", "deltas/delta-0.csv", "export-3.csv", "export-2.csv", "export-1.csv", "export-0.csv",
+    ]
+
+    assert list_all(lambda_context, limit=2) == expected
+    assert list_all(lambda_context, limit=4) == expected
+    # Only the first listing ever reads S3
+    assert s3.listings == 1
+
+def test_presigned_urls_are_only_generated_for_the_page(database, s3, lambda_context):
+    status, body = list_page(lambda_context, limit=1)
+
+    assert status == 200
+    assert body["log_files"] == {"export-4.csv": f"https://test-bucket/{COURSE}/{INSTRUCTOR}/export-4.csv"}
+
+def test_exports_recorded_after_the_backfill_are_listed(database, s3, lambda_context):
+    list_all(lambda_context, limit=10)
+    database.exports.append((COURSE, INSTRUCTOR, "export-5.csv", START + timedelta(hours=2)))
+
+    assert list_all(lambda_context, limit=10)[0] == "export-5.csv"
+    assert s3.listings == 1
+
+def test_without_limit_the_prefix_is_listed_from_s3(database, s3, lambda_context, monkeypatch):
+    monkeypatch.setattr(chatlogs, "list_files_in_s3_prefix", lambda bucket, prefix: ["export-0.csv"])
+
+    status, body = list_page(lambda_context)
+
+    assert status == 200
+    assert list(body["log_files"]) == ["export-0.csv"]
+    assert "next_token" not in body
+    assert database.page_queries == 0
+
+@pytest.mark.parametrize("limit", [0, chatlogs.MAX_PAGE_SIZE + 1, "ten"])
+def test_invalid_limits_are_rejected(database, s3, lambda_context, limit):
+    assert list_page(lambda_context, limit=limit)[0] == 400
+
+def test_tokens_only_continue_their_own_listing(database, s3, lambda_context):
+    _, body = list_page(lambda_context, limit=2)
+
+    assert list_page(lambda_context, limit=2, next_token=body["next_token"], instructor_email="other@example.com")[0] == 400
+    assert list_page(lambda_context, limit=2, next_token="not-a-token")[0] == 400
+    assert list_page(lambda_context, limit=2, next_token=body["next_token"])[0] == 200
@@ -0,0 +1,161 @@
+"""
+Tests for the paginated file listing of getFilesFunction, from S3 and from Module_Files,
+with a fake S3 client and a fake database that evaluates the listing's queries.
+"""
+import json
+
+import pytest
+
+import getFilesFunction as files
+
+COURSE = "00000000-0000-0000-0000-00000000000a"
+MODULE = "00000000-0000-0000-0000-00000000000b"
+PREFIX = f"{COURSE}/{MODULE}/documents/"
+
+# A name with two dots, one with none, and two files sharing a name
+FILE_NAMES = ["notes.v2.pdf", "a.pdf", "b.docx", "b.pdf", "README", "slides.pptx", "syllabus.pdf", "week 1.txt"]
+
+class FakeS3:
+    """
+    Lists keys in order, MaxKeys at a time, with opaque continuation tokens.
+    """
+
+    def __init__(self, keys):
+        self.keys = sorted(keys)
+        self.requests = []
+
+    def list_objects_v2(self, Bucket, Prefix, MaxKeys=1000, ContinuationToken=None):
+        self.requests.append({"MaxKeys": MaxKeys, "ContinuationToken": ContinuationToken})
+        keys = [key for key in self.keys if key.startswith(Prefix)]
+        start = int(ContinuationToken[len("token-"):]) if ContinuationToken else 0
+        result = {"Contents": [{"Key": key} for key in keys[start:start + MaxKeys]], "IsTruncated": start + MaxKeys < len(keys)}
+        if result["IsTruncated"]:
+            result["NextContinuationToken"] = f"token-{start + MaxKeys}"
+        return result
+
+    def generate_presigned_url(self, ClientMethod, Params, ExpiresIn, HttpMethod):
+        return f"https://{Params['Bucket']}/{Params['Key']}"
+
+class FakeCursor:
+    def __init__(self, database):
+        self.database = database
+        self.result = []
+
+    def execute(self, sql, params):
+        self.database.queries.append((sql, params))
+        rows = sorted((name, file_type, metadata) for (module_id, name, file_type), metadata in self.database.rows.items() if module_id == params[0])
+        if "filename = ANY" in sql:
+            rows = [row for row in rows if row[0] in params[1]]
+        elif "(filename, filetype) >" in sql:
+            rows = [row for row in rows if (row[0], row[1]) > (params[1], params[2])]
+        if "LIMIT" in sql:
+            rows = rows[:params[-1]]
+        self.result = rows
+
+    def fetchall(self):
+        return self.result
+
+    def close(self):
+        pass
+
+class FakeDatabase:
+    def __init__(self, rows):
+        # (module_id, filename, filetype) -> metadata
+        self.rows = rows
+        self.queries = []
+        self.closed = False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+@pytest.fixture
+def database(monkeypatch):
+    rows = {(MODULE, *files.split_file_name(file_name)): f"about {file_name}" for file_name in FILE_NAMES}
+    rows[("another-module", "z", "pdf")] = "elsewhere"
+    fake = FakeDatabase(rows)
+    monkeypatch.setattr(files, "connect_to_db", lambda: fake)
+    return fake
+
+@pytest.fixture
+def s3(monkeypatch):
+    fake = FakeS3([PREFIX + file_name for file_name in FILE_NAMES] + [f"{COURSE}/another-module/documents/z.pdf"])
+    monkeypatch.setattr(files, "s3", fake)
+    return fake
+
+def list_page(lambda_context, source=None, limit=None, next_token=None):
+    params = {"course_id": COURSE, "module_id": MODULE}
+    for name, value in (("source", source), ("limit", limit), ("next_token", next_token)):
+        if value is not None:
+            params[name] = str(value)
+    response = files.lambda_handler({"queryStringParameters": params}, lambda_context)
+    return response["statusCode"], json.loads(response["body"])
+
+def list_all(lambda_context, source, limit):
+    pages, next_token = [], None
+    while True:
+        status, body = list_page(lambda_context, source, limit, next_token)
+        assert status == 200
+        assert len(body["document_files"]) <= limit
+        pages.append(body["document_files"])
+        next_token = body["next_token"]
+        if next_token is None:
+            return pages
+
+@pytest.mark.parametrize("file_name", FILE_NAMES + [".env", "archive.tar.gz"])
+def test_join_file_name_inverts_split_file_name(file_name):
+    assert files.join_file_name(*files.split_file_name(file_name)) == file_name
+
+@pytest.mark.parametrize("source", ["s3", "db"])
+def test_pages_list_every_file_once_with_its_metadata(database, s3, lambda_context, source):
+    pages = list_all(lambda_context, source, limit=3)
+
+    listed = [file_name for page in pages for file_name in page]
+    assert sorted(listed) == sorted(FILE_NAMES)
+    assert len(listed) == len(FILE_NAMES)
+    for page in pages:
+        for file_name, entry in page.items():
+            assert entry == {"url": f"https://test-bucket/{PREFIX}{file_name}", "metadata": f"about {file_name}"}
+
+def test_s3_pages_pass_the_continuation_token_through(database, s3, lambda_context):
+    list_all(lambda_context, "s3", limit=3)
+
+    assert [request["MaxKeys"] for request in s3.requests] == [3, 3, 3]
+    assert [request["ContinuationToken"] for request in s3.requests] == [None, "token-3", "token-6"]
+    # Each page only fetches the metadata of its own files
+    assert all("filename = ANY" in sql and len(params[1]) <= 3 for sql, params in database.queries)
+
+def test_db_pages_continue_after_the_last_file(database, s3, lambda_context):
+    pages = list_all(lambda_context, "db", limit=3)
+
+    # Keyset order: by name, then type, so b.docx comes before b.pdf
+    assert [list(page) for page in pages] == [
+        ["README", "a.pdf", "b.docx"],
+        ["b.pdf", "notes.v2.pdf", "slides.pptx"],
+        ["syllabus.pdf", "week 1.txt"],
+    ]
+    assert not s3.requests
+
+def test_without_limit_every_file_is_listed(database, s3, lambda_context):
+    for source in ("s3", "db"):
+        status, body = list_page(lambda_context, source)
+        assert status == 200
+        assert sorted(body["document_files"]) == sorted(FILE_NAMES)
+        assert "next_token" not in body
+
+def test_tokens_only_continue_their_own_source(database, s3, lambda_context):
+    _, s3_page = list_page(lambda_context, "s3", limit=2)
+    _, db_page = list_page(lambda_context, "db", limit=2)
+
+    assert list_page(lambda_context, "db", limit=2, next_token=s3_page["next_token"])[0] == 400
+    assert list_page(lambda_context, "s3", limit=2, next_token=db_page["next_token"])[0] == 400
+    assert list_page(lambda_context, "db", limit=2, next_token="not-a-token")[0] == 400
+
+@pytest.mark.parametrize("params", [{"source": "dynamodb"}, {"limit": 0}, {"limit": files.MAX_PAGE_SIZE + 1}])
+def test_invalid_parameters_are_rejected(database, s3, lambda_context, params):
+    assert list_page(lambda_context, **params)[0] == 400
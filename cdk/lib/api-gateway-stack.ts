@@ -29,6 +29,7 @@ import * as secretsmanager from "aws-cdk-lib/aws-secretsmanager";
 import * as ssm from "aws-cdk-lib/aws-ssm";
 import * as sqs from "aws-cdk-lib/aws-sqs";
 import * as appsync from "aws-cdk-lib/aws-appsync";
+import * as dynamodb from "aws-cdk-lib/aws-dynamodb";
 
 
 export class ApiGatewayStack extends cdk.Stack {
@@ -83,6 +84,14 @@ export class ApiGatewayStack extends cdk.Stack {
         // When deleting the stack, need to empty the Bucket and delete it manually
         removalPolicy: cdk.RemovalPolicy.RETAIN,
         enforceSSL: true,
+        // Data ingestion's page text and embedding cache expires here instead of being evicted on every run
+        lifecycleRules: [
+          {
+            id: "ExpireIngestionCache",
+            prefix: "cache/",
+            expiration: cdk.Duration.days(30),
+          },
+        ],
       }
     );
 
@@ -982,6 +991,18 @@ export class ApiGatewayStack extends cdk.Stack {
       },
     });
 
+    // Query embeddings shared by every text generation container
+    const embeddingCacheTable = new dynamodb.Table(
+      this,
+      `${id}-EmbeddingCacheTable`,
+      {
+        partitionKey: { name: "CacheKey", type: dynamodb.AttributeType.STRING },
+        billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
+        timeToLiveAttribute: "ExpiresAt",
+        removalPolicy: cdk.RemovalPolicy.DESTROY,
+      }
+    );
+
     const textGenLambdaDockerFunc = new lambda.DockerImageFunction(
       this,
       `${id}-TextGenLambdaDockerFunc`,
@@ -998,6 +1019,7 @@ export class ApiGatewayStack extends cdk.Stack {
           BEDROCK_LLM_PARAM: bedrockLLMParameter.parameterName,
           EMBEDDING_MODEL_PARAM: embeddingModelParameter.parameterName,
           TABLE_NAME_PARAM: tableNameParameter.parameterName,
+          EMBEDDING_CACHE_TABLE: embeddingCacheTable.tableName,
         },
       }
     );
@@ -1062,6 +1084,18 @@ export class ApiGatewayStack extends cdk.Stack {
       })
     );
 
+    // Allow the function to invoke itself asynchronously for session naming.
+    // The ARN is built from the name to avoid a dependency cycle with the role.
+    textGenLambdaDockerFunc.addToRolePolicy(
+      new iam.PolicyStatement({
+        effect: iam.Effect.ALLOW,
+        actions: ["lambda:InvokeFunction"],
+        resources: [
+          `arn:aws:lambda:${this.region}:${this.account}:function:${id}-TextGenLambdaDockerFunc`,
+        ],
+      })
+    );
+
     // Grant access to SSM Parameter Store for specific parameters
     textGenLambdaDockerFunc.addToRolePolicy(
       new iam.PolicyStatement({
@@ -1512,6 +1546,9 @@ export class ApiGatewayStack extends cdk.Stack {
       responseMappingTemplate: appsync.MappingTemplate.lambdaResult(),
     });
 
+    // Text generation streams answers to students through sendNotification
+    textGenLambdaDockerFunc.addEnvironment("APPSYNC_API_URL", this.eventApi.graphqlUrl);
+
     // Add permission to allow main.py Lambda to invoke eventNotification Lambda
     notificationFunction.grantInvoke(new iam.ServicePrincipal("lambda.amazonaws.com"));
 
@@ -1609,7 +1646,8 @@ export class ApiGatewayStack extends cdk.Stack {
     
     sqsTrigger.addEventSource(
       new lambdaEventSources.SqsEventSource(messagesQueue, {
-        batchSize: 1, // Process messages one at a time
+        batchSize: 10, // Requests for the same course in a batch share one export
+        reportBatchItemFailures: true,
       })
     );
 
@@ -1639,6 +1677,7 @@ export class ApiGatewayStack extends cdk.Stack {
           "s3:GetObject",
           "s3:DeleteObject",
           "s3:HeadObject",
+          "s3:AbortMultipartUpload",
         ],
         resources: [
           `arn:aws:s3:::${chatlogsBucket.bucketName}/*`, // Grant access to all objects within this bucket
@@ -1672,6 +1711,8 @@ export class ApiGatewayStack extends cdk.Stack {
       memorySize: 128,
       vpc: vpcStack.vpc,
       environment: {
+        SM_DB_CREDENTIALS: db.secretPathUser.secretName,
+        RDS_PROXY_ENDPOINT: db.rdsProxyEndpoint,
         BUCKET: chatlogsBucket.bucketName,
         REGION: this.region,
       },
@@ -1687,6 +1728,20 @@ export class ApiGatewayStack extends cdk.Stack {
     // Grant the Lambda function read-only permissions to the S3 bucket
     chatlogsBucket.grantRead(getChatLogsFunction);
 
+    // Grant access to Secret Manager
+    getChatLogsFunction.addToRolePolicy(
+      new iam.PolicyStatement({
+        effect: iam.Effect.ALLOW,
+        actions: [
+          //Secrets Manager
+          "secretsmanager:GetSecretValue",
+        ],
+        resources: [
+          `arn:aws:secretsmanager:${this.region}:${this.account}:secret:*`,
+        ],
+      })
+    );
+
     // Add the permission to the Lambda function's policy to allow API Gateway access
     getChatLogsFunction.addPermission("AllowApiGatewayInvoke", {
       principal: new iam.ServicePrincipal("apigateway.amazonaws.com"),
@@ -1,12 +1,19 @@
+import io
 import os
 import json
+import uuid
+import heapq
+import itertools
 import logging
 import boto3
 import csv
 import httpx
 import time
 import psycopg2
+import pyarrow as pa
+import pyarrow.parquet as pq
 from datetime import datetime
+from urllib.parse import quote
 from botocore.exceptions import ClientError
 
 # Set up basic logging
@@ -19,6 +26,53 @@ REGION = os.environ["REGION"]
 CHATLOGS_BUCKET = os.environ["CHATLOGS_BUCKET"]
 RDS_PROXY_ENDPOINT = os.environ["RDS_PROXY_ENDPOINT"]
 APPSYNC_API_URL = os.environ["APPSYNC_API_URL"]
+# Rows fetched from the server-side cursor per round trip
+EXPORT_FETCH_SIZE = int(os.environ.get("EXPORT_FETCH_SIZE", "5000"))
+# Size of each multipart upload part; S3 requires at least 5 MiB for all but the last part
+EXPORT_PART_SIZE = max(int(os.environ.get("EXPORT_PART_SIZE", str(8 * 1024 * 1024))), 5 * 1024 * 1024)
+# Receives after which a failing export is dropped instead of retried
+EXPORT_MAX_RECEIVES = int(os.environ.get("EXPORT_MAX_RECEIVES", "3"))
+# A notification is published again every NOTIFICATION_REPUBLISH_INTERVAL seconds until
+# the client acknowledges it, for at most NOTIFICATION_ACK_TIMEOUT seconds. The window only
+# covers a client that is still subscribing: one that has left the page finds the completed
+# request through check_notifications_status, so the batch is not held up waiting for it.
+NOTIFICATION_REPUBLISH_INTERVAL = float(os.environ.get("NOTIFICATION_REPUBLISH_INTERVAL", "1"))
+NOTIFICATION_ACK_TIMEOUT = float(os.environ.get("NOTIFICATION_ACK_TIMEOUT", "5"))
+# Exports leave out the last few seconds of messages, whose transactions may still be committing.
+# They are included in the next incremental export, since the watermark never passes them.
+EXPORT_WATERMARK_LAG = float(os.environ.get("EXPORT_WATERMARK_LAG", "5"))
+
+# "full" exports every message of the course, "incremental" only those sent since the
+# instructor's last export, "compact" merges the instructor's deltas into a new full export
+EXPORT_MODES = ("full", "incremental", "compact")
+
+CSV_HEADER = [
+    "user_id", "module_name", "concept_name", "session_id",
+    "message", "sent_by_student", "competency_status", "timestamp"
+]
+# Export order, as CSV column indexes: user_id, module_name, session_id, timestamp.
+# Compaction merges exports by comparing these fields as text, which matches the query's
+# ORDER BY: uuids compare like their hex text, COLLATE "C" compares code points, a NULL
+# module name is written as "" and sorted first, and str() of a timestamp only omits the
+# microseconds when they are zero, so a shorter one is also the earlier one.
+SORT_COLUMNS = (0, 1, 3, 7)
+# Rows per Parquet row group; one row group of one module is held in memory at a time
+PARQUET_ROW_GROUP_SIZE = int(os.environ.get("PARQUET_ROW_GROUP_SIZE", "100000"))
+
+# Parquet export schema. module_name is the partition key, so it is stored in the
+# object path instead of the files. Repeated strings are dictionary encoded.
+PARQUET_SCHEMA = pa.schema([
+    ("user_id", pa.string()),
+    ("concept_name", pa.string()),
+    ("session_id", pa.string()),
+    ("message", pa.string()),
+    ("sent_by_student", pa.bool_()),
+    ("competency_status", pa.string()),
+    ("timestamp", pa.timestamp("us")),
+])
+PARQUET_DICTIONARY_COLUMNS = ["user_id", "concept_name", "session_id", "competency_status"]
+# Chat messages can be longer than the csv module's default field limit
+csv.field_size_limit(2 ** 31 - 1)
 
 # AWS Clients
 secrets_manager_client = boto3.client("secretsmanager")
@@ -27,6 +81,8 @@ s3_client = boto3.client("s3")
 # Cached resources
 connection = None
 db_secret = None
+# Reused across notifications and invocations
+http_client = httpx.Client(timeout=10.0)
 
 def get_secret():
     global db_secret
@@ -39,20 +95,22 @@ def get_secret():
             raise
     return db_secret
 
+def get_connection_string():
+    secret = get_secret()
+    connection_params = {
+        'dbname': secret["dbname"],
+        'user': secret["username"],
+        'password': secret["password"],
+        'host': RDS_PROXY_ENDPOINT,
+        'port': secret["port"]
+    }
+    return " ".join([f"{key}={value}" for key, value in connection_params.items()])
+
 def connect_to_db():
     global connection
     if connection is None or connection.closed:
         try:
-            secret = get_secret()
-            connection_params = {
-                'dbname': secret["dbname"],
-                'user': secret["username"],
-                'password': secret["password"],
-                'host': RDS_PROXY_ENDPOINT,
-                'port': secret["port"]
-            }
-            connection_string = " ".join([f"{key}={value}" for key, value in connection_params.items()])
-            connection = psycopg2.connect(connection_string)
+            connection = psycopg2.connect(get_connection_string())
             logger.info("Connected to the database!")
             print("Connected to the database!")
         except Exception as e:
@@ -64,18 +122,44 @@ def connect_to_db():
     return connection
 
 
-def query_chat_logs(course_id):
+def open_snapshot():
     """
-    Queries the database to fetch chat logs for a given course_id.
+    Opens a separate, read-only REPEATABLE READ connection for the queries of one export.
+
+    Every query on it sees the same snapshot of the database and the same LOCALTIMESTAMP,
+    so exports of the same course built from separate queries contain the same rows. It is
+    separate from the shared connection, whose writes commit while the export is running.
     """
-    connection = connect_to_db()
+    snapshot = psycopg2.connect(get_connection_string())
+    snapshot.set_session(isolation_level="REPEATABLE READ", readonly=True)
+    return snapshot
+
+
+def query_chat_logs(course_id, since=None, by_module=False, snapshot=None):
+    """
+    Streams the chat logs of a course, in export order, through a server-side cursor.
+
+    Only EXPORT_FETCH_SIZE rows are held in memory at a time, however large the course.
+    Each row has the CSV_HEADER columns followed by the message_id.
+
+    Args:
+    course_id (str): The course to export.
+    since (Optional[tuple]): A (time_sent, message_id) watermark; only later messages are returned.
+    by_module (bool): Order by module first, so each module's rows are contiguous.
+    snapshot (Optional[connection]): A connection from open_snapshot. Its transaction is
+        left open for the next query; the caller closes it.
+    """
+    connection = snapshot or connect_to_db()
     if connection is None:
         error_message = "Database connection is unavailable."
         logger.error(error_message)
         raise Exception(error_message)
 
+    cur = None
     try:
-        cur = connection.cursor()
+        # A named cursor keeps the result set on the server
+        cur = connection.cursor(name=f"chat_logs_{uuid.uuid4().hex}")
+        cur.itersize = EXPORT_FETCH_SIZE
         query = """
             SELECT 
                 u.user_id, 
@@ -88,7 +172,8 @@ def query_chat_logs(course_id):
                     WHEN sm.module_score = 100 THEN 'complete' 
                     ELSE 'incomplete' 
                 END AS competency_status,
-                m.time_sent AS timestamp
+                m.time_sent AS timestamp,
+                m.message_id
             FROM 
                 "Messages" m
             JOIN 
@@ -105,68 +190,380 @@ def query_chat_logs(course_id):
                 "Users" u ON e.user_id = u.user_id
             WHERE 
                 cc.course_id = %s
+                AND m.time_sent <= LOCALTIMESTAMP - make_interval(secs => %s)
+                {since_filter}
             ORDER BY 
-                u.user_id, cm.module_name, s.session_id, m.time_sent;
+                {order_by};
         """
-        cur.execute(query, (course_id,))
-        results = cur.fetchall()
-        logger.info(f"Fetched {len(results)} chat log records for course_id: {course_id}.")
-        print(f"Fetched {len(results)} chat log records for course_id: {course_id}.")
+        # Must match SORT_COLUMNS, see there
+        order_by = 'u.user_id, cm.module_name COLLATE "C" NULLS FIRST, s.session_id, m.time_sent'
+        if by_module:
+            order_by = 'cm.module_name COLLATE "C" NULLS FIRST, u.user_id, s.session_id, m.time_sent'
+        if since is None:
+            cur.execute(query.format(since_filter="", order_by=order_by), (course_id, EXPORT_WATERMARK_LAG))
+        else:
+            since_filter = "AND (m.time_sent, m.message_id) > (%s, %s)"
+            cur.execute(query.format(since_filter=since_filter, order_by=order_by), (course_id, EXPORT_WATERMARK_LAG, since[0], since[1]))
+        count = 0
+        for row in cur:
+            count += 1
+            yield row
         cur.close()
-        return results
+        if snapshot is None:
+            connection.commit()
+        logger.info(f"Streamed {count} chat log records for course_id: {course_id}.")
+        print(f"Streamed {count} chat log records for course_id: {course_id}.")
+    except GeneratorExit:
+        # The consumer stopped early, e.g. because the upload failed
+        if cur and not cur.closed:
+            cur.close()
+        if snapshot is None:
+            connection.rollback()
+        raise
+    except Exception as e:
+        if cur and not cur.closed:
+            cur.close()
+        if snapshot is None:
+            connection.rollback()
+        logger.error(f"Error querying chat logs for course_id {course_id}: {e}")
+        raise
+
+
+class WatermarkTracker:
+    """
+    Passes chat log rows through, remembering the latest (time_sent, message_id) among them.
+    """
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.watermark = None
+
+    def __iter__(self):
+        for row in self.rows:
+            if row[7] is not None and (self.watermark is None or (row[7], row[8]) > self.watermark):
+                self.watermark = (row[7], row[8])
+            yield row
+
+    def close(self):
+        self.rows.close()
+
+
+def export_file_stem():
+    """
+    Returns a unique, time-ordered name for a new export.
+
+    Names start with the export time, which the instructor page displays and list_exports
+    sorts by; the random suffix keeps exports made at the same time from overwriting each other.
+    """
+    return f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')}-{uuid.uuid4().hex[:8]}"
+
+
+def get_watermark(course_id, instructor_email):
+    """
+    Returns the (time_sent, message_id) of the last message in the instructor's exports, or None.
+    """
+    connection = connect_to_db()
+    cur = None
+    try:
+        cur = connection.cursor()
+        cur.execute("""
+            SELECT last_time_sent, last_message_id
+            FROM "Chatlog_Export_Watermarks"
+            WHERE course_id = %s AND instructor_email = %s;
+        """, (course_id, instructor_email))
+        result = cur.fetchone()
+        connection.commit()
+        cur.close()
+        return tuple(result) if result else None
     except Exception as e:
         if cur:
             cur.close()
         connection.rollback()
-        logger.error(f"Error querying chat logs for course_id {course_id}: {e}")
+        logger.error(f"Error fetching export watermark for course_id {course_id}, instructor_email {instructor_email}: {e}")
+        raise
+
+
+def save_watermark(course_id, instructor_emails, watermark):
+    """
+    Advances the export watermark of each instructor. A watermark never moves backwards.
+    """
+    connection = connect_to_db()
+    cur = None
+    try:
+        cur = connection.cursor()
+        for instructor_email in instructor_emails:
+            cur.execute("""
+                INSERT INTO "Chatlog_Export_Watermarks" (course_id, instructor_email, last_time_sent, last_message_id)
+                VALUES (%s, %s, %s, %s)
+                ON CONFLICT (course_id, instructor_email) DO UPDATE
+                SET last_time_sent = EXCLUDED.last_time_sent,
+                    last_message_id = EXCLUDED.last_message_id,
+                    time_updated = now()
+                WHERE ("Chatlog_Export_Watermarks".last_time_sent, "Chatlog_Export_Watermarks".last_message_id)
+                    < (EXCLUDED.last_time_sent, EXCLUDED.last_message_id);
+            """, (course_id, instructor_email, watermark[0], watermark[1]))
+        connection.commit()
+        cur.close()
+    except Exception as e:
+        if cur:
+            cur.close()
+        connection.rollback()
+        logger.error(f"Error saving export watermark for course_id {course_id}: {e}")
         raise
 
 
-def write_to_csv(data, course_id, instructor_email):
+def record_exports(exports):
+    """
+    Adds written files to Chatlog_Exports, the index the chat log listing pages through.
+
+    Raises on failure: the listing trusts the index, so a file missing from it would
+    never be listed. Use record_export to also remove the file from S3.
+
+    Args:
+    exports (list): (S3 key, row count or None) for each file, keyed as {course_id}/{instructor_email}/{file_name}.
+    """
+    connection = connect_to_db()
+    cur = None
+    try:
+        cur = connection.cursor()
+        for s3_key, row_count in exports:
+            course_id, instructor_email, file_name = s3_key.split("/", 2)
+            cur.execute("""
+                INSERT INTO "Chatlog_Exports" (course_id, instructor_email, file_name, row_count)
+                VALUES (%s, %s, %s, %s)
+                ON CONFLICT (course_id, instructor_email, file_name) DO NOTHING;
+            """, (course_id, instructor_email, file_name, row_count))
+        connection.commit()
+        cur.close()
+    except Exception as e:
+        if cur:
+            cur.close()
+        connection.rollback()
+        logger.error(f"Error recording chat log exports: {e}")
+        raise
+
+
+def record_export(s3_key, row_count=None):
+    """
+    Adds a file just written to S3 to Chatlog_Exports, deleting the file if that fails.
+
+    The export then fails as a whole and is retried, instead of leaving a file in S3
+    that the listing does not know about.
+    """
+    try:
+        record_exports([(s3_key, row_count)])
+    except Exception:
+        try:
+            s3_client.delete_object(Bucket=CHATLOGS_BUCKET, Key=s3_key)
+        except ClientError as e:
+            logger.error(f"Error deleting unrecorded export {s3_key}: {e}")
+        raise
+
+
+def forget_exports(s3_keys):
+    """
+    Removes files about to be deleted from Chatlog_Exports.
+
+    Raises on failure, so the files are only deleted once they are no longer listed.
+    """
+    connection = connect_to_db()
+    cur = None
+    try:
+        cur = connection.cursor()
+        for s3_key in s3_keys:
+            course_id, instructor_email, file_name = s3_key.split("/", 2)
+            cur.execute("""
+                DELETE FROM "Chatlog_Exports"
+                WHERE course_id = %s AND instructor_email = %s AND file_name = %s;
+            """, (course_id, instructor_email, file_name))
+        connection.commit()
+        cur.close()
+    except Exception as e:
+        if cur:
+            cur.close()
+        connection.rollback()
+        logger.error(f"Error removing chat log exports: {e}")
+        raise
+
+
+class MultipartUpload:
+    """
+    Writes an S3 object through a multipart upload, sending a part whenever EXPORT_PART_SIZE bytes are buffered.
+
+    It is file-like enough (write, tell, flush) to be used as a pyarrow output stream.
+    """
+
+    def __init__(self, bucket, key, content_type):
+        self.bucket = bucket
+        self.key = key
+        self.buffer = io.BytesIO()
+        self.parts = []
+        self.position = 0
+        self.upload_id = s3_client.create_multipart_upload(
+            Bucket=bucket, Key=key, ContentType=content_type
+        )["UploadId"]
+
+    def write(self, data):
+        self.buffer.write(data)
+        self.position += len(data)
+        if self.buffer.tell() >= EXPORT_PART_SIZE:
+            self._upload_part()
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    @property
+    def closed(self):
+        return False
+
+    def flush(self):
+        pass
+
+    def _upload_part(self):
+        part_number = len(self.parts) + 1
+        response = s3_client.upload_part(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            PartNumber=part_number,
+            Body=self.buffer.getvalue()
+        )
+        self.parts.append({"PartNumber": part_number, "ETag": response["ETag"]})
+        self.buffer = io.BytesIO()
+
+    def complete(self):
+        # The last part may be smaller than 5 MiB, and an empty object still needs one part
+        if self.buffer.tell() or not self.parts:
+            self._upload_part()
+        s3_client.complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            MultipartUpload={"Parts": self.parts}
+        )
+
+    def abort(self):
+        try:
+            s3_client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+        except ClientError as e:
+            logger.error(f"Error aborting multipart upload of {self.key}: {e}")
+
+
+def write_to_csv(rows, s3_key):
     """
-    Writes the queried data to a CSV file.
+    Writes chat log rows as CSV straight to S3, one multipart part at a time.
+
+    Returns:
+    int: The number of rows written.
     """
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    file_name = f"{timestamp}.csv"
-    file_dir = f"/tmp/{course_id}/{instructor_email}"
-    file_path = f"{file_dir}/{file_name}"
+    upload = MultipartUpload(CHATLOGS_BUCKET, s3_key, "text/csv")
+    text = io.StringIO()
+    writer = csv.writer(text)
+    count = 0
 
     try:
-        # Ensure the directory exists (including nested directories)
-        os.makedirs(file_dir, exist_ok=True)
-
-        # Write the data to the CSV file
-        with open(file_path, mode="w", newline="") as file:
-            writer = csv.writer(file)
-            writer.writerow([
-                "user_id", "module_name", "concept_name", "session_id", 
-                "message", "sent_by_student", "competency_status", "timestamp"
-            ])
-            writer.writerows(data)
-
-        logger.info(f"CSV file created successfully: {file_path}")
-        print(f"CSV file created successfully: {file_path}")
-        return file_path, file_name
+        writer.writerow(CSV_HEADER)
+        for row in rows:
+            writer.writerow(row[:len(CSV_HEADER)])
+            count += 1
+            # Encode in chunks rather than per row
+            if text.tell() >= 64 * 1024:
+                upload.write(text.getvalue().encode("utf-8"))
+                text.seek(0)
+                text.truncate()
+        upload.write(text.getvalue().encode("utf-8"))
+        upload.complete()
     except Exception as e:
-        logger.error(f"Error writing to CSV file {file_name}: {e}")
+        upload.abort()
+        logger.error(f"Error writing CSV file {s3_key}: {e}")
         raise
 
+    logger.info(f"CSV file uploaded successfully: s3://{CHATLOGS_BUCKET}/{s3_key} ({count} rows)")
+    print(f"CSV file uploaded successfully: s3://{CHATLOGS_BUCKET}/{s3_key} ({count} rows)")
+    record_export(s3_key, count)
+    return count
+
 
-def upload_to_s3(file_path, course_id, instructor_email, file_name):
+def write_module_partition(module_name, rows, s3_prefix):
     """
-    Uploads the file to S3 with the specified path.
+    Writes one module's rows as a Parquet file, one row group at a time.
+
+    Returns:
+    str: The S3 key of the file.
     """
-    # Construct the S3 key (path in the bucket)
-    s3_key = f"{course_id}/{instructor_email}/{file_name}"
+    s3_key = f"{s3_prefix}module_name={quote(module_name or '', safe='')}/part-0.parquet"
+    upload = MultipartUpload(CHATLOGS_BUCKET, s3_key, "application/vnd.apache.parquet")
+    try:
+        writer = pq.ParquetWriter(
+            pa.PythonFile(upload, mode="w"),
+            PARQUET_SCHEMA,
+            compression="zstd",
+            use_dictionary=PARQUET_DICTIONARY_COLUMNS
+        )
+        batch = iter(rows)
+        count = 0
+        while True:
+            chunk = list(itertools.islice(batch, PARQUET_ROW_GROUP_SIZE))
+            if not chunk:
+                break
+            count += len(chunk)
+            columns = list(zip(*chunk))
+            writer.write_table(pa.Table.from_arrays([
+                pa.array([str(value) for value in columns[0]]),
+                pa.array(columns[2]),
+                pa.array([str(value) for value in columns[3]]),
+                pa.array(columns[4]),
+                pa.array(columns[5]),
+                pa.array(columns[6]),
+                pa.array(columns[7], type=pa.timestamp("us")),
+            ], schema=PARQUET_SCHEMA))
+        writer.close()
+        upload.complete()
+    except Exception as e:
+        upload.abort()
+        logger.error(f"Error writing Parquet file {s3_key}: {e}")
+        raise
+    record_export(s3_key, count)
+    return s3_key
+
 
+def write_to_parquet(course_id, s3_prefix, snapshot=None):
+    """
+    Exports a course's chat logs as Parquet, partitioned by module under s3_prefix.
+
+    The rows are streamed in module order, so only one partition is written at a time.
+    Pass the snapshot the CSV was queried in to export the same rows.
+
+    Returns:
+    list: The S3 keys of the partition files.
+    """
+    rows = query_chat_logs(course_id, by_module=True, snapshot=snapshot)
+    keys = []
     try:
-        s3_client.upload_file(file_path, CHATLOGS_BUCKET, s3_key)
-        logger.info(f"File uploaded successfully to S3: s3://{CHATLOGS_BUCKET}/{s3_key}")
-        print(f"File uploaded successfully to S3: s3://{CHATLOGS_BUCKET}/{s3_key}")
-        return f"s3://{CHATLOGS_BUCKET}/{s3_key}"
+        for module_name, module_rows in itertools.groupby(rows, key=lambda row: row[1]):
+            keys.append(write_module_partition(module_name, module_rows, s3_prefix))
+    finally:
+        rows.close()
+
+    logger.info(f"Parquet export uploaded successfully: s3://{CHATLOGS_BUCKET}/{s3_prefix} ({len(keys)} modules)")
+    print(f"Parquet export uploaded successfully: s3://{CHATLOGS_BUCKET}/{s3_prefix} ({len(keys)} modules)")
+    return keys
+
+
+def copy_in_s3(source_key, s3_key, row_count=None):
+    """
+    Copies an export to another instructor's prefix without downloading it.
+    """
+    try:
+        # The managed copy switches to a multipart copy for large objects
+        s3_client.copy({"Bucket": CHATLOGS_BUCKET, "Key": source_key}, CHATLOGS_BUCKET, s3_key)
+        logger.info(f"File copied successfully to S3: s3://{CHATLOGS_BUCKET}/{s3_key}")
     except Exception as e:
-        logger.error(f"Error uploading file to S3: {e}")
+        logger.error(f"Error copying file to S3: {e}")
         raise
+    record_export(s3_key, row_count)
+    return f"s3://{CHATLOGS_BUCKET}/{s3_key}"
 
 def update_completion_status(course_id, instructor_email, request_id):
     """
@@ -199,80 +596,389 @@ def update_completion_status(course_id, instructor_email, request_id):
 
 
 def invoke_event_notification(request_id, message="Chat logs successfully uploaded"):
-    try:
-        query = """
-        mutation sendNotification($message: String!, $request_id: String!) {
-            sendNotification(message: $message, request_id: $request_id) {
-                message
-                request_id
-            }
+    """
+    Publishes a notification to the instructor's client through the AppSync sendNotification mutation.
+
+    The mutation succeeds whether or not anyone is subscribed, see notify_until_acknowledged.
+
+    Args:
+    request_id (str): The request ID the client subscribed to.
+    message (str): The notification message.
+    """
+    query = """
+    mutation sendNotification($message: String!, $request_id: String!) {
+        sendNotification(message: $message, request_id: $request_id) {
+            message
+            request_id
         }
-        """
-        headers = {"Content-Type": "application/json", "Authorization": "API_KEY"}
-        payload = {
-            "query": query,
-            "variables": {
-                "message": message,
-                "request_id": request_id,
-            }
+    }
+    """
+    headers = {"Content-Type": "application/json", "Authorization": "API_KEY"}
+    payload = {
+        "query": query,
+        "variables": {
+            "message": message,
+            "request_id": request_id,
         }
+    }
 
-        # Delay to ensure client subscribes before mutation is sent 
-        time.sleep(1)
+    response = http_client.post(APPSYNC_API_URL, headers=headers, json=payload)
+    response_data = response.json()
 
-        # Send the request to AppSync
-        with httpx.Client() as client:
-            response = client.post(APPSYNC_API_URL, headers=headers, json=payload)
-            response_data = response.json()
+    if response.status_code != 200 or "errors" in response_data:
+        raise Exception(f"Failed to send notification: {response_data}")
 
-            logger.info(f"RESPONSE: {response}")
-            print(f"RESPONSE: {response}")
+    logger.info(f"Notification sent successfully: {response_data}")
+    print(f"Notification sent successfully: {response_data}")
 
-            if response.status_code != 200 or "errors" in response_data:
-                logger.error(f"Failed to send notification to AppSync: {response_data}")
-                raise Exception(f"Failed to send notification: {response_data}")
 
-            logger.info(f"Notification sent successfully: {response_data}")
-            print(f"Notification sent successfully: {response_data}")
+def get_unacknowledged(request_ids):
+    """
+    Returns the request IDs whose completed notification the client has not acknowledged yet.
+
+    A client acknowledges a notification by removing its chatlogs_notifications row
+    (DELETE /instructor/remove_completed_notification) as soon as it receives it.
+    """
+    connection = connect_to_db()
+    cur = None
+    try:
+        cur = connection.cursor()
+        cur.execute("""
+            SELECT request_id
+            FROM chatlogs_notifications
+            WHERE request_id = ANY(%s::uuid[]) AND completion = TRUE;
+        """, (list(request_ids),))
+        rows = cur.fetchall()
+        connection.commit()
+        cur.close()
+        return {str(row[0]) for row in rows}
     except Exception as e:
-        logger.error(f"Error invoking AppSync notification: {e}")
+        if cur:
+            cur.close()
+        connection.rollback()
+        logger.error(f"Error checking notification acknowledgements: {e}")
         raise
 
 
+def notify_until_acknowledged(notifications, deadline):
+    """
+    Publishes each notification until its client acknowledges it, or until the deadline.
+
+    The client subscribes to onNotify only after its request is queued, and a
+    notification published before that is lost. Instead of guessing how long the
+    client takes to subscribe, each notification is published again every
+    NOTIFICATION_REPUBLISH_INTERVAL seconds while its chatlogs_notifications row
+    is still there. A client that has gone away finds the completed row through
+    check_notifications_status when it comes back.
+
+    Args:
+    notifications (dict): request_id -> notification message.
+    deadline (float): The time.monotonic() value after which publishing stops.
+    """
+    pending = dict(notifications)
+    while pending:
+        for request_id, message in pending.items():
+            try:
+                invoke_event_notification(request_id, message=message)
+            except Exception as e:
+                logger.error(f"Error sending notification for request {request_id}: {e}")
+
+        if time.monotonic() + NOTIFICATION_REPUBLISH_INTERVAL > deadline:
+            break
+        time.sleep(NOTIFICATION_REPUBLISH_INTERVAL)
+        try:
+            unacknowledged = get_unacknowledged(pending)
+        except Exception:
+            break
+        pending = {request_id: message for request_id, message in pending.items() if request_id in unacknowledged}
+
+    if pending:
+        logger.warning(f"Notifications not acknowledged before the deadline: {list(pending)}")
+
+
+def get_export_jobs(event):
+    """
+    Groups the SQS records of a batch by course, so each course is exported once.
+
+    Returns:
+    dict: course_id -> list of jobs with messageId, instructor_email, request_id,
+    mode, include_parquet and receive_count, in queue order.
+    """
+    courses = {}
+    for record in event["Records"]:
+        try:
+            message_body = json.loads(record["body"])
+        except (TypeError, ValueError) as e:
+            logger.error(f"Error parsing SQS message {record.get('messageId')}: {e}")
+            continue
+
+        course_id = message_body.get("course_id")
+        instructor_email = message_body.get("instructor_email")
+        request_id = message_body.get("request_id")
+
+        if not course_id or not instructor_email or not request_id:
+            logger.error("Missing required parameters: course_id or instructor_email or request_id.")
+            continue
+
+        mode = message_body.get("mode", "full")
+        if mode not in EXPORT_MODES:
+            logger.error(f"Unknown export mode {mode}, exporting all chat logs.")
+            mode = "full"
+
+        include_parquet = bool(message_body.get("include_parquet", False))
+        if include_parquet and mode != "full":
+            # Rejected by the API; queued before that check existed
+            logger.warning(f"include_parquet is only supported for full exports, ignoring it for request {request_id}.")
+            include_parquet = False
+
+        attributes = record.get("attributes", {})
+        courses.setdefault(course_id, []).append({
+            "messageId": record.get("messageId"),
+            "instructor_email": instructor_email,
+            "request_id": request_id,
+            "mode": mode,
+            "include_parquet": include_parquet,
+            "receive_count": int(attributes.get("ApproximateReceiveCount", "1")),
+        })
+    return courses
+
+
+def export_full(course_id, instructors, parquet_instructors=()):
+    """
+    Exports a course's chat logs once and places a copy under each instructor's prefix.
+
+    The export also becomes the baseline for the instructors' incremental exports.
+    Instructors in parquet_instructors also get a Parquet copy under parquet/{export name}/,
+    queried in the same snapshot as the CSV so both contain the same rows.
+
+    Returns:
+    dict: instructor_email -> S3 URI of their copy.
+    """
+    export_name = export_file_stem()
+    file_name = f"{export_name}.csv"
+
+    source_key = f"{course_id}/{instructors[0]}/{file_name}"
+    snapshot = open_snapshot()
+    try:
+        rows = WatermarkTracker(query_chat_logs(course_id, snapshot=snapshot))
+        try:
+            count = write_to_csv(rows, source_key)
+        finally:
+            rows.close()
+
+        parquet_keys = []
+        if parquet_instructors:
+            parquet_instructors = list(parquet_instructors)
+            source_prefix = f"{course_id}/{parquet_instructors[0]}/parquet/{export_name}/"
+            parquet_keys = write_to_parquet(course_id, source_prefix, snapshot)
+    finally:
+        snapshot.close()
+
+    uris = {instructors[0]: f"s3://{CHATLOGS_BUCKET}/{source_key}"}
+    for instructor_email in instructors[1:]:
+        uris[instructor_email] = copy_in_s3(source_key, f"{course_id}/{instructor_email}/{file_name}", count)
+
+    if parquet_keys:
+        for instructor_email in parquet_instructors[1:]:
+            prefix = f"{course_id}/{instructor_email}/parquet/{export_name}/"
+            for key in parquet_keys:
+                copy_in_s3(key, prefix + key[len(source_prefix):])
+
+    if rows.watermark is not None:
+        save_watermark(course_id, instructors, rows.watermark)
+    return uris
+
+
+def export_incremental(course_id, instructor_email):
+    """
+    Exports the messages sent since the instructor's last export as a delta file under deltas/.
+
+    Without a previous export, this is a full export.
+
+    Returns:
+    str: The notification message.
+    """
+    watermark = get_watermark(course_id, instructor_email)
+    if watermark is None:
+        logger.info(f"No previous export for course_id {course_id}, instructor_email {instructor_email}; exporting everything.")
+        return f"Chat logs uploaded to {export_full(course_id, [instructor_email])[instructor_email]}"
+
+    s3_key = f"{course_id}/{instructor_email}/deltas/{export_file_stem()}.csv"
+    rows = WatermarkTracker(query_chat_logs(course_id, since=watermark))
+    try:
+        row_iterator = iter(rows)
+        first_row = next(row_iterator, None)
+        if first_row is None:
+            logger.info(f"No new chat logs for course_id {course_id} since {watermark[0]}.")
+            return "No new chat logs since the last export"
+        write_to_csv(itertools.chain([first_row], row_iterator), s3_key)
+    finally:
+        rows.close()
+
+    save_watermark(course_id, [instructor_email], rows.watermark)
+    return f"Chat logs uploaded to s3://{CHATLOGS_BUCKET}/{s3_key}"
+
+
+def read_csv_from_s3(s3_key):
+    """
+    Streams the data rows of an exported CSV file from S3.
+    """
+    body = s3_client.get_object(Bucket=CHATLOGS_BUCKET, Key=s3_key)["Body"]
+    with io.TextIOWrapper(body, encoding="utf-8", newline="") as file:
+        reader = csv.reader(file)
+        next(reader, None)  # header
+        yield from reader
+
+
+def list_exports(course_id, instructor_email):
+    """
+    Lists an instructor's exports.
+
+    Returns:
+    tuple: (full export keys, delta keys), each oldest first.
+    """
+    prefix = f"{course_id}/{instructor_email}/"
+    snapshots, deltas = [], []
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=CHATLOGS_BUCKET, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            name = obj["Key"][len(prefix):]
+            if not name.endswith(".csv"):
+                continue
+            if "/" not in name:
+                snapshots.append(obj["Key"])
+            elif name.startswith("deltas/") and name.count("/") == 1:
+                deltas.append(obj["Key"])
+    # File names start with the export time, so name order is time order
+    return sorted(snapshots), sorted(deltas)
+
+
+def delete_exports(s3_keys):
+    """
+    Deletes exports from S3 after removing them from Chatlog_Exports.
+    """
+    if not s3_keys:
+        return
+    forget_exports(s3_keys)
+    for start in range(0, len(s3_keys), 1000):
+        s3_client.delete_objects(
+            Bucket=CHATLOGS_BUCKET,
+            Delete={"Objects": [{"Key": key} for key in s3_keys[start:start + 1000]]}
+        )
+
+
+def compact_exports(course_id, instructor_email):
+    """
+    Merges the instructor's latest full export and the deltas written after it into a new full export.
+
+    Every input is sorted in export order, so they are combined with a streaming k-way
+    merge and memory use does not depend on their size. The merged deltas are deleted,
+    and so are deltas written before the latest full export, which already contains them.
+
+    Returns:
+    str: The notification message.
+    """
+    snapshots, deltas = list_exports(course_id, instructor_email)
+    base = snapshots[-1] if snapshots else None
+    stale = []
+    if base is not None:
+        base_name = base.rsplit("/", 1)[1]
+        stale = [key for key in deltas if key.rsplit("/", 1)[1] < base_name]
+        deltas = [key for key in deltas if key.rsplit("/", 1)[1] >= base_name]
+
+    if not deltas:
+        if base is None:
+            return f"Chat logs uploaded to {export_full(course_id, [instructor_email])[instructor_email]}"
+        delete_exports(stale)
+        logger.info(f"Nothing to compact for course_id {course_id}, instructor_email {instructor_email}; removed {len(stale)} stale deltas.")
+        return f"Chat logs uploaded to s3://{CHATLOGS_BUCKET}/{base}"
+
+    s3_key = f"{course_id}/{instructor_email}/{export_file_stem()}.csv"
+    sources = [read_csv_from_s3(key) for key in ([base] if base else []) + deltas]
+    try:
+        merged = heapq.merge(*sources, key=lambda row: tuple(row[index] for index in SORT_COLUMNS))
+        count = write_to_csv(merged, s3_key)
+    finally:
+        for source in sources:
+            source.close()
+
+    delete_exports(stale + deltas)
+    logger.info(f"Compacted {len(deltas)} deltas into {s3_key} ({count} rows), removed {len(stale)} stale deltas.")
+    return f"Chat logs compacted to s3://{CHATLOGS_BUCKET}/{s3_key}"
+
+
+def export_course(course_id, jobs):
+    """
+    Runs the export jobs of one course. Full exports requested in the same batch share one export.
+
+    Returns:
+    dict: request_id -> notification message.
+    """
+    messages = {}
+
+    full_jobs = [job for job in jobs if job["mode"] == "full"]
+    if full_jobs:
+        uris = export_full(
+            course_id,
+            list(dict.fromkeys(job["instructor_email"] for job in full_jobs)),
+            list(dict.fromkeys(job["instructor_email"] for job in full_jobs if job["include_parquet"]))
+        )
+        for job in full_jobs:
+            messages[job["request_id"]] = f"Chat logs uploaded to {uris[job['instructor_email']]}"
+
+    for job in jobs:
+        if job["mode"] == "incremental":
+            messages[job["request_id"]] = export_incremental(course_id, job["instructor_email"])
+        elif job["mode"] == "compact":
+            messages[job["request_id"]] = compact_exports(course_id, job["instructor_email"])
+    return messages
+
+
 def handler(event, context):
     try:
         if "Records" not in event:
             logger.error("Invalid event format: missing 'Records'.")
             raise ValueError("Event does not contain 'Records'.")
 
-        for record in event["Records"]:
+        failed_messages = []
+        notifications = {}
+
+        for course_id, jobs in get_export_jobs(event).items():
+            logger.info(f"Exporting chat logs for course_id {course_id} for {len(jobs)} requests.")
             try:
-                message_body = json.loads(record["body"])
-                course_id = message_body.get("course_id")
-                instructor_email = message_body.get("instructor_email")
-                request_id = message_body.get("request_id")
+                messages = export_course(course_id, jobs)
+            except Exception as e:
+                logger.error(f"Error exporting chat logs for course_id {course_id}: {e}")
+                # Retry a few times, then drop the requests so the FIFO group is not blocked
+                if max(job["receive_count"] for job in jobs) < EXPORT_MAX_RECEIVES:
+                    failed_messages.extend(job["messageId"] for job in jobs)
+                continue
 
-                if not course_id or not instructor_email or not request_id:
-                    logger.error("Missing required parameters: course_id or instructor_email or request_id.")
+            for index, job in enumerate(jobs):
+                try:
+                    update_completion_status(course_id, job["instructor_email"], job["request_id"])
+                except Exception as e:
+                    logger.error(f"Error updating completion status for request {job['request_id']}: {e}")
+                    # FIFO: the failed message and every later one in the group are retried
+                    if job["receive_count"] < EXPORT_MAX_RECEIVES:
+                        failed_messages.extend(later["messageId"] for later in jobs[index:])
+                        break
                     continue
 
-                chat_logs = query_chat_logs(course_id)
-                print("GOT chat_logs")
-                csv_path, csv_name = write_to_csv(chat_logs, course_id, instructor_email)
-                print("GOT got csv_path and csv_name")
-                s3_uri = upload_to_s3(csv_path, course_id, instructor_email, csv_name)
-                print("GOT s3_uri")
-                update_completion_status(course_id, instructor_email, request_id)
-                print("Updating completion status")
-                invoke_event_notification(request_id, message=f"Chat logs uploaded to {s3_uri}")
-                print("FINALLY SENT NOTIFICATION")
+                notifications[job["request_id"]] = messages[job["request_id"]]
 
-            except Exception as e:
-                logger.error(f"Error processing SQS message: {e}")
-                continue
+        # Leave time to return the batch result before the function times out
+        ack_timeout = NOTIFICATION_ACK_TIMEOUT
+        if context is not None:
+            ack_timeout = min(ack_timeout, context.get_remaining_time_in_millis() / 1000 - 10)
+        notify_until_acknowledged(notifications, time.monotonic() + ack_timeout)
 
-        return {"statusCode": 200, "body": json.dumps({"message": "Processing completed successfully."})}
+        return {
+            "statusCode": 200,
+            "body": json.dumps({"message": "Processing completed successfully."}),
+            "batchItemFailures": [{"itemIdentifier": message_id} for message_id in dict.fromkeys(failed_messages)]
+        }
 
     except Exception as e:
         logger.error(f"Unhandled error in sqsTrigger handler: {e}")
-        return {"statusCode": 500, "body": json.dumps({"error": str(e)})}
\ No newline at end of file
+        return {"statusCode": 500, "body": json.dumps({"error": str(e)})}
@@ -0,0 +1,197 @@
+"""
+Fakes shared by the chat log export tests: an in-memory S3 client and a psycopg2-like database.
+
+Run from cdk/sqsTrigger with the Lambda's requirements installed:
+    python -m pytest tests
+"""
+import csv
+import io
+import os
+import sys
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+os.environ.setdefault("SM_DB_CREDENTIALS", "test-db-credentials")
+os.environ.setdefault("REGION", "ca-central-1")
+os.environ.setdefault("AWS_DEFAULT_REGION", "ca-central-1")
+os.environ.setdefault("CHATLOGS_BUCKET", "test-chatlogs")
+os.environ.setdefault("RDS_PROXY_ENDPOINT", "localhost")
+os.environ.setdefault("APPSYNC_API_URL", "https://example.com/graphql")
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import main
+
+class FakeS3:
+    """
+    Keeps objects in a dict and records every multipart upload part.
+    """
+
+    def __init__(self):
+        self.objects = {}
+        self.uploads = {}
+        self.parts = []
+        # Called with the key before each part is stored, e.g. to observe how far a stream got
+        self.on_upload_part = None
+
+    def create_multipart_upload(self, Bucket, Key, ContentType):
+        upload_id = uuid.uuid4().hex
+        self.uploads[upload_id] = {}
+        return {"UploadId": upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        if self.on_upload_part:
+            self.on_upload_part(Key)
+        self.uploads[UploadId][PartNumber] = Body
+        self.parts.append((Key, PartNumber, len(Body)))
+        return {"ETag": f"etag-{PartNumber}"}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        parts = self.uploads.pop(UploadId)
+        self.objects[Key] = b"".join(parts[part["PartNumber"]] for part in MultipartUpload["Parts"])
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.uploads.pop(UploadId, None)
+
+    def copy(self, CopySource, Bucket, Key):
+        self.objects[Key] = self.objects[CopySource["Key"]]
+
+    def get_object(self, Bucket, Key):
+        return {"Body": io.BytesIO(self.objects[Key])}
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop(Key, None)
+
+    def delete_objects(self, Bucket, Delete):
+        for obj in Delete["Objects"]:
+            self.objects.pop(obj["Key"], None)
+
+    def get_paginator(self, operation):
+        fake = self
+
+        class Paginator:
+            def paginate(self, Bucket, Prefix):
+                keys = sorted(key for key in fake.objects if key.startswith(Prefix))
+                yield {"Contents": [{"Key": key} for key in keys]}
+
+        return Paginator()
+
+class FakeCursor:
+    """
+    A cursor that records its statements. A named cursor streams the course's chat log rows.
+    """
+
+    def __init__(self, database, name=None):
+        self.database = database
+        self.name = name
+        self.itersize = 2000
+        self.rows = []
+        self.yielded = 0
+        self.closed = False
+        self.rowcount = 0
+
+    def execute(self, sql, params=None):
+        self.database.statements.append((sql, params))
+        if self.database.fail_on and self.database.fail_on in sql:
+            raise Exception(f"Injected failure on {self.database.fail_on}")
+        if self.name is not None:
+            self.database.chat_log_queries.append((sql, params))
+            self.rows = self.database.rows_by_course.get(params[0], [])
+        self.rowcount = 1
+
+    def __iter__(self):
+        self.database.streams.append(self)
+        for row in self.rows:
+            self.yielded += 1
+            yield row
+
+    def fetchone(self):
+        return None
+
+    def fetchall(self):
+        return []
+
+    def close(self):
+        self.closed = True
+
+class FakeConnection:
+    def __init__(self, database):
+        self.database = database
+        self.closed = False
+
+    def cursor(self, name=None):
+        return FakeCursor(self.database, name)
+
+    def commit(self):
+        self.database.commits += 1
+
+    def rollback(self):
+        self.database.rollbacks += 1
+
+    def close(self):
+        self.closed = True
+
+class FakeDatabase:
+    """
+    Chat log rows by course, and every statement run against them.
+
+    Set fail_on to a piece of SQL to make statements containing it fail.
+    """
+
+    def __init__(self):
+        self.rows_by_course = {}
+        self.statements = []
+        self.chat_log_queries = []
+        self.streams = []
+        self.commits = 0
+        self.rollbacks = 0
+        self.fail_on = None
+
+    def connection(self):
+        return FakeConnection(self)
+
+def make_rows(count, modules=("Module A", "Module B"), start=datetime(2026, 1, 5, 9, 0, 0)):
+    """
+    Build chat log rows in export order: user_id, module_name, session_id, then time_sent.
+
+    Each row has the CSV_HEADER columns followed by the message_id.
+    """
+    users = sorted(str(uuid.UUID(int=index + 1)) for index in range(max(1, count // 20)))
+    rows = []
+    for index in range(count):
+        user_id = users[index % len(users)]
+        module_name = modules[index % len(modules)]
+        session_id = str(uuid.UUID(int=1000 + index % 7))
+        time_sent = start + timedelta(seconds=index, microseconds=(index % 3) * 250000)
+        rows.append((
+            user_id, module_name, "Concept", session_id, f"message {index} " + "x" * 40,
+            index % 2 == 0, "incomplete", time_sent, str(uuid.UUID(int=10 ** 6 + index)),
+        ))
+    # A NULL module is exported as "" and sorts first
+    return sorted(rows, key=lambda row: (row[0], (row[1] or "").encode("utf-8"), row[3], row[7]))
+
+def csv_bytes(rows):
+    """
+    The CSV export of rows, as write_to_csv writes it.
+    """
+    text = io.StringIO()
+    writer = csv.writer(text)
+    writer.writerow(main.CSV_HEADER)
+    for row in rows:
+        writer.writerow(row[:len(main.CSV_HEADER)])
+    return text.getvalue().encode("utf-8")
+
+@pytest.fixture
+def s3(monkeypatch):
+    fake = FakeS3()
+    monkeypatch.setattr(main, "s3_client", fake)
+    return fake
+
+@pytest.fixture
+def database(monkeypatch):
+    fake = FakeDatabase()
+    monkeypatch.setattr(main, "connect_to_db", fake.connection)
+    monkeypatch.setattr(main, "open_snapshot", fake.connection)
+    return fake
@@ -0,0 +1,100 @@
+"""
+Tests that compaction merges exports in the same order as a full export from the database.
+"""
+import csv
+import io
+from datetime import datetime
+
+import main
+from conftest import csv_bytes, make_rows
+
+COURSE = "00000000-0000-0000-0000-00000000000c"
+INSTRUCTOR = "instructor@example.com"
+PREFIX = f"{COURSE}/{INSTRUCTOR}/"
+
+# Upper and lower case, and a name outside ASCII, which COLLATE "C" orders by code point
+MODULES = ("Module B", "module a", "Études", "Zeta", "Module A")
+
+def write_export(name, rows):
+    main.write_to_csv(iter(rows), f"{PREFIX}{name}")
+
+def read_rows(body):
+    return list(csv.reader(io.StringIO(body.decode("utf-8"))))[1:]
+
+def split_by_time(rows, *bounds):
+    """
+    Split rows, keeping export order, at each time bound.
+    """
+    parts = []
+    lower = None
+    for upper in bounds + (None,):
+        parts.append([
+            row for row in rows
+            if (lower is None or row[7] > lower) and (upper is None or row[7] <= upper)
+        ])
+        lower = upper
+    return parts
+
+def test_sort_key_matches_export_order():
+    rows = make_rows(300, modules=MODULES)
+    text_rows = read_rows(csv_bytes(rows))
+
+    assert sorted(text_rows, key=lambda row: tuple(row[index] for index in main.SORT_COLUMNS)) == text_rows
+
+def test_compaction_merges_base_and_deltas_in_export_order(database, s3):
+    rows = make_rows(300, modules=MODULES)
+    base, first_delta, second_delta = split_by_time(rows, datetime(2026, 1, 5, 9, 1, 40), datetime(2026, 1, 5, 9, 3, 20))
+    write_export("2026-01-06 10:00:00.000000-aaaaaaaa.csv", base)
+    write_export("deltas/2026-01-06 11:00:00.000000-bbbbbbbb.csv", first_delta)
+    write_export("deltas/2026-01-06 12:00:00.000000-cccccccc.csv", second_delta)
+
+    main.compact_exports(COURSE, INSTRUCTOR)
+
+    compacted = [key for key in s3.objects if key.startswith(PREFIX) and "/" not in key[len(PREFIX):] and "aaaaaaaa" not in key]
+    assert len(compacted) == 1
+    assert s3.objects[compacted[0]] == csv_bytes(rows)
+    # The merged deltas are gone from S3 and from the listing index
+    assert not [key for key in s3.objects if "/deltas/" in key]
+    forgotten = [params[2] for sql, params in database.statements if 'DELETE FROM "Chatlog_Exports"' in sql]
+    assert sorted(forgotten) == ["deltas/2026-01-06 11:00:00.000000-bbbbbbbb.csv", "deltas/2026-01-06 12:00:00.000000-cccccccc.csv"]
+
+def test_compaction_removes_deltas_older_than_the_base(database, s3):
+    rows = make_rows(100, modules=MODULES)
+    early, late = split_by_time(rows, datetime(2026, 1, 5, 9, 0, 50))
+    # The base was written after the stale delta, so it already holds the delta's rows
+    write_export("deltas/2026-01-06 09:00:00.000000-dddddddd.csv", early)
+    write_export("2026-01-06 10:00:00.000000-aaaaaaaa.csv", early)
+    write_export("deltas/2026-01-06 11:00:00.000000-bbbbbbbb.csv", late)
+
+    main.compact_exports(COURSE, INSTRUCTOR)
+
+    assert not [key for key in s3.objects if "/deltas/" in key]
+    compacted = [key for key in s3.objects if key.startswith(PREFIX) and "aaaaaaaa" not in key]
+    assert len(compacted) == 1
+    # The stale delta's rows are not merged in twice
+    assert s3.objects[compacted[0]] == csv_bytes(rows)
+
+def test_compaction_without_new_deltas_still_removes_stale_ones(database, s3):
+    rows = make_rows(40)
+    write_export("deltas/2026-01-06 09:00:00.000000-dddddddd.csv", rows[:10])
+    write_export("2026-01-06 10:00:00.000000-aaaaaaaa.csv", rows)
+
+    message = main.compact_exports(COURSE, INSTRUCTOR)
+
+    assert message.endswith("2026-01-06 10:00:00.000000-aaaaaaaa.csv")
+    assert sorted(s3.objects) == [f"{PREFIX}2026-01-06 10:00:00.000000-aaaaaaaa.csv"]
+
+def test_deltas_stay_in_s3_if_they_cannot_be_unlisted(database, s3):
+    rows = make_rows(40)
+    write_export("2026-01-06 10:00:00.000000-aaaaaaaa.csv", rows[:20])
+    write_export("deltas/2026-01-06 11:00:00.000000-bbbbbbbb.csv", rows[20:])
+    database.fail_on = 'DELETE FROM "Chatlog_Exports"'
+
+    try:
+        main.compact_exports(COURSE, INSTRUCTOR)
+    except Exception:
+        pass
+    else:
+        raise AssertionError("compaction should fail when the index cannot be updated")
+
+    assert f"{PREFIX}deltas/2026-01-06 11:00:00.000000-bbbbbbbb.csv" in s3.objects
@@ -0,0 +1,88 @@
+"""
+Tests that the Parquet export reads back as the same rows as the CSV export.
+
+The partition files are copied from the fake S3 to a local directory under their exact
+keys and read back with pyarrow's hive partitioning, as Athena or pandas would read them.
+The size comparison prints its numbers; run with -s to see them, and set BENCHMARK_ROWS
+for a larger course.
+"""
+import csv
+import io
+import os
+import time
+
+import pyarrow.dataset as ds
+
+import main
+from conftest import make_rows
+
+COURSE = "00000000-0000-0000-0000-00000000000d"
+PREFIX = f"{COURSE}/instructor@example.com/parquet/export/"
+
+# Characters that must be quoted in a path segment, and a NULL module written as ""
+MODULES = ("Module A", "Études", "a/b & c?", "100%", None)
+
+def by_module(rows):
+    """
+    The rows in the Parquet query's order: module first.
+    """
+    return sorted(rows, key=lambda row: ((row[1] or "").encode("utf-8"), row[0], row[3], row[7]))
+
+def read_parquet(s3, tmp_path):
+    for key, body in s3.objects.items():
+        if key.startswith(PREFIX):
+            path = tmp_path / key[len(PREFIX):]
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(body)
+    return ds.dataset(str(tmp_path), format="parquet", partitioning="hive").to_table()
+
+def read_csv(body):
+    return list(csv.DictReader(io.StringIO(body.decode("utf-8"))))
+
+def as_text(record):
+    """
+    A row as the CSV export writes it.
+    """
+    return (
+        record["user_id"], record["module_name"] or "", record["concept_name"], record["session_id"],
+        record["message"], str(record["sent_by_student"]), record["competency_status"], str(record["timestamp"]),
+    )
+
+def test_parquet_round_trip_matches_csv(database, s3, tmp_path):
+    rows = make_rows(500, modules=MODULES)
+    database.rows_by_course[COURSE] = by_module(rows)
+
+    keys = main.write_to_parquet(COURSE, PREFIX)
+    main.write_to_csv(iter(rows), f"{COURSE}/instructor@example.com/export.csv")
+
+    # One partition per module, with the name quoted into a single path segment
+    assert len(keys) == len(MODULES)
+    assert f"{PREFIX}module_name=a%2Fb%20%26%20c%3F/part-0.parquet" in keys
+    assert f"{PREFIX}module_name=/part-0.parquet" in keys
+
+    table = read_parquet(s3, tmp_path)
+    assert sorted(table.column("module_name").unique().to_pylist()) == sorted(module or "" for module in MODULES)
+
+    csv_rows = read_csv(s3.objects[f"{COURSE}/instructor@example.com/export.csv"])
+    assert table.num_rows == len(csv_rows) == len(rows)
+    assert sorted(as_text(record) for record in table.to_pylist()) == sorted(tuple(row.values()) for row in csv_rows)
+
+def test_parquet_is_smaller_than_csv(database, s3, tmp_path):
+    count = int(os.environ.get("BENCHMARK_ROWS", "20000"))
+    rows = make_rows(count, modules=MODULES)
+    database.rows_by_course[COURSE] = by_module(rows)
+
+    start = time.perf_counter()
+    main.write_to_csv(iter(rows), f"{COURSE}/instructor@example.com/export.csv")
+    csv_time = time.perf_counter() - start
+    start = time.perf_counter()
+    keys = main.write_to_parquet(COURSE, PREFIX)
+    parquet_time = time.perf_counter() - start
+
+    csv_size = len(s3.objects[f"{COURSE}/instructor@example.com/export.csv"])
+    parquet_size = sum(len(s3.objects[key]) for key in keys)
+    print(
+        f"\n{count} rows: CSV {csv_size / 1024:.0f} KiB in {csv_time * 1000:.0f} ms, "
+        f"Parquet {parquet_size / 1024:.0f} KiB in {parquet_time * 1000:.0f} ms"
+    )
+    assert parquet_size < csv_size
@@ -0,0 +1,92 @@
+"""
+Tests that chat log exports stream from the cursor to S3 and that a batch exports each course once.
+"""
+import json
+
+import main
+from conftest import csv_bytes, make_rows
+
+COURSE_A = "00000000-0000-0000-0000-00000000000a"
+COURSE_B = "00000000-0000-0000-0000-00000000000b"
+
+def sqs_record(message_id, course_id, instructor_email, request_id, mode="full"):
+    return {
+        "messageId": message_id,
+        "body": json.dumps({
+            "course_id": course_id,
+            "instructor_email": instructor_email,
+            "request_id": request_id,
+            "mode": mode,
+        }),
+        "attributes": {"ApproximateReceiveCount": "1"},
+    }
+
+def test_query_chat_logs_uses_a_server_side_cursor(database):
+    rows = make_rows(50)
+    database.rows_by_course[COURSE_A] = rows
+
+    assert list(main.query_chat_logs(COURSE_A)) == rows
+    stream = database.streams[0]
+    assert stream.name is not None
+    assert stream.itersize == main.EXPORT_FETCH_SIZE
+    assert stream.closed
+
+def test_write_to_csv_uploads_parts_while_streaming(database, s3, monkeypatch):
+    part_size = 100 * 1024
+    monkeypatch.setattr(main, "EXPORT_PART_SIZE", part_size)
+    rows = make_rows(6000)
+    database.rows_by_course[COURSE_A] = rows
+
+    rows_read_at_part = []
+    s3.on_upload_part = lambda key: rows_read_at_part.append(database.streams[0].yielded)
+
+    count = main.write_to_csv(main.query_chat_logs(COURSE_A), f"{COURSE_A}/a@example.com/export.csv")
+
+    body = s3.objects[f"{COURSE_A}/a@example.com/export.csv"]
+    assert count == len(rows)
+    assert body == csv_bytes(rows)
+
+    # Parts go out as they fill, long before the last row is read
+    part_sizes = [size for _, _, size in s3.parts]
+    assert len(part_sizes) >= 2
+    assert rows_read_at_part[0] < len(rows) / 2
+    # Every part but the last is at least the part size, and the buffer never holds
+    # much more than one part plus one encoded chunk, however many rows there are
+    max_part_size = part_size + 64 * 1024 + 1024
+    assert all(part_size <= size <= max_part_size for size in part_sizes[:-1])
+    assert len(body) // max_part_size <= len(part_sizes) <= len(body) // part_size + 1
+
+def test_handler_exports_each_course_once(database, s3, monkeypatch):
+    database.rows_by_course[COURSE_A] = make_rows(40)
+    database.rows_by_course[COURSE_B] = make_rows(10)
+    notified = {}
+    monkeypatch.setattr(main, "notify_until_acknowledged", lambda notifications, deadline: notified.update(notifications))
+
+    event = {"Records": [
+        sqs_record("m1", COURSE_A, "a@example.com", "10000000-0000-0000-0000-000000000001"),
+        sqs_record("m2", COURSE_A, "b@example.com", "10000000-0000-0000-0000-000000000002"),
+        sqs_record("m3", COURSE_B, "a@example.com", "10000000-0000-0000-0000-000000000003"),
+        sqs_record("m4", COURSE_A, "c@example.com", "10000000-0000-0000-0000-000000000004"),
+    ]}
+    response = main.handler(event, None)
+
+    assert response["batchItemFailures"] == []
+    # One chat log query per course, however many instructors asked for it
+    assert sorted(params[0] for _, params in database.chat_log_queries) == [COURSE_A, COURSE_B]
+    for course_id, instructor_email in [(COURSE_A, "a@example.com"), (COURSE_A, "b@example.com"), (COURSE_A, "c@example.com"), (COURSE_B, "a@example.com")]:
+        keys = [key for key in s3.objects if key.startswith(f"{course_id}/{instructor_email}/")]
+        assert len(keys) == 1
+        assert s3.objects[keys[0]] == csv_bytes(database.rows_by_course[course_id])
+    assert set(notified) == {f"10000000-0000-0000-0000-00000000000{index}" for index in range(1, 5)}
+
+def test_handler_fails_the_job_if_the_export_cannot_be_recorded(database, s3, monkeypatch):
+    database.rows_by_course[COURSE_A] = make_rows(40)
+    database.fail_on = 'INSERT INTO "Chatlog_Exports"'
+    monkeypatch.setattr(main, "notify_until_acknowledged", lambda notifications, deadline: None)
+
+    response = main.handler({"Records": [sqs_record("m1", COURSE_A, "a@example.com", "10000000-0000-0000-0000-000000000001")]}, None)
+
+    # Retried, with no file left in S3 that the listing would not show
+    assert response["batchItemFailures"] == [{"itemIdentifier": "m1"}]
+    assert not s3.objects
+    assert not [sql for sql, _ in database.statements if "Chatlog_Export_Watermarks" in sql]
@@ -1,18 +1,39 @@
-import boto3, re
+import os, re, time, random, asyncio, logging
+from typing import Optional
+import boto3
 from langchain_aws import ChatBedrock
 from langchain_aws import BedrockLLM
+from langchain_core.messages import AIMessage, HumanMessage
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_classic.chains.combine_documents import create_stuff_documents_chain
-from langchain_classic.chains import create_retrieval_chain
-from langchain_core.runnables.history import RunnableWithMessageHistory
-from langchain_community.chat_message_histories import DynamoDBChatMessageHistory
 from pydantic import BaseModel, Field
 
+from helpers.history import WindowedChatMessageHistory
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Included by the LLM once the student has mastered the topic
+COMPETENCY_MARKER = "COMPETENCY ACHIEVED"
+
+# Bounds for regenerating empty or failed answers
+LLM_MAX_ATTEMPTS = int(os.environ.get("LLM_MAX_ATTEMPTS", "3"))
+LLM_RETRY_BASE_DELAY = float(os.environ.get("LLM_RETRY_BASE_DELAY", "0.5"))
+LLM_RETRY_MAX_DELAY = float(os.environ.get("LLM_RETRY_MAX_DELAY", "4"))
+FALLBACK_RESPONSE = (
+    "Sorry, I wasn't able to come up with a response just now. "
+    "Could you send your message again?"
+)
+
 class LLM_evaluation(BaseModel):
     response: str = Field(description="Assessment of the student's answer with a follow-up question.")
     verdict: str = Field(description="'True' if the student has mastered the concept, 'False' otherwise.")
 
 
+# History tables known to exist in this container, so the check only runs on cold start
+_ready_history_tables = set()
+
 def create_dynamodb_history_table(table_name: str) -> bool:
     """
     Create a DynamoDB table to store the session history if it doesn't already exist.
@@ -21,43 +42,39 @@ def create_dynamodb_history_table(table_name: str) -> bool:
     table_name (str): The name of the DynamoDB table to create.
 
     Returns:
-    None
+    bool: True if the table had to be created, False if it already existed.
     
-    If the table already exists, this function does nothing. Otherwise, it creates a 
-    new table with a key schema based on 'SessionId'.
+    The table is looked up with describe_table once per container; later calls
+    return immediately. If the table does not exist, it is created with a key
+    schema based on 'SessionId'.
     """
-    # Get the service resource and client.
-    dynamodb_resource = boto3.resource("dynamodb")
+    if table_name in _ready_history_tables:
+        return False
+
     dynamodb_client = boto3.client("dynamodb")
-    
-    # Retrieve the list of tables that currently exist.
-    existing_tables = []
-    exclusive_start_table_name = None
-    
-    while True:
-        if exclusive_start_table_name:
-            response = dynamodb_client.list_tables(ExclusiveStartTableName=exclusive_start_table_name)
-        else:
-            response = dynamodb_client.list_tables()
-        
-        existing_tables.extend(response.get('TableNames', []))
-        
-        if 'LastEvaluatedTableName' in response:
-            exclusive_start_table_name = response['LastEvaluatedTableName']
-        else:
-            break
-    
-    if table_name not in existing_tables:  # Create a new table if it doesn't exist.
+
+    try:
+        dynamodb_client.describe_table(TableName=table_name)
+        created = False
+    except dynamodb_client.exceptions.ResourceNotFoundException:
         # Create the DynamoDB table.
-        table = dynamodb_resource.create_table(
-            TableName=table_name,
-            KeySchema=[{"AttributeName": "SessionId", "KeyType": "HASH"}],
-            AttributeDefinitions=[{"AttributeName": "SessionId", "AttributeType": "S"}],
-            BillingMode="PAY_PER_REQUEST",
-        )
-        
-        # Wait until the table exists.
-        table.meta.client.get_waiter("table_exists").wait(TableName=table_name)
+        try:
+            dynamodb_client.create_table(
+                TableName=table_name,
+                KeySchema=[{"AttributeName": "SessionId", "KeyType": "HASH"}],
+                AttributeDefinitions=[{"AttributeName": "SessionId", "AttributeType": "S"}],
+                BillingMode="PAY_PER_REQUEST",
+            )
+        except dynamodb_client.exceptions.ResourceInUseException:
+            pass  # another container created it first
+        created = True
+
+    # Wait until the table exists (returns at once if it is already active).
+    if created:
+        dynamodb_client.get_waiter("table_exists").wait(TableName=table_name)
+
+    _ready_history_tables.add(table_name)
+    return created
 
 def get_bedrock_llm(
     bedrock_llm_id: str,
@@ -79,47 +96,6 @@ def get_bedrock_llm(
         model_kwargs=dict(temperature=temperature),
     )
 
-def get_other_module_names(course_id: str, current_module_id: str, connection) -> list[str]:
-    """
-    Retrieve all other module names in the same course, excluding the current module.
-
-    Args:
-    course_id (str): The course ID.
-    current_module_id (str): The current module ID.
-    connection: The active database connection.
-
-    Returns:
-    list[str]: A list of other module names in the same course.
-    """
-    if connection is None:
-        print("No database connection available.")
-        return []
-
-    try:
-        cur = connection.cursor()
-
-        query = """
-            SELECT cm.module_name
-            FROM "Course_Modules" cm
-            INNER JOIN "Course_Concepts" cc ON cm.concept_id = cc.concept_id
-            WHERE cc.course_id = %s AND cm.module_id != %s;
-        """
-        cur.execute(query, (course_id, current_module_id))
-        results = cur.fetchall()
-        connection.commit()
-        cur.close()
-
-        other_modules = [row[0] for row in results]
-        print(f"Other modules in course {course_id}: {other_modules}")
-        return other_modules
-
-    except Exception as e:
-        if cur:
-            cur.close()
-        connection.rollback()
-        print(f"Error fetching other module names: {e}")
-        return []
-
 def get_student_query(raw_query: str) -> str:
     """
     Format the student's raw query into a specific template suitable for processing.
@@ -154,39 +130,28 @@ def get_initial_student_query(topic: str) -> str:
     """
     return student_query
 
-def get_response(
-    query: str,
-    topic: str,
-    llm: ChatBedrock,
-    history_aware_retriever,
-    table_name: str,
-    session_id: str,
-    course_system_prompt: str,
-    course_id: str,
-    module_id: str,
-    connection
-) -> dict:
+def get_question_answer_chain(llm: ChatBedrock):
     """
-    Generates a response to a query using the LLM and a history-aware retriever for context.
+    Build the question answering chain.
+
+    The chain does not depend on the course, module or session, so it is built once
+    per container. topic, course_system_prompt, conversation_summary, chat_history
+    and the retrieved context are supplied as inputs when it is invoked.
 
     Args:
-    query (str): The student's query string for which a response is needed.
-    topic (str): The specific topic that the student needs to master.
     llm (ChatBedrock): The language model instance used to generate the response.
-    history_aware_retriever: The history-aware retriever instance that provides relevant context documents for the query.
-    table_name (str): The DynamoDB table name used to store and retrieve the chat history.
-    session_id (str): The unique identifier for the chat session to manage history.
 
     Returns:
-    dict: A dictionary containing the generated response and the source documents used in the retrieval.
+    Runnable: A chain that returns the answer as a string.
     """
     # Create a system prompt for the question answering
     system_prompt = (
         ""
         "system"
         "You are an instructor for a course. "
-        f"Your job is to help the student master the topic: {topic}. \n"        
-        f"{course_system_prompt}"
+        "Your job is to help the student master the topic: {topic}. \n"
+        "{course_system_prompt}"
+        "{conversation_summary}"
         "Continue this process until you determine that the student has mastered the topic. \nOnce mastery is achieved, include COMPETENCY ACHIEVED in your response and do not ask any further questions about the topic. "
         "Use the following pieces of retrieved context to answer "
         "a question asked by the student. Use three sentences maximum and keep the "
@@ -205,63 +170,232 @@ def get_response(
             ("human", "{input}"),
         ]
     )
-    question_answer_chain = create_stuff_documents_chain(llm, qa_prompt)
-    rag_chain = create_retrieval_chain(history_aware_retriever, question_answer_chain)
-
-    conversational_rag_chain = RunnableWithMessageHistory(
-        rag_chain,
-        lambda session_id: DynamoDBChatMessageHistory(
-            table_name=table_name, 
-            session_id=session_id
-        ),
-        input_messages_key="input",
-        history_messages_key="chat_history",
-        output_messages_key="answer",
-    )
-    
-    # Generate the response until it's not empty
-    response = ""
-    while not response:
-        response = generate_response(
-            conversational_rag_chain,
-            query,
-            session_id
-        )
-    
-    return get_llm_output(response, course_id, module_id, connection)
+    return create_stuff_documents_chain(llm, qa_prompt)
 
-def generate_response(conversational_rag_chain: object, query: str, session_id: str) -> str:
+async def get_response(
+    query: str,
+    topic: str,
+    question_answer_chain,
+    history_aware_retriever,
+    history: WindowedChatMessageHistory,
+    collection_name: str,
+    course_system_prompt: str,
+    other_modules: list[str],
+    deadline: Optional[float] = None,
+    publisher=None,
+    query_embedding: Optional[tuple[str, list[float]]] = None
+) -> dict:
     """
-    Invokes the RAG chain to generate a response to a given query.
+    Generates a response to a query using the LLM and a history-aware retriever for context.
+
+    The chat history window is loaded once and the context is retrieved once. Only
+    the answer generation is retried, and the exchange is appended to the history once.
 
     Args:
-    conversational_rag_chain: The Conversational RAG chain object that processes the query and retrieves relevant responses.
-    query (str): The input query for which the response is being generated.
-    session_id (str): The unique identifier for the current conversation session.
+    query (str): The student's query string for which a response is needed.
+    topic (str): The specific topic that the student needs to master.
+    question_answer_chain: The shared chain from get_question_answer_chain.
+    history_aware_retriever: The history-aware retriever instance that provides relevant context documents for the query.
+    history (WindowedChatMessageHistory): The session's chat history, ideally already loaded.
+    collection_name (str): The vectorstore collection to retrieve context from (the module ID).
+    course_system_prompt (str): The instructor's system prompt for the course.
+    other_modules (list[str]): The other module names in the course, recommended once competency is achieved.
+    deadline (Optional[float]): time.monotonic() value after which no new attempt is started.
+    publisher (Optional[StreamPublisher]): If given, receives the answer text as it is generated.
+    query_embedding (Optional[tuple[str, list[float]]]): A (text, vector) pair computed ahead of
+        time, used by the retriever if it searches for that exact text.
 
     Returns:
-    str: The answer generated by the Conversational RAG chain, based on the input query and session context.
+    dict: A dictionary containing the generated response, the competency verdict, the number
+    of messages in the session, the stored session name, if any, and whether the history
+    needs trimming.
     """
-    return conversational_rag_chain.invoke(
-        {
-            "input": query
-        },
-        config={
-            "configurable": {"session_id": session_id}
-        },  # constructs a key "session_id" in `store`.
-    )["answer"]
+    inputs = {
+        "input": query,
+        "chat_history": history.messages,
+        "conversation_summary": history.summary_context,
+        "topic": topic,
+        "course_system_prompt": course_system_prompt
+    }
+    config = {"configurable": {"collection_name": collection_name, "query_embedding": query_embedding}}
+
+    inputs["context"] = await history_aware_retriever.ainvoke(inputs, config=config)
+
+    response = await generate_response_with_retries(question_answer_chain, inputs, config, deadline, publisher)
+
+    await asyncio.to_thread(history.add_messages, [HumanMessage(content=query), AIMessage(content=response)])
+
+    output = get_llm_output(response, other_modules)
+    # Let the caller decide on session naming and trimming without reading the history again
+    output["message_count"] = history.message_count
+    output["session_name"] = history.session_name
+    output["needs_trim"] = history.needs_trim
+    return output
+
+async def get_opener_response(
+    query: str,
+    opener: str,
+    history: WindowedChatMessageHistory,
+    other_modules: list[str],
+    publisher=None
+) -> dict:
+    """
+    Answers the opening turn of a session with a pre-generated opener instead of calling the LLM.
+
+    The exchange is written to the history exactly as get_response would write it,
+    so later turns see the same conversation.
+
+    Args:
+    query (str): The initial student query from get_initial_student_query.
+    opener (str): A pooled response previously generated for that query.
+    history (WindowedChatMessageHistory): The session's chat history.
+    other_modules (list[str]): The other module names in the course.
+    publisher (Optional[StreamPublisher]): If given, receives the opener.
+
+    Returns:
+    dict: The same fields as get_response.
+    """
+    output = get_llm_output(opener, other_modules)
+    if publisher:
+        publisher.write(output["llm_output"])
+
+    await asyncio.to_thread(history.add_messages, [HumanMessage(content=query), AIMessage(content=opener)])
+
+    output["message_count"] = history.message_count
+    output["session_name"] = history.session_name
+    output["needs_trim"] = history.needs_trim
+    return output
+
+async def generate_response_with_retries(
+    question_answer_chain,
+    inputs: dict,
+    config: dict,
+    deadline: Optional[float] = None,
+    publisher=None
+) -> str:
+    """
+    Generate an answer, retrying empty answers and errors a bounded number of times.
+
+    Attempts are spaced with exponential backoff and full jitter, and no attempt is
+    started after the deadline. If every attempt returned an empty answer, a
+    fallback reply is returned; if the last attempt raised, the error is re-raised.
+
+    Args:
+    question_answer_chain: The shared chain from get_question_answer_chain.
+    inputs (dict): The chain inputs, including the already retrieved context.
+    config (dict): The run config.
+    deadline (Optional[float]): time.monotonic() value after which no new attempt is started.
+    publisher (Optional[StreamPublisher]): If given, receives the answer text as it is generated.
+
+    Returns:
+    str: The answer, or FALLBACK_RESPONSE.
+    """
+    error = None
+    for attempt in range(1, LLM_MAX_ATTEMPTS + 1):
+        try:
+            response = await generate_response(question_answer_chain, inputs, config, publisher)
+            if response.strip():
+                return response
+            logger.warning(f"Empty LLM response (attempt {attempt}/{LLM_MAX_ATTEMPTS})")
+            error = None
+        except Exception as e:
+            logger.error(f"Error generating LLM response (attempt {attempt}/{LLM_MAX_ATTEMPTS}): {e}")
+            error = e
+
+        if publisher:
+            publisher.reset()
+
+        if attempt == LLM_MAX_ATTEMPTS:
+            break
+        delay = random.uniform(0, min(LLM_RETRY_MAX_DELAY, LLM_RETRY_BASE_DELAY * 2 ** (attempt - 1)))
+        if deadline is not None and time.monotonic() + delay >= deadline:
+            logger.warning("Not enough time left in the invocation for another attempt")
+            break
+        await asyncio.sleep(delay)
+
+    if error is not None:
+        raise error
+
+    logger.warning("Returning the fallback response")
+    if publisher:
+        publisher.write(FALLBACK_RESPONSE)
+    return FALLBACK_RESPONSE
+
+async def generate_response(question_answer_chain, inputs: dict, config: dict, publisher=None) -> str:
+    """
+    Invokes the question answering chain once.
+
+    Args:
+    question_answer_chain: The shared chain from get_question_answer_chain.
+    inputs (dict): The chain inputs, including the already retrieved context.
+    config (dict): The run config.
+    publisher (Optional[StreamPublisher]): If given, the answer is streamed to it.
+
+    Returns:
+    str: The answer generated by the LLM.
+    """
+    if publisher is None:
+        return await question_answer_chain.ainvoke(inputs, config=config)
+
+    competency_filter = CompetencyStreamFilter()
+    async for token in question_answer_chain.astream(inputs, config=config):
+        publisher.write(competency_filter.feed(token))
+    publisher.write(competency_filter.finish())
+    return competency_filter.text
+
+class CompetencyStreamFilter:
+    """
+    Passes streamed answer text through while watching for the competency marker.
+
+    The last len(COMPETENCY_MARKER) - 1 characters are held back, so the marker is
+    never shown to the student even when it is split across tokens. Once the marker
+    is seen, no further text is passed on; get_llm_output decides the final output.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.sent = 0
+        self.achieved = False
+
+    def feed(self, token: str) -> str:
+        """
+        Add a token and return the text that is now safe to show.
+        """
+        self.text += token
+        if self.achieved:
+            return ""
+
+        index = self.text.find(COMPETENCY_MARKER, self.sent)
+        if index != -1:
+            self.achieved = True
+            end = index
+        else:
+            end = max(self.sent, len(self.text) - (len(COMPETENCY_MARKER) - 1))
+
+        safe_text = self.text[self.sent:end]
+        self.sent = end
+        return safe_text
+
+    def finish(self) -> str:
+        """
+        Return the held back text once the stream has ended.
+        """
+        if self.achieved:
+            return ""
+        safe_text = self.text[self.sent:]
+        self.sent = len(self.text)
+        return safe_text
 
 def get_llm_output(
     response: str,
-    course_id: str,
-    module_id: str,
-    connection
+    other_modules: list[str]
     ) -> dict:
     """
     Processes the response from the LLM to determine if competency has been achieved.
 
     Args:
     response (str): The response generated by the LLM.
+    other_modules (list[str]): The other module names in the course, recommended once competency is achieved.
 
     Returns:
     dict: A dictionary containing the processed output from the LLM and a boolean 
@@ -270,18 +404,18 @@ def get_llm_output(
 
     competion_sentence = " Congratulations! You have achieved competency over this module! Please try other modules to continue your learning journey! :)"
     
-    if "COMPETENCY ACHIEVED" not in response:
+    if COMPETENCY_MARKER not in response:
         return dict(
             llm_output=response,
             llm_verdict=False
         )
     
-    elif "COMPETENCY ACHIEVED" in response:
+    elif COMPETENCY_MARKER in response:
         sentences = split_into_sentences(response)
         
         for i in range(len(sentences)):
             
-            if "COMPETENCY ACHIEVED" in sentences[i]:
+            if COMPETENCY_MARKER in sentences[i]:
                 llm_response=' '.join(sentences[0:i-1])
                 
                 if sentences[i-1][-1] == '?':
@@ -290,7 +424,6 @@ def get_llm_output(
                         llm_verdict=False
                     )
                 else:
-                    other_modules = get_other_module_names(course_id, module_id, connection)
                     recommendation = ""
                     if other_modules:
                         recommendation = " You may also want to explore these modules next: " + ", ".join(other_modules) + "."
@@ -299,7 +432,6 @@ def get_llm_output(
                         llm_verdict=True
                     )
     elif "compet" in response or "master" in response:
-        other_modules = get_other_module_names(course_id, module_id, connection)
         recommendation = ""
         if other_modules:
             recommendation = " You may also want to explore these modules next: " + ", ".join(other_modules) + "."
@@ -328,23 +460,25 @@ def split_into_sentences(paragraph: str) -> list[str]:
     sentences = re.split(sentence_endings, paragraph)
     return sentences
 
-def update_session_name(table_name: str, session_id: str, bedrock_llm_id: str) -> str:
+def generate_session_name(table_name: str, session_id: str, bedrock_llm_id: str) -> Optional[str]:
     """
-    Check if both the LLM and the student have exchanged exactly one message each.
-    If so, generate and return a session name using the content of the student's first message
-    and the LLM's first response. Otherwise, return None.
+    Generate a session name from the student's first message and the LLM's first response.
+
+    Only the first exchange is read from the history, so the cost does not depend
+    on the length of the session.
 
     Args:
-    session_id (str): The unique ID for the session.
     table_name (str): The DynamoDB table name where the conversation history is stored.
+    session_id (str): The unique ID for the session.
+    bedrock_llm_id (str): The Bedrock model used to write the name.
 
     Returns:
-    str: The updated session name if conditions are met, otherwise None.
+    Optional[str]: The generated session name, or None if the first exchange is incomplete.
     """
     
     dynamodb_client = boto3.client("dynamodb")
     
-    # Retrieve the conversation history from the DynamoDB table
+    # Retrieve the first exchange from the DynamoDB table
     try:
         response = dynamodb_client.get_item(
             TableName=table_name,
@@ -352,7 +486,8 @@ def update_session_name(table_name: str, session_id: str, bedrock_llm_id: str) -
                 'SessionId': {
                     'S': session_id
                 }
-            }
+            },
+            ProjectionExpression="History[0], History[1], History[2], History[3]"
         )
     except Exception as e:
         print(f"Error fetching conversation history from DynamoDB: {e}")
@@ -360,30 +495,19 @@ def update_session_name(table_name: str, session_id: str, bedrock_llm_id: str) -
 
     history = response.get('Item', {}).get('History', {}).get('L', [])
 
-
-
     human_messages = []
     ai_messages = []
     
     # Find the first human and ai messages in the history
-    # Check if length of human messages is 2 since the prompt counts as 1
-    # Check if length of AI messages is 2 since after first response by student, another response is generated
     for item in history:
         message_type = item.get('M', {}).get('data', {}).get('M', {}).get('type', {}).get('S')
         
         if message_type == 'human':
             human_messages.append(item)
-            if len(human_messages) > 2:
-                print("More than one student message found; not the first exchange.")
-                return None
-        
         elif message_type == 'ai':
             ai_messages.append(item)
-            if len(ai_messages) > 2:
-                print("More than one AI message found; not the first exchange.")
-                return None
 
-    if len(human_messages) != 2 or len(ai_messages) != 2:
+    if not human_messages or not ai_messages:
         print("Not a complete first exchange between the LLM and student.")
         return None
     
@@ -415,4 +539,27 @@ def update_session_name(table_name: str, session_id: str, bedrock_llm_id: str) -
     """
     
     session_name = llm.invoke(prompt)
-    return session_name
+    return session_name.strip()
+
+def save_session_name(table_name: str, session_id: str, session_name: str) -> None:
+    """
+    Store the session name on the session's history item, where the next chat turn picks it up.
+
+    Args:
+    table_name (str): The DynamoDB table name where the conversation history is stored.
+    session_id (str): The unique ID for the session.
+    session_name (str): The generated session name.
+    """
+    dynamodb_client = boto3.client("dynamodb")
+    dynamodb_client.update_item(
+        TableName=table_name,
+        Key={
+            'SessionId': {
+                'S': session_id
+            }
+        },
+        UpdateExpression="SET SessionName = :session_name",
+        ExpressionAttributeValues={
+            ":session_name": {"S": session_name}
+        }
+    )
@@ -0,0 +1,137 @@
+import os
+import time
+import asyncio
+import hashlib
+import logging
+from array import array
+from collections import Counter
+from typing import List, Optional
+
+import boto3
+from langchain_core.embeddings import Embeddings
+
+from helpers.cache import TTLCache
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+EMBEDDING_CACHE_SIZE = int(os.environ.get("EMBEDDING_CACHE_SIZE", "2048"))
+EMBEDDING_CACHE_TTL = float(os.environ.get("EMBEDDING_CACHE_TTL", "86400"))
+# Optional DynamoDB table shared by every container; only the container-local cache is used if unset
+EMBEDDING_CACHE_TABLE = os.environ.get("EMBEDDING_CACHE_TABLE", "")
+# The hit rate is logged at INFO once per this many lookups, each lookup only at DEBUG
+EMBEDDING_CACHE_LOG_EVERY = int(os.environ.get("EMBEDDING_CACHE_LOG_EVERY", "100"))
+
+dynamodb_resource = boto3.resource("dynamodb")
+
+def normalize_query(text: str) -> str:
+    """
+    Collapse whitespace so trivially different spellings of a query share an entry.
+    Case is kept, since the embedding model is case sensitive.
+    """
+    return " ".join(text.split())
+
+class CachedQueryEmbeddings(Embeddings):
+    """
+    Embeddings that cache query vectors by (model ID, normalized text).
+
+    Lookups go to a container-local LRU cache with a time to live first and, if
+    EMBEDDING_CACHE_TABLE is set, to a DynamoDB table shared by all containers.
+    Vectors are stored there as packed float32 with an ExpiresAt TTL attribute.
+    Document embeddings are passed through uncached.
+    """
+
+    def __init__(self, embeddings: Embeddings, model_id: str):
+        self.embeddings = embeddings
+        self.model_id = model_id
+        self.local_cache = TTLCache(maxsize=EMBEDDING_CACHE_SIZE, ttl=EMBEDDING_CACHE_TTL)
+        self.table = dynamodb_resource.Table(EMBEDDING_CACHE_TABLE) if EMBEDDING_CACHE_TABLE else None
+        # Per-container counters: local_hit, shared_hit, miss
+        self.stats = Counter()
+
+    def _shared_key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_id}\x00{text}".encode("utf-8")).hexdigest()
+
+    def _get_shared(self, text: str) -> Optional[List[float]]:
+        if self.table is None:
+            return None
+        try:
+            item = self.table.get_item(Key={"CacheKey": self._shared_key(text)}).get("Item")
+        except Exception as e:
+            logger.error(f"Error reading the shared embedding cache: {e}")
+            return None
+        # DynamoDB deletes expired items lazily, so the expiry is checked here as well
+        if item is None or int(item["ExpiresAt"]) < time.time():
+            return None
+        return array("f", bytes(item["Embedding"])).tolist()
+
+    def _set_shared(self, text: str, vector: List[float]) -> None:
+        if self.table is None:
+            return
+        try:
+            self.table.put_item(Item={
+                "CacheKey": self._shared_key(text),
+                "Embedding": array("f", vector).tobytes(),
+                "ExpiresAt": int(time.time() + EMBEDDING_CACHE_TTL),
+            })
+        except Exception as e:
+            logger.error(f"Error writing the shared embedding cache: {e}")
+
+    def _record(self, outcome: str) -> None:
+        self.stats[outcome] += 1
+        logger.debug(f"Query embedding cache: {outcome}.")
+        stats = self.get_stats()
+        if stats["lookups"] % EMBEDDING_CACHE_LOG_EVERY == 0:
+            logger.info(
+                f"Query embedding cache hit rate {stats['hit_rate']:.1%} "
+                f"over {stats['lookups']} lookups in this container, stats: {dict(self.stats)}"
+            )
+
+    def get_stats(self) -> dict:
+        """
+        Return the cache counters of this container and the overall hit rate.
+        """
+        lookups = sum(self.stats.values())
+        hits = self.stats["local_hit"] + self.stats["shared_hit"]
+        return {**self.stats, "lookups": lookups, "hit_rate": hits / lookups if lookups else 0.0}
+
+    def embed_query(self, text: str) -> List[float]:
+        key = (self.model_id, normalize_query(text))
+        vector = self.local_cache.get(key)
+        if vector is not None:
+            self._record("local_hit")
+            return vector
+
+        vector = self._get_shared(key[1])
+        if vector is not None:
+            self._record("shared_hit")
+        else:
+            vector = self.embeddings.embed_query(key[1])
+            self._set_shared(key[1], vector)
+            self._record("miss")
+        self.local_cache.set(key, vector)
+        return vector
+
+    async def aembed_query(self, text: str) -> List[float]:
+        key = (self.model_id, normalize_query(text))
+        vector = self.local_cache.get(key)
+        if vector is not None:
+            self._record("local_hit")
+            return vector
+
+        vector = await asyncio.to_thread(self._get_shared, key[1])
+        if vector is not None:
+            self._record("shared_hit")
+        else:
+            vector = await self.embeddings.aembed_query(key[1])
+            await asyncio.to_thread(self._set_shared, key[1], vector)
+            self._record("miss")
+        self.local_cache.set(key, vector)
+        return vector
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self.embeddings.aembed_documents(texts)
@@ -1,7 +1,12 @@
+import os
 import logging
-from typing import Optional
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional, Tuple
 
 import psycopg2
+from sqlalchemy import event, text
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
 from langchain_aws import BedrockEmbeddings
 from langchain_postgres import PGVector
 
@@ -9,18 +14,135 @@ from langchain_postgres import PGVector
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Container-scoped registries. Engines are keyed by (host, port, dbname, user, password)
+# so every request on a warm Lambda reuses the same pooled connection to the RDS proxy,
+# while rotated credentials get a new pool instead of the one built with the old password.
+# PGVector views are keyed by (engine key, collection name) so the collection lookup
+# only happens the first time a module is queried. The engines are async and bound to
+# the handler's event loop, which main.py keeps across invocations.
+_engines: Dict[Tuple[str, int, str, str, str], AsyncEngine] = {}
+_vectorstores: Dict[Tuple[Tuple[str, int, str, str, str], str], PGVector] = {}
+
+# ANN search parameters. pgvector's defaults (ef_search=40, probes=1) trade too much
+# recall on the per-module partial indexes built during ingestion.
+VECTOR_EF_SEARCH = int(os.environ.get("VECTOR_EF_SEARCH", "100"))
+VECTOR_IVFFLAT_PROBES = int(os.environ.get("VECTOR_IVFFLAT_PROBES", "10"))
+
+_search_params: ContextVar[Optional[Dict[str, int]]] = ContextVar("vector_search_params", default=None)
+
+@contextmanager
+def vector_search_params(ef_search: int = VECTOR_EF_SEARCH, probes: int = VECTOR_IVFFLAT_PROBES) -> Iterator[None]:
+    """
+    Apply ANN search parameters to the database transactions opened inside the block.
+
+    The values are set with set_config(..., is_local => true), so they only last for
+    the transaction and never leak into other clients sharing an RDS proxy connection.
+
+    Args:
+    ef_search (int, optional): hnsw.ef_search, must be at least the number of results requested.
+    probes (int, optional): ivfflat.probes.
+    """
+    token = _search_params.set({"ef_search": ef_search, "probes": probes})
+    try:
+        yield
+    finally:
+        _search_params.reset(token)
+
+def _apply_search_params(conn) -> None:
+    params = _search_params.get()
+    if params is None:
+        return
+    conn.execute(
+        text(
+            "SELECT set_config('hnsw.ef_search', :ef_search, true), "
+            "set_config('ivfflat.probes', :probes, true)"
+        ),
+        {"ef_search": str(params["ef_search"]), "probes": str(params["probes"])}
+    )
+
+def get_engine(
+    dbname: str,
+    user: str,
+    password: str,
+    host: str,
+    port: int
+) -> AsyncEngine:
+    """
+    Return the shared async SQLAlchemy engine for the given database, creating it on first use.
+
+    Args:
+    dbname (str): The name of the database.
+    user (str): The database user.
+    password (str): The database password.
+    host (str): The database host.
+    port (int): The database port.
+
+    Returns:
+    AsyncEngine: The shared engine.
+    """
+    connection_string = (
+        f"postgresql+psycopg://{user}:{password}@{host}:{port}/{dbname}"
+    )
+    key = (host, int(port), dbname, user, password)
+
+    engine = _engines.get(key)
+    if engine is None:
+        logger.info("Creating shared database engine")
+        engine = create_async_engine(
+            connection_string,
+            pool_size=1,
+            max_overflow=2,
+            pool_pre_ping=True,  # the RDS proxy may drop idle connections between invocations
+            pool_recycle=900,
+        )
+        # Async engines dispatch their events from the underlying sync engine
+        event.listen(engine.sync_engine, "begin", _apply_search_params)
+        _engines[key] = engine
+
+    return engine
+
+async def dispose_engine(
+    dbname: str,
+    user: str,
+    password: str,
+    host: str,
+    port: int
+) -> None:
+    """
+    Close the shared engine of the given credentials and forget it and its PGVector instances.
+
+    The next get_engine call with the same credentials opens a new pool.
+    """
+    key = (host, int(port), dbname, user, password)
+    for vectorstore_key in [vectorstore_key for vectorstore_key in _vectorstores if vectorstore_key[0] == key]:
+        del _vectorstores[vectorstore_key]
+    engine = _engines.pop(key, None)
+    if engine is not None:
+        logger.info("Disposing shared database engine")
+        await engine.dispose()
+
+def is_authentication_error(error: Exception) -> bool:
+    """
+    Whether connecting failed because the password was rejected, e.g. after the secret was rotated.
+
+    libpq reports it without a SQLSTATE, so the message is matched.
+    """
+    return "password authentication failed" in str(error)
+
 def get_vectorstore(
-    collection_name: str, 
-    embeddings: BedrockEmbeddings, 
-    dbname: str, 
-    user: str, 
-    password: str, 
-    host: str, 
+    collection_name: str,
+    embeddings: BedrockEmbeddings,
+    dbname: str,
+    user: str,
+    password: str,
+    host: str,
     port: int
-) -> Optional[PGVector]:
+) -> PGVector:
     """
-    Initialize and return a PGVector instance.
-    
+    Return an async PGVector instance for the collection, backed by the shared engine.
+
+    Only its async methods can be used, e.g. asimilarity_search_by_vector.
+
     Args:
     collection_name (str): The name of the collection.
     embeddings (BedrockEmbeddings): The embeddings instance.
@@ -29,26 +151,35 @@ def get_vectorstore(
     password (str): The database password.
     host (str): The database host.
     port (int): The database port.
-    
+
     Returns:
-    Optional[PGVector]: The initialized PGVector instance, or None if an error occurred.
+    PGVector: The initialized PGVector instance. Errors are logged and raised.
     """
     try:
-        connection_string = (
-            f"postgresql+psycopg://{user}:{password}@{host}:{port}/{dbname}"
+        engine = get_engine(
+            dbname=dbname,
+            user=user,
+            password=password,
+            host=host,
+            port=port
         )
+        key = ((host, int(port), dbname, user, password), collection_name)
 
-        logger.info("Initializing the VectorStore")
-        vectorstore = PGVector(
-            embeddings=embeddings,
-            collection_name=collection_name,
-            connection=connection_string,
-            use_jsonb=True
-        )
+        vectorstore = _vectorstores.get(key)
+        if vectorstore is None or vectorstore.embeddings is not embeddings:
+            logger.info("Initializing the VectorStore")
+            vectorstore = PGVector(
+                embeddings=embeddings,
+                collection_name=collection_name,
+                connection=engine,
+                use_jsonb=True,
+                async_mode=True
+            )
+            _vectorstores[key] = vectorstore
+            logger.info("VectorStore initialized")
 
-        logger.info("VectorStore initialized")
-        return vectorstore, connection_string
+        return vectorstore
 
     except Exception as e:
         logger.error(f"Error initializing vector store: {e}")
-        return None
\ No newline at end of file
+        raise
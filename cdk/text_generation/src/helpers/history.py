@@ -0,0 +1,178 @@
+import os
+import logging
+from typing import List, Sequence
+
+import boto3
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import BaseMessage, messages_from_dict, messages_to_dict
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Messages kept verbatim in the History list; older ones are folded into Summary.
+# The list may grow by HISTORY_TRIM_SLACK messages before a trim is requested, so
+# the summarization call happens once every few turns instead of on every turn.
+HISTORY_WINDOW_MESSAGES = int(os.environ.get("HISTORY_WINDOW_MESSAGES", "12"))
+HISTORY_TRIM_SLACK = int(os.environ.get("HISTORY_TRIM_SLACK", "8"))
+
+SUMMARY_PROMPT = """You are keeping notes on a tutoring conversation between an instructor and a student.
+Update the summary with the new messages. Keep the questions already asked, what the student
+has shown they understand or misunderstand, and anything the instructor promised to come back to.
+Use at most 150 words. ONLY OUTPUT THE UPDATED SUMMARY. NO OTHER TEXT.
+
+Summary so far:
+{summary}
+
+New messages:
+{messages}
+"""
+
+dynamodb_resource = boto3.resource("dynamodb")
+
+class WindowedChatMessageHistory(BaseChatMessageHistory):
+    """
+    Chat history that keeps the last HISTORY_WINDOW_MESSAGES messages plus a rolling summary.
+
+    The session item has the same History list as DynamoDBChatMessageHistory, so
+    other readers of the table keep working, plus:
+    - Summary: a summary of the messages trimmed from History.
+    - MessageCount: the number of messages ever added to the session.
+    - SessionName: the generated session name, read here but written by the naming task.
+
+    Reads and writes only touch the window, so their cost does not grow with the
+    length of the session. New messages are appended with list_append instead of
+    rewriting the whole item. Trimming calls the summarizer, so it is left to a
+    separate invocation: add_messages only sets needs_trim.
+    """
+
+    def __init__(self, table_name: str, session_id: str, summarizer=None):
+        self.table = dynamodb_resource.Table(table_name)
+        self.session_id = session_id
+        self.summarizer = summarizer
+        self._loaded = False
+        self._history: List[dict] = []
+        self.summary = ""
+        self.message_count = 0
+        self.session_name = None
+
+    def load(self) -> None:
+        """
+        Read the window, summary and counters of the session, once.
+        """
+        if self._loaded:
+            return
+        response = self.table.get_item(
+            Key={"SessionId": self.session_id},
+            ProjectionExpression="History, #summary, MessageCount, SessionName",
+            ExpressionAttributeNames={"#summary": "Summary"}
+        )
+        item = response.get("Item", {})
+        self._history = item.get("History", [])
+        self.summary = item.get("Summary", "")
+        self.message_count = int(item.get("MessageCount", len(self._history)))
+        self.session_name = item.get("SessionName")
+        self._loaded = True
+
+    @property
+    def messages(self) -> List[BaseMessage]:
+        """
+        The messages in the window. The summary of older messages is in summary_context.
+        """
+        self.load()
+        return messages_from_dict(self._history)
+
+    @property
+    def summary_context(self) -> str:
+        """
+        The rolling summary as a line for the system prompt, or "" if nothing was trimmed yet.
+
+        Chat models only accept a system message at the start of the conversation, so the
+        summary goes into the prompt's leading system message instead of the history.
+        """
+        self.load()
+        if not self.summary:
+            return ""
+        return f"Summary of the earlier conversation: {self.summary}\n"
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        """
+        Append messages to the session with a single update.
+        """
+        self.load()
+        new_history = messages_to_dict(messages)
+        response = self.table.update_item(
+            Key={"SessionId": self.session_id},
+            UpdateExpression=(
+                "SET History = list_append(if_not_exists(History, :empty), :new), "
+                "MessageCount = if_not_exists(MessageCount, :count) + :added"
+            ),
+            ExpressionAttributeValues={
+                ":empty": [],
+                ":new": new_history,
+                ":count": self.message_count,
+                ":added": len(new_history),
+            },
+            ReturnValues="UPDATED_NEW"
+        )
+        attributes = response.get("Attributes", {})
+        self._history = attributes.get("History", self._history + new_history)
+        self.message_count = int(attributes.get("MessageCount", self.message_count + len(new_history)))
+
+    @property
+    def needs_trim(self) -> bool:
+        """
+        Whether History has outgrown the window by more than HISTORY_TRIM_SLACK messages.
+        """
+        return len(self._history) > HISTORY_WINDOW_MESSAGES + HISTORY_TRIM_SLACK
+
+    def trim(self) -> None:
+        """
+        Fold the messages before the window into the summary and drop them from History.
+        """
+        self.load()
+        overflow = len(self._history) - HISTORY_WINDOW_MESSAGES
+        if overflow <= 0:
+            return
+
+        summary = self.summarize(messages_from_dict(self._history[:overflow]))
+        kept = self._history[overflow:]
+        try:
+            # Only trim if no other request appended in the meantime
+            self.table.update_item(
+                Key={"SessionId": self.session_id},
+                UpdateExpression="SET History = :kept, #summary = :summary",
+                ConditionExpression="size(History) = :size",
+                ExpressionAttributeNames={"#summary": "Summary"},
+                ExpressionAttributeValues={
+                    ":kept": kept,
+                    ":summary": summary,
+                    ":size": len(self._history),
+                }
+            )
+        except self.table.meta.client.exceptions.ConditionalCheckFailedException:
+            logger.info(f"History for session {self.session_id} changed while trimming, skipping.")
+            return
+
+        logger.info(f"Trimmed {overflow} messages from the history of session {self.session_id}")
+        self._history = kept
+        self.summary = summary
+
+    def summarize(self, messages: List[BaseMessage]) -> str:
+        """
+        Return the summary updated with messages. Without a summarizer the old summary is kept.
+        """
+        if self.summarizer is None:
+            return self.summary
+
+        transcript = "\n".join(f"{message.type}: {message.content}" for message in messages)
+        result = self.summarizer.invoke(
+            SUMMARY_PROMPT.format(summary=self.summary or "(none)", messages=transcript)
+        )
+        return getattr(result, "content", result).strip()
+
+    def clear(self) -> None:
+        self.table.delete_item(Key={"SessionId": self.session_id})
+        self._history = []
+        self.summary = ""
+        self.message_count = 0
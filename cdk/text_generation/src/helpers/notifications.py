@@ -0,0 +1,133 @@
+import os
+import json
+import time
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Optional
+
+import httpx
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+APPSYNC_API_URL = os.environ.get("APPSYNC_API_URL")
+# Tokens are sent in batches so a response costs tens of mutations, not hundreds
+STREAM_FLUSH_CHARS = int(os.environ.get("STREAM_FLUSH_CHARS", "48"))
+STREAM_FLUSH_INTERVAL = float(os.environ.get("STREAM_FLUSH_INTERVAL", "0.15"))
+
+SEND_NOTIFICATION_MUTATION = """
+mutation sendNotification($message: String!, $request_id: String!) {
+    sendNotification(message: $message, request_id: $request_id) {
+        message
+        request_id
+    }
+}
+"""
+
+# Reused across invocations so warm requests skip the TLS handshake
+_http_client: Optional[httpx.Client] = None
+# A single worker keeps events in order without blocking token generation
+_sender = ThreadPoolExecutor(max_workers=1)
+
+def get_http_client() -> httpx.Client:
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.Client(timeout=5.0)
+    return _http_client
+
+def send_notification(request_id: str, message: str) -> None:
+    """
+    Publish a message to the subscribers of request_id through the AppSync sendNotification mutation.
+
+    Args:
+    request_id (str): The request ID the client subscribed to with onNotify.
+    message (str): The message to deliver.
+    """
+    headers = {"Content-Type": "application/json", "Authorization": "API_KEY"}
+    payload = {
+        "query": SEND_NOTIFICATION_MUTATION,
+        "variables": {"message": message, "request_id": request_id},
+    }
+    response = get_http_client().post(APPSYNC_API_URL, headers=headers, json=payload)
+    response_data = response.json()
+    if response.status_code != 200 or "errors" in response_data:
+        raise Exception(f"Failed to send notification: {response_data}")
+
+class StreamPublisher:
+    """
+    Sends a streamed LLM response to the client as a sequence of AppSync notifications.
+
+    Each notification message is a JSON event:
+    {"type": "token", "seq": n, "text": "..."} for each batch of tokens, then one
+    {"type": "final", "seq": n, ...} carrying the complete output and verdict. A
+    {"type": "reset", "seq": n} event means the answer is being regenerated and
+    the text received so far should be discarded.
+    The client must subscribe to onNotify(request_id) before calling the endpoint.
+    """
+
+    def __init__(self, request_id: str):
+        self.request_id = request_id
+        self.seq = 0
+        self.buffer: List[str] = []
+        self.buffered_chars = 0
+        self.last_flush = time.monotonic()
+        self.pending: List[Future] = []
+        self.first_token_at: Optional[float] = None
+        self.started_at = time.monotonic()
+
+    def _publish(self, event: dict) -> None:
+        event["seq"] = self.seq
+        self.seq += 1
+        self.pending.append(_sender.submit(send_notification, self.request_id, json.dumps(event)))
+
+    def write(self, text: str) -> None:
+        """
+        Queue text for the client, flushing once enough text or time has accumulated.
+        """
+        if not text:
+            return
+        if self.first_token_at is None:
+            self.first_token_at = time.monotonic()
+            # Send the very first token immediately to minimize time to first token
+            self._publish({"type": "token", "text": text})
+            self.last_flush = time.monotonic()
+            return
+
+        self.buffer.append(text)
+        self.buffered_chars += len(text)
+        if self.buffered_chars >= STREAM_FLUSH_CHARS or time.monotonic() - self.last_flush >= STREAM_FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self) -> None:
+        if self.buffer:
+            self._publish({"type": "token", "text": "".join(self.buffer)})
+            self.buffer = []
+            self.buffered_chars = 0
+        self.last_flush = time.monotonic()
+
+    def reset(self) -> None:
+        """
+        Tell the client to discard the text streamed so far, e.g. before a retry.
+        """
+        self.buffer = []
+        self.buffered_chars = 0
+        # The retry's first token is sent immediately too
+        self.first_token_at = None
+        self._publish({"type": "reset"})
+
+    def close(self, final_event: dict) -> None:
+        """
+        Flush any buffered text, send the final event and wait until every event is delivered.
+        """
+        self.flush()
+        self._publish(dict(final_event, type="final"))
+        for future in self.pending:
+            try:
+                future.result()
+            except Exception as e:
+                logger.error(f"Error sending stream notification for request {self.request_id}: {e}")
+        self.pending = []
+
+        if self.first_token_at is not None:
+            logger.info(f"Time to first token: {self.first_token_at - self.started_at:.3f}s, {self.seq} events sent")
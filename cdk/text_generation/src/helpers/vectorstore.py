@@ -1,38 +1,113 @@
-from typing import Dict
+import os
+import re
+import asyncio
+import hashlib
+import logging
+from collections import Counter
+from typing import Callable, Dict, List, Optional
 
 from langchain_core.vectorstores import VectorStoreRetriever
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_classic.chains import create_history_aware_retriever
+from langchain_core.messages import BaseMessage
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.runnables import RunnableConfig, RunnableLambda
 
-from helpers.helper import get_vectorstore
+from helpers.cache import TTLCache
+from helpers.helper import dispose_engine, get_vectorstore, is_authentication_error, vector_search_params, VECTOR_EF_SEARCH
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Number of chunks returned per retrieval
+RETRIEVER_K = 4
+
+# When to spend an LLM call rewriting the question into a standalone question:
+# "always" on every turn with history, "skip" never, "heuristic" only when the
+# question refers back to the conversation, "cached" always but memoized by
+# (history, question). The heuristic policy memoizes its rewrites too. "always"
+# keeps the original behaviour; the others trade some recall on follow-ups for latency.
+QUESTION_REWRITE_POLICY = os.environ.get("QUESTION_REWRITE_POLICY", "always").lower()
+QUESTION_REWRITE_MIN_HISTORY = int(os.environ.get("QUESTION_REWRITE_MIN_HISTORY", "2"))
+QUESTION_REWRITE_CACHE_SIZE = int(os.environ.get("QUESTION_REWRITE_CACHE_SIZE", "1024"))
+QUESTION_REWRITE_CACHE_TTL = float(os.environ.get("QUESTION_REWRITE_CACHE_TTL", "3600"))
+
+# Words that usually point back to an earlier message
+REFERENTIAL_WORDS = {
+    "it", "its", "it's", "this", "that", "these", "those", "they", "them", "their",
+    "he", "she", "him", "her", "his", "there", "above", "previous", "earlier",
+    "former", "latter", "same", "again", "else", "more", "example", "why",
+}
+
+rewrite_cache = TTLCache(maxsize=QUESTION_REWRITE_CACHE_SIZE, ttl=QUESTION_REWRITE_CACHE_TTL)
+# Per-container counters: turns, no_history, skipped, cache_hit, rewritten
+rewrite_stats = Counter()
 
 def get_vectorstore_retriever(
     llm,
     vectorstore_config_dict: Dict[str, str],
-    embeddings#: BedrockEmbeddings
+    embeddings,#: BedrockEmbeddings
+    rewrite_llm=None,
+    refresh_vectorstore_config: Optional[Callable[[], Dict[str, str]]] = None
 ) -> VectorStoreRetriever:
     """
-    Retrieve the vectorstore and return the history-aware retriever object.
+    Build the history-aware retriever object.
+
+    The retriever is built once and shared by every module: the collection to search
+    is read from config["configurable"]["collection_name"] on each call. If
+    config["configurable"]["query_embedding"] holds a (text, vector) pair for the
+    final search text, the vector is used instead of embedding the text again. The
+    search runs on the async vector store, so call the retriever with ainvoke.
 
     Args:
     llm: The language model instance used to generate the response.
-    vectorstore_config_dict (Dict[str, str]): The configuration dictionary for the vectorstore, including parameters like collection name, database name, user, password, host, and port.
+    vectorstore_config_dict (Dict[str, str]): The configuration dictionary for the vectorstore, including parameters like database name, user, password, host, and port.
     embeddings (BedrockEmbeddings): The embeddings instance used to process the documents.
+    rewrite_llm (optional): A cheaper model for rewriting questions. Defaults to llm.
+    refresh_vectorstore_config (Callable, optional): Fetches the configuration again, e.g. after the database secret was rotated. When the password is rejected, the stale engine is disposed and the search is retried once with the refreshed configuration.
 
     Returns:
     VectorStoreRetriever: A history-aware retriever instance.
     """
-    vectorstore, _ = get_vectorstore(
-        collection_name=vectorstore_config_dict['collection_name'],
-        embeddings=embeddings,
-        dbname=vectorstore_config_dict['dbname'],
-        user=vectorstore_config_dict['user'],
-        password=vectorstore_config_dict['password'],
-        host=vectorstore_config_dict['host'],
-        port=int(vectorstore_config_dict['port'])
-    )
+    async def search(query: str, config: RunnableConfig, vectorstore_config_dict: Dict[str, str]):
+        vectorstore = get_vectorstore(
+            collection_name=config["configurable"]["collection_name"],
+            embeddings=embeddings,
+            dbname=vectorstore_config_dict['dbname'],
+            user=vectorstore_config_dict['user'],
+            password=vectorstore_config_dict['password'],
+            host=vectorstore_config_dict['host'],
+            port=int(vectorstore_config_dict['port'])
+        )
+        vectorstore_retriever = vectorstore.as_retriever(search_kwargs={"k": RETRIEVER_K})
+        # The handler may have embedded the question while it loaded the history
+        query_embedding = config["configurable"].get("query_embedding")
+
+        # ef_search must be at least k or the HNSW scan returns fewer than k results
+        with vector_search_params(ef_search=max(VECTOR_EF_SEARCH, RETRIEVER_K)):
+            if query_embedding is not None and query_embedding[0] == query:
+                return await vectorstore.asimilarity_search_by_vector(query_embedding[1], k=RETRIEVER_K)
+            return await vectorstore_retriever.ainvoke(query, config=config)
 
-    retriever = vectorstore.as_retriever()
+    async def retrieve(query: str, config: RunnableConfig):
+        nonlocal vectorstore_config_dict
+        try:
+            return await search(query, config, vectorstore_config_dict)
+        except Exception as e:
+            if refresh_vectorstore_config is None or not is_authentication_error(e):
+                raise
+            logger.warning("Database password rejected, reconnecting with refreshed credentials.")
+            await dispose_engine(
+                dbname=vectorstore_config_dict['dbname'],
+                user=vectorstore_config_dict['user'],
+                password=vectorstore_config_dict['password'],
+                host=vectorstore_config_dict['host'],
+                port=int(vectorstore_config_dict['port'])
+            )
+            vectorstore_config_dict = await asyncio.to_thread(refresh_vectorstore_config)
+            return await search(query, config, vectorstore_config_dict)
+
+    retriever = RunnableLambda(retrieve)
 
     # Contextualize question and create history-aware retriever
     contextualize_q_system_prompt = (
@@ -40,7 +115,8 @@ def get_vectorstore_retriever(
         "which might reference context in the chat history, "
         "formulate a standalone question which can be understood "
         "without the chat history. Do NOT answer the question, "
-        "just reformulate it if needed and otherwise return it as is."
+        "just reformulate it if needed and otherwise return it as is.\n"
+        "{conversation_summary}"
     )
     contextualize_q_prompt = ChatPromptTemplate.from_messages(
         [
@@ -48,9 +124,84 @@ def get_vectorstore_retriever(
             MessagesPlaceholder("chat_history"),
             ("human", "{input}"),
         ]
-    )
-    history_aware_retriever = create_history_aware_retriever(
-        llm, retriever, contextualize_q_prompt
+    ).partial(conversation_summary="")
+    rewrite_chain = contextualize_q_prompt | (rewrite_llm or llm) | StrOutputParser()
+
+    async def retrieve_with_history(inputs: dict, config: RunnableConfig):
+        query = await get_retrieval_query(inputs, rewrite_chain, config)
+        return await retriever.ainvoke(query, config=config)
+
+    history_aware_retriever = RunnableLambda(retrieve_with_history).with_config(
+        run_name="chat_retriever_chain"
     )
 
-    return history_aware_retriever
\ No newline at end of file
+    return history_aware_retriever
+
+def needs_rewrite(question: str, chat_history: List[BaseMessage]) -> bool:
+    """
+    Guess whether a question can only be understood with the chat history.
+
+    Args:
+    question (str): The latest student message.
+    chat_history (List[BaseMessage]): The conversation so far.
+
+    Returns:
+    bool: True if the question refers back to the conversation and should be rewritten.
+    """
+    if len(chat_history) < QUESTION_REWRITE_MIN_HISTORY:
+        return False
+    words = set(re.findall(r"[a-z']+", question.lower()))
+    return not words.isdisjoint(REFERENTIAL_WORDS)
+
+def get_history_key(question: str, chat_history: List[BaseMessage]) -> str:
+    digest = hashlib.sha256()
+    for message in chat_history:
+        digest.update(f"{message.type}:{message.content}\x00".encode("utf-8"))
+    digest.update(question.encode("utf-8"))
+    return digest.hexdigest()
+
+async def get_retrieval_query(inputs: dict, rewrite_chain, config: RunnableConfig) -> str:
+    """
+    Return the query to search the vectorstore with, rewriting the question only if the policy requires it.
+
+    Args:
+    inputs (dict): The chain inputs, with "input", "chat_history" and optionally "conversation_summary".
+    rewrite_chain: Rewrites the question into a standalone question.
+    config (RunnableConfig): The config of the current run.
+
+    Returns:
+    str: The standalone question.
+    """
+    question = inputs["input"]
+    chat_history = inputs.get("chat_history") or []
+    rewrite_stats["turns"] += 1
+
+    if not chat_history:
+        outcome = "no_history"
+    elif QUESTION_REWRITE_POLICY == "skip":
+        outcome = "skipped"
+    elif QUESTION_REWRITE_POLICY == "heuristic" and not needs_rewrite(question, chat_history):
+        outcome = "skipped"
+    else:
+        outcome = "rewritten"
+
+    if outcome != "rewritten":
+        query = question
+    elif QUESTION_REWRITE_POLICY in ("heuristic", "cached"):
+        key = get_history_key(question, chat_history)
+        query = rewrite_cache.get(key)
+        if query is not None:
+            outcome = "cache_hit"
+        else:
+            query = await rewrite_chain.ainvoke(inputs, config=config)
+            rewrite_cache.set(key, query)
+    else:
+        query = await rewrite_chain.ainvoke(inputs, config=config)
+
+    rewrite_stats[outcome] += 1
+    avoided = rewrite_stats["turns"] - rewrite_stats["rewritten"]
+    logger.info(
+        f"Question rewrite ({QUESTION_REWRITE_POLICY}): {outcome}. "
+        f"Avoided {avoided} of {rewrite_stats['turns']} rewrites in this container, stats: {dict(rewrite_stats)}"
+    )
+    return query
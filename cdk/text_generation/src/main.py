@@ -1,13 +1,21 @@
 import os
 import json
+import time
 import boto3
+import random
+import asyncio
+import hashlib
 import logging
-import boto3
 import psycopg2
+from psycopg_pool import AsyncConnectionPool
 from langchain_aws import BedrockEmbeddings
 
+from helpers.cache import TTLCache
+from helpers.embeddings import CachedQueryEmbeddings
 from helpers.vectorstore import get_vectorstore_retriever
-from helpers.chat import get_bedrock_llm, get_initial_student_query, get_student_query, create_dynamodb_history_table, get_response, update_session_name
+from helpers.chat import FALLBACK_RESPONSE, get_bedrock_llm, get_initial_student_query, get_student_query, create_dynamodb_history_table, get_question_answer_chain, get_response, get_opener_response, generate_session_name, save_session_name
+from helpers.history import WindowedChatMessageHistory
+from helpers.notifications import StreamPublisher
 
 # Set up basic logging
 logging.basicConfig(level=logging.INFO)
@@ -20,25 +28,58 @@ RDS_PROXY_ENDPOINT = os.environ["RDS_PROXY_ENDPOINT"]
 BEDROCK_LLM_PARAM = os.environ["BEDROCK_LLM_PARAM"]
 EMBEDDING_MODEL_PARAM = os.environ["EMBEDDING_MODEL_PARAM"]
 TABLE_NAME_PARAM = os.environ["TABLE_NAME_PARAM"]
+# Optional cheaper Bedrock model for rewriting follow-up questions before retrieval
+QUESTION_REWRITE_MODEL_ID = os.environ.get("QUESTION_REWRITE_MODEL_ID")
+# Greeting prompt, greeting, first student message and the reply to it
+FIRST_EXCHANGE_MESSAGE_COUNT = 4
+# Seconds kept free at the end of an invocation for writing the history
+RESPONSE_TIME_MARGIN = float(os.environ.get("RESPONSE_TIME_MARGIN", "15"))
+METADATA_CACHE_TTL = float(os.environ.get("METADATA_CACHE_TTL", "300"))
+METADATA_CACHE_SIZE = int(os.environ.get("METADATA_CACHE_SIZE", "256"))
+METADATA_VERSION_CHECK = os.environ.get("METADATA_VERSION_CHECK", "true").lower() == "true"
+# Every check is a query per warm container and module, so by default an entry is only
+# revalidated a few times during its TTL; lower it for edits to show up sooner
+METADATA_VERSION_CHECK_INTERVAL = float(os.environ.get("METADATA_VERSION_CHECK_INTERVAL", METADATA_CACHE_TTL / 5))
+# Pre-generated opening turns kept per module; 0 generates every opening turn
+OPENER_POOL_SIZE = int(os.environ.get("OPENER_POOL_SIZE", "3"))
+# Connections kept by each container for the metadata queries
+DB_POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE", "2"))
 
 # AWS Clients
 secrets_manager_client = boto3.client("secretsmanager")
 ssm_client = boto3.client("ssm", region_name=REGION)
 bedrock_runtime = boto3.client("bedrock-runtime", region_name=REGION)
+lambda_client = boto3.client("lambda", region_name=REGION)
 
 # Cached resources
 connection = None
+db_pool = None
 db_secret = None
 BEDROCK_LLM_ID = None
 EMBEDDING_MODEL_ID = None
 TABLE_NAME = None
 
+# Course/module metadata, keyed by (course_id, module_id)
+metadata_cache = TTLCache(maxsize=METADATA_CACHE_SIZE, ttl=METADATA_CACHE_TTL)
+
 # Cached embeddings instance
 embeddings = None
 
-def get_secret(secret_name, expect_json=True):
+# LLM and RAG chain, built once and shared by every course, module and session
+llm = None
+summarizer_llm = None
+history_aware_retriever = None
+question_answer_chain = None
+
+# Set once the parameters, embeddings and history table are ready for this container
+constants_initialized = False
+
+# Reused across invocations so the connection pool and HTTP clients bound to it stay usable
+event_loop = asyncio.new_event_loop()
+
+def get_secret(secret_name, expect_json=True, refresh=False):
     global db_secret
-    if db_secret is None:
+    if db_secret is None or refresh:
         try:
             response = secrets_manager_client.get_secret_value(SecretId=secret_name)["SecretString"]
             db_secret = json.loads(response) if expect_json else response
@@ -64,19 +105,78 @@ def get_parameter(param_name, cached_var):
     return cached_var
 
 def initialize_constants():
-    global BEDROCK_LLM_ID, EMBEDDING_MODEL_ID, TABLE_NAME, embeddings
+    global BEDROCK_LLM_ID, EMBEDDING_MODEL_ID, TABLE_NAME, embeddings, constants_initialized
+    if constants_initialized:
+        return
+
     BEDROCK_LLM_ID = get_parameter(BEDROCK_LLM_PARAM, BEDROCK_LLM_ID)
     EMBEDDING_MODEL_ID = get_parameter(EMBEDDING_MODEL_PARAM, EMBEDDING_MODEL_ID)
     TABLE_NAME = get_parameter(TABLE_NAME_PARAM, TABLE_NAME)
 
     if embeddings is None:
-        embeddings = BedrockEmbeddings(
-            model_id=EMBEDDING_MODEL_ID,
-            client=bedrock_runtime,
-            region_name=REGION,
+        # Opening queries are the same for every student in a module, so query vectors are cached
+        embeddings = CachedQueryEmbeddings(
+            BedrockEmbeddings(
+                model_id=EMBEDDING_MODEL_ID,
+                client=bedrock_runtime,
+                region_name=REGION,
+            ),
+            EMBEDDING_MODEL_ID
         )
     
     create_dynamodb_history_table(TABLE_NAME)
+    constants_initialized = True
+
+def get_vectorstore_config(refresh=False):
+    """
+    Build the vectorstore config from the database secret, fetching the secret again if refresh is set.
+    """
+    db_secret = get_secret(DB_SECRET_NAME, refresh=refresh)
+    return {
+        'dbname': db_secret["dbname"],
+        'user': db_secret["username"],
+        'password': db_secret["password"],
+        'host': RDS_PROXY_ENDPOINT,
+        'port': db_secret["port"]
+    }
+
+def get_rag_chain():
+    """
+    Build the LLM, history-aware retriever and question answering chain once per container.
+    """
+    global llm, history_aware_retriever, question_answer_chain
+    if question_answer_chain is not None:
+        return history_aware_retriever, question_answer_chain
+
+    logger.info("Creating Bedrock LLM instance.")
+    llm = get_bedrock_llm(BEDROCK_LLM_ID)
+
+    logger.info("Retrieving vectorstore config.")
+    vectorstore_config_dict = get_vectorstore_config()
+
+    logger.info("Creating history-aware retriever.")
+    history_aware_retriever = get_vectorstore_retriever(
+        llm=llm,
+        vectorstore_config_dict=vectorstore_config_dict,
+        embeddings=embeddings,
+        rewrite_llm=get_summarizer_llm(),
+        # Rotating the secret must not leave the retriever on a rejected password
+        refresh_vectorstore_config=lambda: get_vectorstore_config(refresh=True)
+    )
+
+    logger.info("Creating question answering chain.")
+    question_answer_chain = get_question_answer_chain(llm)
+    return history_aware_retriever, question_answer_chain
+
+def get_summarizer_llm():
+    """
+    Build the LLM used for rewriting questions and summarizing old history once per container.
+    """
+    global summarizer_llm
+    if summarizer_llm is None:
+        # Both are fine on the cheaper model
+        summarizer_llm = get_bedrock_llm(QUESTION_REWRITE_MODEL_ID or BEDROCK_LLM_ID)
+    return summarizer_llm
 
 def connect_to_db():
     global connection
@@ -101,87 +201,305 @@ def connect_to_db():
             raise
     return connection
 
-def get_module_name(module_id):
-    connection = connect_to_db()
-    if connection is None:
-        logger.error("No database connection available.")
+async def get_db_pool():
+    """
+    Open the container's async connection pool on first use.
+    """
+    global db_pool
+    if db_pool is None:
+        secret = get_secret(DB_SECRET_NAME)
+        connection_params = {
+            'dbname': secret["dbname"],
+            'user': secret["username"],
+            'password': secret["password"],
+            'host': RDS_PROXY_ENDPOINT,
+            'port': secret["port"]
+        }
+        connection_string = " ".join([f"{key}={value}" for key, value in connection_params.items()])
+        pool = AsyncConnectionPool(
+            connection_string,
+            min_size=1,
+            max_size=DB_POOL_MAX_SIZE,
+            kwargs={"autocommit": True},
+            # The proxy may drop idle connections between invocations
+            check=AsyncConnectionPool.check_connection,
+            open=False
+        )
+        await pool.open()
+        db_pool = pool
+        logger.info("Opened the database connection pool!")
+    return db_pool
+
+# Columns that identify the current version of a course/module's metadata. xmin
+# changes whenever a row is updated, and the sibling list changes whenever a module
+# in the course is added, renamed or removed.
+METADATA_VERSION_SQL = """
+    c.xmin::text || ':' || COALESCE(cm.xmin::text, '') || ':' || COALESCE((
+        SELECT md5(string_agg(om.module_id::text || om.xmin::text, ',' ORDER BY om.module_id))
+        FROM "Course_Modules" om
+        INNER JOIN "Course_Concepts" oc ON om.concept_id = oc.concept_id
+        WHERE oc.course_id = c.course_id
+    ), '')
+"""
+
+async def fetch_course_module_metadata(course_id, module_id):
+    """
+    Fetch the course system prompt, module name and sibling module names in one query.
+
+    Returns:
+    dict: The metadata and its version, or None if the course was not found. module_name is None if the module was not found.
+    """
+    try:
+        pool = await get_db_pool()
+        async with pool.connection() as conn:
+            cur = await conn.execute(f"""
+                SELECT
+                    c.system_prompt,
+                    cm.module_name,
+                    ARRAY(
+                        SELECT om.module_name
+                        FROM "Course_Modules" om
+                        INNER JOIN "Course_Concepts" oc ON om.concept_id = oc.concept_id
+                        WHERE oc.course_id = c.course_id AND om.module_id != cm.module_id
+                    ),
+                    {METADATA_VERSION_SQL}
+                FROM "Courses" c
+                LEFT JOIN "Course_Modules" cm ON cm.module_id = %s
+                WHERE c.course_id = %s;
+            """, (module_id, course_id))
+            result = await cur.fetchone()
+
+        if result is None:
+            logger.warning(f"No course found for course_id {course_id}")
+            return None
+
+        system_prompt, module_name, other_modules, version = result
+        logger.info(f"Fetched metadata for course_id {course_id} and module_id {module_id}")
+        return {
+            "system_prompt": system_prompt,
+            "module_name": module_name,
+            "other_modules": list(other_modules),
+            "version": version,
+            "checked_at": time.monotonic()
+        }
+
+    except Exception as e:
+        logger.error(f"Error fetching course/module metadata: {e}")
         return None
-    
+
+async def fetch_course_module_version(course_id, module_id):
+    """
+    Fetch only the version of a course/module's metadata.
+    """
     try:
-        cur = connection.cursor()
+        pool = await get_db_pool()
+        async with pool.connection() as conn:
+            cur = await conn.execute(f"""
+                SELECT {METADATA_VERSION_SQL}
+                FROM "Courses" c
+                LEFT JOIN "Course_Modules" cm ON cm.module_id = %s
+                WHERE c.course_id = %s;
+            """, (module_id, course_id))
+            result = await cur.fetchone()
+        return result[0] if result else None
 
-        cur.execute("""
-            SELECT module_name 
-            FROM "Course_Modules" 
-            WHERE module_id = %s;
-        """, (module_id,))
-        
-        result = cur.fetchone()
-        logger.info(f"Query result: {result}")
-        module_name = result[0] if result else None
-        
-        cur.close()
-        
-        if module_name:
-            logger.info(f"Module name for module_id {module_id} found: {module_name}")
-        else:
-            logger.warning(f"No module name found for module_id {module_id}")
-        
-        return module_name
+    except Exception as e:
+        logger.error(f"Error fetching course/module metadata version: {e}")
+        return None
+
+async def get_course_module_metadata(course_id, module_id):
+    """
+    Return the system prompt, module name and sibling module names for a chat turn.
+
+    Results are cached per container for METADATA_CACHE_TTL seconds. When
+    METADATA_VERSION_CHECK is enabled, a cached entry older than
+    METADATA_VERSION_CHECK_INTERVAL seconds is revalidated with a lightweight
+    version query, so instructor edits show up within that interval instead of the TTL.
 
+    Returns:
+    dict: The metadata, or None if the course was not found.
+    """
+    key = (course_id, module_id)
+    metadata = metadata_cache.get(key)
+
+    if metadata is not None:
+        if not METADATA_VERSION_CHECK or time.monotonic() - metadata["checked_at"] < METADATA_VERSION_CHECK_INTERVAL:
+            return metadata
+        if await fetch_course_module_version(course_id, module_id) == metadata["version"]:
+            metadata["checked_at"] = time.monotonic()
+            return metadata
+        logger.info(f"Metadata for course_id {course_id} and module_id {module_id} changed, refetching")
+        metadata_cache.invalidate(key)
+
+    metadata = await fetch_course_module_metadata(course_id, module_id)
+    if metadata is not None and metadata["module_name"] is not None:
+        metadata_cache.set(key, metadata)
+    return metadata
+
+def get_opener_prompt_hash(system_prompt, student_query):
+    """
+    Identify what an opener was generated from, so pooled openers are not served after the prompt or model changes.
+    """
+    return hashlib.sha256(f"{BEDROCK_LLM_ID}\x00{system_prompt}\x00{student_query}".encode("utf-8")).hexdigest()
+
+async def fetch_module_openers(module_id, prompt_hash):
+    """
+    Fetch the pooled opening turns of a module.
+
+    Returns:
+    list: The openers, or an empty list if there are none or the query failed.
+    """
+    try:
+        pool = await get_db_pool()
+        async with pool.connection() as conn:
+            cur = await conn.execute("""
+                SELECT opener
+                FROM "Module_Openers"
+                WHERE module_id = %s AND prompt_hash = %s
+                ORDER BY variant;
+            """, (module_id, prompt_hash))
+            return [row[0] for row in await cur.fetchall()]
     except Exception as e:
-        logger.error(f"Error fetching module name: {e}")
-        if cur:
-            cur.close()
-        connection.rollback()
+        logger.error(f"Error fetching openers for module_id {module_id}: {e}")
+        return []
+
+async def save_module_opener(module_id, prompt_hash, variant, opener):
+    """
+    Add a generated opening turn to the module's pool and drop openers generated from an older prompt.
+    """
+    try:
+        pool = await get_db_pool()
+        async with pool.connection() as conn:
+            async with conn.transaction():
+                await conn.execute("""
+                    DELETE FROM "Module_Openers"
+                    WHERE module_id = %s AND prompt_hash != %s;
+                """, (module_id, prompt_hash))
+                # Another session may have filled the same variant concurrently
+                await conn.execute("""
+                    INSERT INTO "Module_Openers" (module_id, prompt_hash, variant, opener)
+                    VALUES (%s, %s, %s, %s)
+                    ON CONFLICT (module_id, prompt_hash, variant) DO NOTHING;
+                """, (module_id, prompt_hash, variant, opener))
+        logger.info(f"Saved opener variant {variant} for module_id {module_id}")
+    except Exception as e:
+        logger.error(f"Error saving opener for module_id {module_id}: {e}")
+
+async def embed_query(text):
+    """
+    Embed a retrieval query ahead of time. Failures are only logged, since the
+    retriever embeds the query itself when no vector is available.
+
+    Returns:
+    tuple: (text, vector), or None if the embedding failed.
+    """
+    try:
+        return text, await embeddings.aembed_query(text)
+    except Exception as e:
+        logger.error(f"Error embedding query ahead of retrieval: {e}")
         return None
 
-def get_system_prompt(course_id):
+def request_session_name(session_id):
+    """
+    Name the session in a separate, asynchronous invocation of this function.
+    """
+    lambda_client.invoke(
+        FunctionName=os.environ["AWS_LAMBDA_FUNCTION_NAME"],
+        InvocationType="Event",
+        Payload=json.dumps({"action": "name_session", "session_id": session_id})
+    )
+
+def update_session_name_in_db(session_id, session_name):
     connection = connect_to_db()
     if connection is None:
         logger.error("No database connection available.")
-        return None
-    
+        return
+
+    cur = None
     try:
         cur = connection.cursor()
-        logger.info("Connected to RDS instance!")
-
         cur.execute("""
-            SELECT system_prompt 
-            FROM "Courses" 
-            WHERE course_id = %s;
-        """, (course_id,))
-        
-        result = cur.fetchone()
-        logger.info(f"Query result: {result}")
-        system_prompt = result[0] if result else None
-        
+            UPDATE "Sessions"
+            SET session_name = %s
+            WHERE session_id = %s;
+        """, (session_name, session_id))
+        connection.commit()
         cur.close()
-        
-        if system_prompt:
-            logger.info(f"System prompt for course_id {course_id} found: {system_prompt}")
-        else:
-            logger.warning(f"No system prompt found for course_id {course_id}")
-        
-        return system_prompt
-
     except Exception as e:
-        logger.error(f"Error fetching system prompt: {e}")
         if cur:
             cur.close()
         connection.rollback()
-        return None
+        logger.error(f"Error updating session name in database: {e}")
+        raise
+
+def name_session(session_id):
+    """
+    Generate a name for the session from its first exchange and store it.
+
+    The name is saved on the DynamoDB session item, which the next chat turn returns
+    to the client, and in the Sessions table.
+    """
+    session_name = generate_session_name(TABLE_NAME, session_id, BEDROCK_LLM_ID)
+    if not session_name:
+        logger.info(f"No session name generated for session {session_id}.")
+        return {"statusCode": 200, "body": json.dumps("No session name generated")}
+
+    save_session_name(TABLE_NAME, session_id, session_name)
+    update_session_name_in_db(session_id, session_name)
+    logger.info(f"Session {session_id} named: {session_name}")
+    return {"statusCode": 200, "body": json.dumps({"session_name": session_name})}
+
+def request_history_trim(session_id):
+    """
+    Trim the session's history in a separate, asynchronous invocation of this function.
+    """
+    lambda_client.invoke(
+        FunctionName=os.environ["AWS_LAMBDA_FUNCTION_NAME"],
+        InvocationType="Event",
+        Payload=json.dumps({"action": "trim_history", "session_id": session_id})
+    )
+
+def trim_history(session_id):
+    """
+    Fold the messages before the session's history window into its summary.
+
+    The summarizer call takes seconds, so it runs here instead of before the reply.
+    If the student sends another message meanwhile, the trim is skipped and the
+    next turn requests a new one.
+    """
+    history = WindowedChatMessageHistory(TABLE_NAME, session_id, summarizer=get_summarizer_llm())
+    history.trim()
+    return {"statusCode": 200, "body": json.dumps("History trimmed")}
 
 def handler(event, context):
     logger.info("Text Generation Lambda function is called!")
     initialize_constants()
 
+    # Asynchronous session naming requested by an earlier chat turn
+    if event.get("action") == "name_session":
+        return name_session(event["session_id"])
+
+    # Asynchronous history trimming requested by an earlier chat turn
+    if event.get("action") == "trim_history":
+        return trim_history(event["session_id"])
+
+    return event_loop.run_until_complete(async_handler(event, context))
+
+async def async_handler(event, context):
+    # Stop starting new LLM attempts in time to save the history and return a reply
+    deadline = None
+    if context is not None:
+        deadline = time.monotonic() + context.get_remaining_time_in_millis() / 1000 - RESPONSE_TIME_MARGIN
+
     query_params = event.get("queryStringParameters", {})
 
     course_id = query_params.get("course_id", "")
     session_id = query_params.get("session_id", "")
     module_id = query_params.get("module_id", "")
     session_name = query_params.get("session_name", "New Chat")
+    # When set, the answer is also streamed to AppSync subscribers of onNotify(stream_request_id)
+    stream_request_id = query_params.get("stream_request_id", "")
+    publisher = StreamPublisher(stream_request_id) if stream_request_id else None
 
     if not course_id:
         logger.error("Missing required parameter: course_id")
@@ -222,90 +540,66 @@ def handler(event, context):
             'body': json.dumps('Missing required parameter: module_id')
         }
     
-    system_prompt = get_system_prompt(course_id)
+    body = {} if event.get("body") is None else json.loads(event.get("body"))
+    question = body.get("message_content", "")
 
-    if system_prompt is None:
-        logger.error(f"Error fetching system prompt for course_id: {course_id}")
+    try:
+        retriever, qa_chain = get_rag_chain()
+    except Exception as e:
+        logger.error(f"Error creating RAG chain: {e}")
         return {
-            'statusCode': 400,
+            'statusCode': 500,
             "headers": {
                 "Content-Type": "application/json",
                 "Access-Control-Allow-Headers": "*",
                 "Access-Control-Allow-Origin": "*",
                 "Access-Control-Allow-Methods": "*",
             },
-            'body': json.dumps('Error fetching system prompt')
+            'body': json.dumps('Error creating RAG chain')
         }
-    
-    topic = get_module_name(module_id)
 
-    if topic is None:
-        logger.error(f"Invalid module_id: {module_id}")
-        return {
-            'statusCode': 400,
-            'body': json.dumps('Invalid module_id')
-        }
-    
-    body = {} if event.get("body") is None else json.loads(event.get("body"))
-    question = body.get("message_content", "")
-    
-    if not question:
-        logger.info(f"Start of conversation. Creating conversation history table in DynamoDB.")
-        student_query = get_initial_student_query(topic)
-    else:
+    # The metadata (RDS), the chat history (DynamoDB) and the embedding of the
+    # student's question (Bedrock) do not depend on each other, so they are fetched
+    # concurrently. The initial query depends on the module name, so it is not embedded
+    # early, but it is the same for every student and usually hits the embedding cache.
+    history = WindowedChatMessageHistory(TABLE_NAME, session_id)
+    tasks = [get_course_module_metadata(course_id, module_id), asyncio.to_thread(history.load)]
+    if question:
         logger.info(f"Processing student question: {question}")
         student_query = get_student_query(question)
-    
-    try:
-        logger.info("Creating Bedrock LLM instance.")
-        llm = get_bedrock_llm(BEDROCK_LLM_ID)
-    except Exception as e:
-        logger.error(f"Error getting LLM from Bedrock: {e}")
+        tasks.append(embed_query(student_query))
+    metadata, history_result, *query_embedding = await asyncio.gather(*tasks, return_exceptions=True)
+    query_embedding = query_embedding[0] if query_embedding else None
+
+    if isinstance(metadata, Exception):
+        logger.error(f"Error fetching course/module metadata: {metadata}")
+        metadata = None
+    system_prompt = metadata["system_prompt"] if metadata else None
+
+    if system_prompt is None:
+        logger.error(f"Error fetching system prompt for course_id: {course_id}")
         return {
-            'statusCode': 500,
+            'statusCode': 400,
             "headers": {
                 "Content-Type": "application/json",
                 "Access-Control-Allow-Headers": "*",
                 "Access-Control-Allow-Origin": "*",
                 "Access-Control-Allow-Methods": "*",
             },
-            'body': json.dumps('Error getting LLM from Bedrock')
+            'body': json.dumps('Error fetching system prompt')
         }
     
-    try:
-        logger.info("Retrieving vectorstore config.")
-        db_secret = get_secret(DB_SECRET_NAME)
-        vectorstore_config_dict = {
-            'collection_name': module_id,
-            'dbname': db_secret["dbname"],
-            'user': db_secret["username"],
-            'password': db_secret["password"],
-            'host': RDS_PROXY_ENDPOINT,
-            'port': db_secret["port"]
-        }
-    except Exception as e:
-        logger.error(f"Error retrieving vectorstore config: {e}")
+    topic = metadata["module_name"]
+
+    if topic is None:
+        logger.error(f"Invalid module_id: {module_id}")
         return {
-            'statusCode': 500,
-            "headers": {
-                "Content-Type": "application/json",
-                "Access-Control-Allow-Headers": "*",
-                "Access-Control-Allow-Origin": "*",
-                "Access-Control-Allow-Methods": "*",
-            },
-            'body': json.dumps('Error retrieving vectorstore config')
+            'statusCode': 400,
+            'body': json.dumps('Invalid module_id')
         }
-    
-    try:
-        logger.info("Creating history-aware retriever.")
 
-        history_aware_retriever = get_vectorstore_retriever(
-            llm=llm,
-            vectorstore_config_dict=vectorstore_config_dict,
-            embeddings=embeddings
-        )
-    except Exception as e:
-        logger.error(f"Error creating history-aware retriever: {e}")
+    if isinstance(history_result, Exception):
+        logger.error(f"Error loading chat history: {history_result}")
         return {
             'statusCode': 500,
             "headers": {
@@ -314,29 +608,63 @@ def handler(event, context):
                 "Access-Control-Allow-Origin": "*",
                 "Access-Control-Allow-Methods": "*",
             },
-            'body': json.dumps('Error creating history-aware retriever')
+            'body': json.dumps('Error getting response')
         }
-    
+
+    # Opening turns of new sessions are served from, or added to, the module's opener pool
+    openers = None
+    if not question:
+        logger.info(f"Start of conversation. Creating conversation history table in DynamoDB.")
+        student_query = get_initial_student_query(topic)
+        if OPENER_POOL_SIZE > 0 and history.message_count == 0:
+            prompt_hash = get_opener_prompt_hash(system_prompt, student_query)
+            openers = await fetch_module_openers(module_id, prompt_hash)
+
+    if openers is not None and len(openers) >= OPENER_POOL_SIZE:
+        logger.info(f"Serving a pooled opener for module_id {module_id}.")
+        try:
+            response = await get_opener_response(
+                query=student_query,
+                opener=random.choice(openers),
+                history=history,
+                other_modules=metadata["other_modules"],
+                publisher=publisher
+            )
+        except Exception as e:
+            logger.error(f"Error writing pooled opener to history: {e}")
+            if publisher:
+                publisher.close({"error": "Error getting response"})
+            return {
+                'statusCode': 500,
+                "headers": {
+                    "Content-Type": "application/json",
+                    "Access-Control-Allow-Headers": "*",
+                    "Access-Control-Allow-Origin": "*",
+                    "Access-Control-Allow-Methods": "*",
+                },
+                'body': json.dumps('Error getting response')
+            }
+        return await build_response(response, session_id, session_name, publisher)
+
     try:
         logger.info("Generating response from the LLM.")
-        connection = connect_to_db()
-        if connection is None:
-            logger.error("No database connection available.")
-            raise Exception("No database connection available.")
-        response = get_response(
+        response = await get_response(
             query=student_query,
             topic=topic,
-            llm=llm,
-            history_aware_retriever=history_aware_retriever,
-            table_name=TABLE_NAME,
-            session_id=session_id,
+            question_answer_chain=qa_chain,
+            history_aware_retriever=retriever,
+            history=history,
+            collection_name=module_id,
             course_system_prompt=system_prompt,
-            course_id=course_id,
-            module_id=module_id,
-            connection=connection
+            other_modules=metadata["other_modules"],
+            deadline=deadline,
+            publisher=publisher,
+            query_embedding=query_embedding
         )
     except Exception as e:
         logger.error(f"Error getting response: {e}")
+        if publisher:
+            publisher.close({"error": "Error getting response"})
         return {
             'statusCode': 500,
             "headers": {
@@ -348,17 +676,41 @@ def handler(event, context):
             'body': json.dumps('Error getting response')
         }
     
-    try:
-        logger.info("Updating session name if this is the first exchange between the LLM and student")
-        potential_session_name = update_session_name(TABLE_NAME, session_id, BEDROCK_LLM_ID)
-        if potential_session_name:
-            logger.info("This is the first exchange between the LLM and student. Updating session name.")
-            session_name = potential_session_name
-        else:
-            logger.info("Not the first exchange between the LLM and student. Session name remains the same.")
-    except Exception as e:
-        logger.error(f"Error updating session name: {e}")
-        session_name = "New Chat"
+    if openers is not None and not response.get("llm_verdict") and response.get("llm_output") not in (None, FALLBACK_RESPONSE):
+        await save_module_opener(module_id, prompt_hash, len(openers), response["llm_output"])
+
+    return await build_response(response, session_id, session_name, publisher)
+
+async def build_response(response, session_id, session_name, publisher=None):
+    """
+    Finish the stream, request a session name after the first exchange or a history trim
+    when the window overflows, and build the API response.
+
+    The requests are blocking Lambda invocations, so they run in worker threads.
+    """
+    if publisher:
+        publisher.close({
+            "llm_output": response.get("llm_output", "LLM failed to create response"),
+            "llm_verdict": response.get("llm_verdict", "LLM failed to create verdict")
+        })
+
+    # A name generated after an earlier turn takes precedence over the one the client sent
+    if response.get("session_name"):
+        session_name = response["session_name"]
+
+    if response.get("message_count") == FIRST_EXCHANGE_MESSAGE_COUNT:
+        logger.info("This is the first exchange between the LLM and student. Requesting a session name.")
+        try:
+            await asyncio.to_thread(request_session_name, session_id)
+        except Exception as e:
+            logger.error(f"Error requesting session name: {e}")
+
+    if response.get("needs_trim"):
+        try:
+            await asyncio.to_thread(request_history_trim, session_id)
+        except Exception as e:
+            # Requested again after the next turn
+            logger.error(f"Error requesting history trim: {e}")
     
     logger.info("Returning the generated response.")
     return {
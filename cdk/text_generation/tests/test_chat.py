@@ -0,0 +1,153 @@
+"""
+Tests for the prompts of the question answering and question rewrite chains, with a
+model that records the messages it is sent.
+
+Run from cdk/text_generation with the Lambda's requirements installed:
+    python -m pytest tests
+"""
+import os
+import sys
+import asyncio
+
+from langchain_core.documents import Document
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, messages_to_dict
+from langchain_core.runnables import RunnableLambda
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "ca-central-1")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from helpers import history, vectorstore
+from helpers.chat import get_question_answer_chain
+from helpers.history import WindowedChatMessageHistory
+from helpers.vectorstore import get_vectorstore_retriever
+
+WINDOW = [
+    HumanMessage(content="What is a binary search tree?"),
+    AIMessage(content="A tree where every node's left subtree holds smaller keys. What is a leaf?"),
+]
+
+class FakeTable:
+    def __init__(self, item):
+        self.item = item
+
+    def get_item(self, Key, ProjectionExpression, ExpressionAttributeNames):
+        return {"Item": self.item}
+
+class FakeDynamoDB:
+    def __init__(self, item):
+        self.item = item
+
+    def Table(self, name):
+        return FakeTable(self.item)
+
+class RecordingModel:
+    """
+    Stands in for the chat model: records each prompt and answers with a fixed reply.
+    """
+
+    def __init__(self, reply="An answer."):
+        self.reply = reply
+        self.prompts = []
+
+    def runnable(self):
+        def answer(prompt_value):
+            self.prompts.append(prompt_value.to_messages())
+            return AIMessage(content=self.reply)
+        return RunnableLambda(answer)
+
+def load_history(monkeypatch, summary):
+    item = {"History": messages_to_dict(WINDOW), "MessageCount": 20}
+    if summary:
+        item["Summary"] = summary
+    monkeypatch.setattr(history, "dynamodb_resource", FakeDynamoDB(item))
+    return WindowedChatMessageHistory("history", "session")
+
+def qa_inputs(chat_history, **overrides):
+    inputs = {
+        "input": "Is a leaf a node without children?",
+        "chat_history": chat_history.messages,
+        "conversation_summary": chat_history.summary_context,
+        "topic": "Trees",
+        "course_system_prompt": "Be encouraging. ",
+        "context": [Document(page_content="A leaf is a node with no children.")],
+    }
+    inputs.update(overrides)
+    return inputs
+
+def test_history_keeps_the_summary_out_of_the_messages(monkeypatch):
+    chat_history = load_history(monkeypatch, "The student asked about trees.")
+
+    assert chat_history.messages == WINDOW
+    assert chat_history.summary_context == "Summary of the earlier conversation: The student asked about trees.\n"
+    assert load_history(monkeypatch, None).summary_context == ""
+
+def test_summary_is_part_of_the_leading_system_message(monkeypatch):
+    chat_history = load_history(monkeypatch, "The student asked about trees.")
+    model = RecordingModel()
+
+    asyncio.run(get_question_answer_chain(model.runnable()).ainvoke(qa_inputs(chat_history)))
+
+    messages = model.prompts[0]
+    assert isinstance(messages[0], SystemMessage)
+    assert "Summary of the earlier conversation: The student asked about trees." in messages[0].content
+    # Only the first message is a system message, as the Anthropic message format requires
+    assert not any(isinstance(message, SystemMessage) for message in messages[1:])
+    assert messages[1:] == WINDOW + [HumanMessage(content="Is a leaf a node without children?")]
+
+def test_rewrite_prompt_sees_the_summary(monkeypatch):
+    monkeypatch.setattr(vectorstore, "QUESTION_REWRITE_POLICY", "always")
+
+    class FakeVectorStore:
+        def as_retriever(self, search_kwargs):
+            return RunnableLambda(lambda query: [Document(page_content=f"found for {query}")])
+
+    monkeypatch.setattr(vectorstore, "get_vectorstore", lambda **kwargs: FakeVectorStore())
+    chat_history = load_history(monkeypatch, "The student asked about trees.")
+    rewriter = RecordingModel("Is a leaf of a binary search tree a node without children?")
+    retriever = get_vectorstore_retriever(
+        None,
+        {"dbname": "db", "user": "user", "password": "password", "host": "localhost", "port": "5432"},
+        embeddings=None,
+        rewrite_llm=rewriter.runnable(),
+    )
+
+    documents = asyncio.run(retriever.ainvoke(qa_inputs(chat_history), config={"configurable": {"collection_name": "module"}}))
+
+    assert documents[0].page_content == "found for Is a leaf of a binary search tree a node without children?"
+    messages = rewriter.prompts[0]
+    assert isinstance(messages[0], SystemMessage)
+    assert "The student asked about trees." in messages[0].content
+    assert not any(isinstance(message, SystemMessage) for message in messages[1:])
+
+def test_shared_chain_renders_each_request_with_its_own_course(monkeypatch):
+    chat_history = load_history(monkeypatch, None)
+    model = RecordingModel()
+    # Built once per container, as get_rag_chain does, and shared by every course and module
+    chain = get_question_answer_chain(model.runnable())
+    requests = [
+        qa_inputs(chat_history, topic="Trees", course_system_prompt="Be encouraging. "),
+        qa_inputs(
+            chat_history,
+            topic="Sorting",
+            course_system_prompt="Answer in French. ",
+            context=[Document(page_content="Merge sort runs in O(n log n).")],
+        ),
+    ]
+
+    async def run():
+        return await asyncio.gather(*(chain.ainvoke(inputs) for inputs in requests))
+
+    asyncio.run(run())
+    asyncio.run(chain.ainvoke(requests[0]))
+
+    system_messages = sorted((messages[0].content for messages in model.prompts), key=lambda content: "Sorting" in content)
+    trees, trees_again, sorting = system_messages
+    assert trees == trees_again
+    assert "master the topic: Trees. \nBe encouraging. Continue" in trees
+    assert "A leaf is a node with no children." in trees
+    assert "master the topic: Sorting. \nAnswer in French. Continue" in sorting
+    assert "Merge sort runs in O(n log n)." in sorting
+    for leaked in ("Sorting", "French", "Merge sort"):
+        assert leaked not in trees
+    for leaked in ("Trees", "encouraging", "leaf"):
+        assert leaked not in sorting
@@ -0,0 +1,124 @@
+"""
+Cold start and warm path of the text generation handler with the AWS layer replaced by
+fakes that answer after BENCHMARK_AWS_LATENCY_MS, standing in for the control plane
+round trips of SSM and DynamoDB.
+
+The request carries no course_id, so the handler answers right after initializing the
+container and the measured time is the overhead every request pays before the chat
+turn starts. Run with -s to see the timings:
+    python -m pytest tests/test_cold_start.py -s
+"""
+import os
+import sys
+import time
+import subprocess
+import statistics
+
+import pytest
+
+ENVIRONMENT = {
+    "AWS_DEFAULT_REGION": "ca-central-1",
+    "SM_DB_CREDENTIALS": "test-secret",
+    "REGION": "ca-central-1",
+    "RDS_PROXY_ENDPOINT": "localhost",
+    "BEDROCK_LLM_PARAM": "test-llm",
+    "EMBEDDING_MODEL_PARAM": "test-embedding",
+    "TABLE_NAME_PARAM": "test-table",
+    "AWS_LAMBDA_FUNCTION_NAME": "text-generation",
+}
+for name, value in ENVIRONMENT.items():
+    os.environ.setdefault(name, value)
+SRC = os.path.join(os.path.dirname(__file__), "..", "src")
+sys.path.insert(0, SRC)
+
+import main
+from helpers import chat
+
+AWS_LATENCY = int(os.environ.get("BENCHMARK_AWS_LATENCY_MS", "20")) / 1000
+REPEATS = 20
+EVENT = {"queryStringParameters": {}}
+
+class FakeSSM:
+    def __init__(self, calls):
+        self.calls = calls
+
+    def get_parameter(self, Name, WithDecryption):
+        time.sleep(AWS_LATENCY)
+        self.calls.append(("get_parameter", Name))
+        return {"Parameter": {"Value": f"value-of-{Name}"}}
+
+class FakeDynamoDBClient:
+    class exceptions:
+        class ResourceNotFoundException(Exception):
+            pass
+
+    def __init__(self, calls):
+        self.calls = calls
+
+    def describe_table(self, TableName):
+        time.sleep(AWS_LATENCY)
+        self.calls.append(("describe_table", TableName))
+        return {"Table": {"TableName": TableName, "TableStatus": "ACTIVE"}}
+
+class FakeBoto3:
+    def __init__(self, calls):
+        self.calls = calls
+
+    def client(self, service_name, **kwargs):
+        assert service_name == "dynamodb"
+        return FakeDynamoDBClient(self.calls)
+
+@pytest.fixture
+def aws_calls(monkeypatch):
+    """
+    A cold container: nothing initialized and every AWS call recorded.
+    """
+    calls = []
+    monkeypatch.setattr(main, "ssm_client", FakeSSM(calls))
+    monkeypatch.setattr(chat, "boto3", FakeBoto3(calls))
+    for name in ("BEDROCK_LLM_ID", "EMBEDDING_MODEL_ID", "TABLE_NAME", "embeddings"):
+        monkeypatch.setattr(main, name, None)
+    monkeypatch.setattr(main, "constants_initialized", False)
+    monkeypatch.setattr(chat, "_ready_history_tables", set())
+    return calls
+
+def time_ms(function):
+    start = time.perf_counter()
+    result = function()
+    return (time.perf_counter() - start) * 1000, result
+
+def test_warm_requests_skip_the_bootstrap(aws_calls):
+    cold_time, response = time_ms(lambda: main.handler(EVENT, None))
+    assert response["statusCode"] == 400
+    cold_calls = list(aws_calls)
+
+    warm_times = [time_ms(lambda: main.handler(EVENT, None))[0] for _ in range(REPEATS)]
+
+    print(
+        f"\nFirst request {cold_time:.1f} ms with {len(cold_calls)} AWS calls of {AWS_LATENCY * 1000:.0f} ms, "
+        f"warm requests median {statistics.median(warm_times):.2f} ms"
+    )
+    assert cold_calls == [
+        ("get_parameter", "test-llm"),
+        ("get_parameter", "test-embedding"),
+        ("get_parameter", "test-table"),
+        ("describe_table", "value-of-test-table"),
+    ]
+    # Warm invocations make no control plane calls at all
+    assert aws_calls == cold_calls
+    assert max(warm_times) < AWS_LATENCY * 1000
+
+def test_import_time():
+    """
+    Time to import the handler module in a fresh interpreter, as on a cold start.
+    """
+    script = "import time; start = time.perf_counter(); import main; print((time.perf_counter() - start) * 1000)"
+    times = []
+    for _ in range(3):
+        result = subprocess.run(
+            [sys.executable, "-c", script],
+            cwd=SRC, env={**os.environ, **ENVIRONMENT}, capture_output=True, text=True, check=True
+        )
+        times.append(float(result.stdout.strip().splitlines()[-1]))
+
+    print(f"\nImporting main: median {statistics.median(times):.0f} ms over {len(times)} fresh interpreters")
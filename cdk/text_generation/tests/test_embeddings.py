@@ -0,0 +1,114 @@
+"""
+Tests for the query embedding cache, with a counting fake model and a fake DynamoDB table
+in place of the shared cache.
+
+Run from cdk/text_generation with the Lambda's requirements installed:
+    python -m pytest tests
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+
+from langchain_core.embeddings import Embeddings
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "ca-central-1")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from helpers import embeddings as query_embeddings
+from helpers.cache import TTLCache
+from helpers.embeddings import CachedQueryEmbeddings
+
+class CountingEmbeddings(Embeddings):
+    def __init__(self):
+        self.queries = []
+
+    def embed_query(self, text):
+        self.queries.append(text)
+        return [float(len(text)), 0.5]
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+class FakeTable:
+    def __init__(self):
+        self.items = {}
+
+    def get_item(self, Key):
+        item = self.items.get(Key["CacheKey"])
+        return {"Item": item} if item is not None else {}
+
+    def put_item(self, Item):
+        self.items[Item["CacheKey"]] = Item
+
+def test_local_hits_and_misses():
+    model = CountingEmbeddings()
+    cached = CachedQueryEmbeddings(model, "model")
+
+    assert cached.embed_query("What is a leaf?") == [15.0, 0.5]
+    # Whitespace differences share the entry
+    assert cached.embed_query("  What is  a leaf? ") == [15.0, 0.5]
+    assert asyncio.run(cached.aembed_query("What is a leaf?")) == [15.0, 0.5]
+    cached.embed_query("What is a root?")
+
+    assert model.queries == ["What is a leaf?", "What is a root?"]
+    stats = cached.get_stats()
+    assert (stats["local_hit"], stats["miss"], stats["lookups"]) == (2, 2, 4)
+    assert stats["hit_rate"] == 0.5
+
+def test_local_entries_expire():
+    model = CountingEmbeddings()
+    cached = CachedQueryEmbeddings(model, "model")
+    cached.local_cache = TTLCache(maxsize=10, ttl=0.05)
+
+    cached.embed_query("What is a leaf?")
+    cached.embed_query("What is a leaf?")
+    time.sleep(0.1)
+    cached.embed_query("What is a leaf?")
+
+    assert model.queries == ["What is a leaf?", "What is a leaf?"]
+    assert (cached.stats["local_hit"], cached.stats["miss"]) == (1, 2)
+
+def test_shared_cache_is_used_by_other_containers_until_it_expires():
+    model = CountingEmbeddings()
+    table = FakeTable()
+    first, second = CachedQueryEmbeddings(model, "model"), CachedQueryEmbeddings(model, "model")
+    first.table = second.table = table
+
+    first.embed_query("What is a leaf?")
+    assert second.embed_query("What is a leaf?") == [15.0, 0.5]
+    assert second.stats["shared_hit"] == 1
+    assert model.queries == ["What is a leaf?"]
+
+    # DynamoDB may still return an item after its TTL
+    for item in table.items.values():
+        item["ExpiresAt"] = int(time.time()) - 1
+    third = CachedQueryEmbeddings(model, "model")
+    third.table = table
+    third.embed_query("What is a leaf?")
+    assert third.stats["miss"] == 1
+    assert model.queries == ["What is a leaf?", "What is a leaf?"]
+
+def test_models_do_not_share_entries():
+    model = CountingEmbeddings()
+    table = FakeTable()
+    first, second = CachedQueryEmbeddings(model, "model-a"), CachedQueryEmbeddings(model, "model-b")
+    first.table = second.table = table
+
+    first.embed_query("What is a leaf?")
+    second.embed_query("What is a leaf?")
+
+    assert len(model.queries) == 2
+
+def test_hit_rate_is_logged_periodically(monkeypatch, caplog):
+    monkeypatch.setattr(query_embeddings, "EMBEDDING_CACHE_LOG_EVERY", 3)
+    cached = CachedQueryEmbeddings(CountingEmbeddings(), "model")
+
+    with caplog.at_level(logging.INFO, logger=query_embeddings.logger.name):
+        for _ in range(7):
+            cached.embed_query("What is a leaf?")
+
+    messages = [record.getMessage() for record in caplog.records if record.levelno == logging.INFO]
+    assert len(messages) == 2
+    assert messages[0].startswith("Query embedding cache hit rate 66.7% over 3 lookups")
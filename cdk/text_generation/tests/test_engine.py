@@ -0,0 +1,115 @@
+"""
+Tests for the container's shared database engines: one per set of credentials, and
+rebuilt with refreshed credentials when the password is rejected after a rotation.
+
+Run from cdk/text_generation with the Lambda's requirements installed:
+    python -m pytest tests
+"""
+import os
+import sys
+import asyncio
+
+import pytest
+from langchain_core.documents import Document
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableLambda
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "ca-central-1")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from helpers import helper, vectorstore
+from helpers.vectorstore import get_vectorstore_retriever
+
+# The questions have no history, so they are never rewritten
+LLM = RunnableLambda(lambda prompt_value: AIMessage(content="unused"))
+CONFIG = {"dbname": "db", "user": "user", "password": "first", "host": "localhost", "port": "5432"}
+
+@pytest.fixture(autouse=True)
+def registries():
+    yield
+    helper._engines.clear()
+    helper._vectorstores.clear()
+
+class FakeVectorStore:
+    def __init__(self, password):
+        self.password = password
+
+    def as_retriever(self, search_kwargs):
+        return RunnableLambda(lambda query: [Document(page_content=f"found with {self.password}")])
+
+def rotated_database(monkeypatch, password):
+    """
+    Fakes a database that only accepts password, recording the engines that get disposed.
+    """
+    disposed = []
+
+    def get_vectorstore(**kwargs):
+        if kwargs["password"] != password:
+            raise Exception(f'connection failed: FATAL:  password authentication failed for user "{kwargs["user"]}"')
+        return FakeVectorStore(kwargs["password"])
+
+    async def dispose_engine(**kwargs):
+        disposed.append(kwargs["password"])
+
+    monkeypatch.setattr(vectorstore, "get_vectorstore", get_vectorstore)
+    monkeypatch.setattr(vectorstore, "dispose_engine", dispose_engine)
+    return disposed
+
+def retrieve(retriever):
+    return asyncio.run(retriever.ainvoke(
+        {"input": "What is a leaf?", "chat_history": []},
+        config={"configurable": {"collection_name": "module"}}
+    ))
+
+def test_engines_are_shared_per_credentials():
+    engine = helper.get_engine(**{**CONFIG, "port": 5432})
+
+    assert helper.get_engine(**{**CONFIG, "port": 5432}) is engine
+    assert helper.get_engine(**{**CONFIG, "port": 5432, "password": "second"}) is not engine
+
+def test_disposing_forgets_the_engine_and_its_vectorstores():
+    credentials = {**CONFIG, "port": 5432}
+    engine = helper.get_engine(**credentials)
+    helper.get_vectorstore(collection_name="module", embeddings=None, **credentials)
+    other = helper.get_vectorstore(collection_name="module", embeddings=None, **{**credentials, "password": "second"})
+
+    asyncio.run(helper.dispose_engine(**credentials))
+
+    assert helper.get_engine(**credentials) is not engine
+    assert list(helper._vectorstores.values()) == [other]
+
+def test_rejected_password_is_refreshed_once(monkeypatch):
+    disposed = rotated_database(monkeypatch, "second")
+    refreshes = []
+
+    def refresh():
+        refreshes.append(True)
+        return {**CONFIG, "password": "second"}
+
+    retriever = get_vectorstore_retriever(LLM, dict(CONFIG), embeddings=None, refresh_vectorstore_config=refresh)
+
+    assert retrieve(retriever)[0].page_content == "found with second"
+    assert disposed == ["first"]
+    # Later requests use the refreshed credentials straight away
+    assert retrieve(retriever)[0].page_content == "found with second"
+    assert len(refreshes) == 1
+
+def test_other_errors_are_not_retried(monkeypatch):
+    disposed = rotated_database(monkeypatch, "first")
+
+    def get_vectorstore(**kwargs):
+        raise Exception("could not connect to server")
+
+    monkeypatch.setattr(vectorstore, "get_vectorstore", get_vectorstore)
+    retriever = get_vectorstore_retriever(LLM, dict(CONFIG), embeddings=None, refresh_vectorstore_config=lambda: pytest.fail("refreshed"))
+
+    with pytest.raises(Exception, match="could not connect"):
+        retrieve(retriever)
+    assert not disposed
+
+def test_without_refresh_the_error_is_raised(monkeypatch):
+    rotated_database(monkeypatch, "second")
+    retriever = get_vectorstore_retriever(LLM, dict(CONFIG), embeddings=None)
+
+    with pytest.raises(Exception, match="password authentication failed"):
+        retrieve(retriever)
@@ -0,0 +1,93 @@
+"""
+Tests for streaming answers through StreamPublisher, with a fake chat model that streams
+its tokens slowly and a fake AppSync mutation that records what is published and when.
+
+Run from cdk/text_generation with the Lambda's requirements installed:
+    python -m pytest tests
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import threading
+from typing import List
+
+from langchain_core.documents import Document
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "ca-central-1")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from helpers import notifications
+from helpers.chat import generate_response, get_question_answer_chain
+from helpers.notifications import StreamPublisher
+
+TOKENS = ["A ", "leaf ", "is ", "a ", "node ", "with ", "no ", "children. ", "What ", "is ", "its ", "depth?"]
+TOKEN_DELAY = 0.05
+
+class SlowStreamingModel(BaseChatModel):
+    """
+    Streams TOKENS one at a time, TOKEN_DELAY seconds apart, and records when it finished.
+    """
+
+    tokens: List[str]
+    delay: float
+    finished_at: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "slow-streaming"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(self.tokens)))])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        for token in self.tokens:
+            await asyncio.sleep(self.delay)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+        self.finished_at = time.monotonic()
+
+def record_notifications(monkeypatch):
+    sent = []
+    lock = threading.Lock()
+
+    def send_notification(request_id, message):
+        with lock:
+            sent.append((time.monotonic(), json.loads(message)))
+
+    monkeypatch.setattr(notifications, "send_notification", send_notification)
+    return sent
+
+def test_first_token_is_published_before_the_answer_completes(monkeypatch):
+    sent = record_notifications(monkeypatch)
+    model = SlowStreamingModel(tokens=TOKENS, delay=TOKEN_DELAY)
+    publisher = StreamPublisher("request")
+    inputs = {
+        "input": "What is a leaf?",
+        "chat_history": [],
+        "conversation_summary": "",
+        "topic": "Trees",
+        "course_system_prompt": "",
+        "context": [Document(page_content="A leaf is a node with no children.")],
+    }
+
+    answer = asyncio.run(generate_response(get_question_answer_chain(model), inputs, {}, publisher))
+    publisher.close({"llm_output": answer, "llm_verdict": False})
+
+    first_sent_at, first_event = sent[0]
+    assert first_event["type"] == "token" and first_event["seq"] == 0
+    assert "".join(TOKENS).startswith(first_event["text"])
+    # The competency filter holds back the length of its marker, so the first text goes
+    # out a few tokens in, while the model still has several tokens to stream
+    assert first_sent_at < model.finished_at - 4 * TOKEN_DELAY
+    assert publisher.first_token_at - publisher.started_at < model.finished_at - publisher.started_at
+
+    events = [event for _, event in sent]
+    assert [event["seq"] for event in events] == list(range(len(events)))
+    assert "".join(event["text"] for event in events if event["type"] == "token") == answer == "".join(TOKENS)
+    assert events[-1] == {"type": "final", "seq": len(events) - 1, "llm_output": answer, "llm_verdict": False}
+    # The remaining tokens are batched
+    assert len(events) < len(TOKENS) + 1
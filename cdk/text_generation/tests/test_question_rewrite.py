@@ -0,0 +1,94 @@
+"""
+Tests for the question rewrite policies of the history-aware retriever.
+
+Run from cdk/text_generation with the Lambda's requirements installed:
+    python -m pytest tests
+"""
+import os
+import sys
+import asyncio
+from collections import Counter
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from helpers import vectorstore
+from helpers.cache import TTLCache
+from helpers.vectorstore import get_retrieval_query, needs_rewrite
+
+HISTORY = [
+    HumanMessage(content="What is a binary search tree?"),
+    AIMessage(content="A tree where every node's left subtree holds smaller keys and its right subtree larger ones."),
+]
+
+class FakeRewriteChain:
+    """
+    Rewrites a question by prefixing it, counting the calls.
+    """
+
+    def __init__(self):
+        self.calls = 0
+
+    async def ainvoke(self, inputs, config=None):
+        self.calls += 1
+        return f"standalone: {inputs['input']}"
+
+@pytest.fixture(autouse=True)
+def fresh_cache(monkeypatch):
+    monkeypatch.setattr(vectorstore, "rewrite_cache", TTLCache(maxsize=16, ttl=60))
+    monkeypatch.setattr(vectorstore, "rewrite_stats", Counter())
+
+def retrieval_query(question, chat_history, chain):
+    return asyncio.run(get_retrieval_query({"input": question, "chat_history": chat_history}, chain, {}))
+
+def test_needs_rewrite():
+    assert needs_rewrite("Why is it balanced?", HISTORY)
+    assert needs_rewrite("Can you give an example?", HISTORY)
+    assert not needs_rewrite("How does quicksort partition an array?", HISTORY)
+    # Too little history to refer back to
+    assert not needs_rewrite("Why is it balanced?", HISTORY[:1])
+
+def test_always_rewrites_every_turn_with_history(monkeypatch):
+    monkeypatch.setattr(vectorstore, "QUESTION_REWRITE_POLICY", "always")
+    chain = FakeRewriteChain()
+
+    assert retrieval_query("How does quicksort partition an array?", HISTORY, chain) == "standalone: How does quicksort partition an array?"
+    assert retrieval_query("How does quicksort partition an array?", HISTORY, chain) == "standalone: How does quicksort partition an array?"
+    assert chain.calls == 2
+
+def test_no_history_is_never_rewritten(monkeypatch):
+    monkeypatch.setattr(vectorstore, "QUESTION_REWRITE_POLICY", "always")
+    chain = FakeRewriteChain()
+
+    assert retrieval_query("Why is it balanced?", [], chain) == "Why is it balanced?"
+    assert chain.calls == 0
+    assert vectorstore.rewrite_stats["no_history"] == 1
+
+def test_skip_never_rewrites(monkeypatch):
+    monkeypatch.setattr(vectorstore, "QUESTION_REWRITE_POLICY", "skip")
+    chain = FakeRewriteChain()
+
+    assert retrieval_query("Why is it balanced?", HISTORY, chain) == "Why is it balanced?"
+    assert chain.calls == 0
+
+def test_heuristic_rewrites_only_follow_ups_and_memoizes(monkeypatch):
+    monkeypatch.setattr(vectorstore, "QUESTION_REWRITE_POLICY", "heuristic")
+    chain = FakeRewriteChain()
+
+    assert retrieval_query("How does quicksort partition an array?", HISTORY, chain) == "How does quicksort partition an array?"
+    assert retrieval_query("Why is it balanced?", HISTORY, chain) == "standalone: Why is it balanced?"
+    assert retrieval_query("Why is it balanced?", HISTORY, chain) == "standalone: Why is it balanced?"
+    assert chain.calls == 1
+    assert vectorstore.rewrite_stats == Counter({"turns": 3, "skipped": 1, "rewritten": 1, "cache_hit": 1})
+
+def test_cached_memoizes_by_history_and_question(monkeypatch):
+    monkeypatch.setattr(vectorstore, "QUESTION_REWRITE_POLICY", "cached")
+    chain = FakeRewriteChain()
+
+    retrieval_query("How does quicksort partition an array?", HISTORY, chain)
+    retrieval_query("How does quicksort partition an array?", HISTORY, chain)
+    # Same question after a different conversation
+    retrieval_query("How does quicksort partition an array?", HISTORY[:1], chain)
+    assert chain.calls == 2